@@ -0,0 +1,60 @@
+"""
+Compare the fast timestamp handling in the Atom serialization
+with the strptime and rfc3339_date path it replaced.
+
+Run from the top of the package with:
+
+    python -m bench.bench_dates
+"""
+
+import datetime
+import time
+import timeit
+
+from feedgenerator import rfc3339_date
+
+from tiddlywebplugins.atom.feed import Serialization
+
+
+ENTRIES = 10000
+DISTINCT_TIMESTAMPS = 200
+
+
+def timestamps():
+    """
+    A feed's worth of created and modified timestamps, with
+    the repetition found in real collections.
+    """
+    distinct = ['2012%02d%02d%02d%02d00' % (1 + index % 12, 1 + index % 28,
+        index % 24, index % 60) for index in range(DISTINCT_TIMESTAMPS)]
+    return distinct * (ENTRIES // DISTINCT_TIMESTAMPS)
+
+
+def strptime_path(stamps):
+    for stamp in stamps:
+        # _add_item parsed created once and modified twice
+        for _ in range(3):
+            date = datetime.datetime(*(time.strptime(
+                stamp, '%Y%m%d%H%M%S')[0:6]))
+        # and add_item_elements formatted updated and published
+        for _ in range(2):
+            rfc3339_date(date).decode('utf-8')
+
+
+def fast_path(stamps):
+    serialization = Serialization({})
+    for stamp in stamps:
+        for _ in range(2):
+            serialization._tiddler_date(stamp)
+
+
+def main():
+    stamps = timestamps()
+    for name, func in [('strptime', strptime_path), ('fast', fast_path)]:
+        elapsed = min(timeit.repeat(lambda: func(stamps), number=1, repeat=3))
+        print('%-10s %8.4fs %10.0f entries/s' % (name, elapsed,
+            len(stamps) / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Compare the memory and time used to hold feed entries as the
+per item dicts feedgenerator uses and as Entry records.
+
+Run from the top of the package with:
+
+    python -m bench.bench_entries
+"""
+
+import datetime
+import gc
+import sys
+import timeit
+
+from tiddlywebplugins.atom.feed import AtomFeed
+
+
+ENTRIES = 10000
+
+
+def dict_add_item(items, title, link, description, base=None,
+        author_email=None, author_name=None, author_link=None,
+        pubdate=None, updated=None, unique_id=None,
+        enclosure=None, categories=(), item_copyright=None,
+        **kwargs):
+    """
+    Add an item as AtomFeed.add_item used to.
+    """
+    item = {
+        'title': title,
+        'link': link,
+        'base': base,
+        'description': description,
+        'author_email': author_email,
+        'author_name': author_name,
+        'author_link': author_link,
+        'pubdate': pubdate,
+        'updated': updated,
+        'unique_id': unique_id,
+        'enclosure': enclosure,
+        'categories': categories or (),
+        'item_copyright': item_copyright,
+    }
+    item.update(kwargs)
+    items.append(item)
+
+
+def fill(add_item, description, date):
+    for index in range(ENTRIES):
+        add_item(title=u'tiddler %s' % index,
+                link=u'http://0.0.0.0:8080/bags/b/tiddlers/t%s' % index,
+                base=u'http://0.0.0.0:8080/bags/b/tiddlers/',
+                description=description,
+                author_name=u'cdent',
+                pubdate=date, pubdate_string=u'2012-01-01T00:00:00Z',
+                updated=date, updated_string=u'2012-01-01T00:00:00Z',
+                unique_id=u'b/tiddler %s' % index)
+
+
+def fill_dicts(description, date):
+    items = []
+    fill(lambda **kwargs: dict_add_item(items, **kwargs), description, date)
+    return items
+
+
+def fill_entries(description, date):
+    feed = AtomFeed(title=u'bench', link=u'http://0.0.0.0:8080/',
+            description=u'bench')
+    fill(feed.add_item, description, date)
+    return feed.items
+
+
+def main():
+    description = u'<p>content</p>' * 100
+    date = datetime.datetime(2012, 1, 1)
+    for name, func in [('dict', fill_dicts), ('entry', fill_entries)]:
+        items = func(description, date)
+        overhead = sum(sys.getsizeof(item) for item in items) / len(items)
+        elapsed = min(timeit.repeat(lambda: func(description, date),
+            number=1, repeat=3))
+        print('%-6s %5d bytes/entry container %8.4fs to add %s'
+                % (name, overhead, elapsed, ENTRIES))
+        del items
+        gc.collect()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Compare the cost of sending HTML tiddlers sanitized with that of
+sending them as source wrapped in a <pre>, the escape only path.
+
+Both are measured as far as the escaped text written into the feed,
+for a typical page, a large page and some malformed input, and then
+as the whole of a feed of one tiddler holding each of them. The feeds
+raise 'atom.sanitize_max_size' so that every sample is sanitized; the
+last row, 'fallback', is the large page with the default limit, which
+is sent as source in both columns.
+
+Run from the top of the package with:
+
+    python -m bench.bench_sanitize
+"""
+
+import timeit
+
+from tiddlyweb.config import config
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.serializer import Serializer
+import tiddlywebwiki
+
+from tiddlywebplugins.atom.feed import _escape
+from tiddlywebplugins.atom.sanitize import sanitize_html, DEFAULT_MAX_SIZE
+
+
+PAGE = u"""<div class="entry">
+<h2 id="title">A heading &amp; some <em>emphasis</em></h2>
+<p>Some text with a <a href="http://example.com/page?a=1&amp;b=2"
+ onclick="track()">link</a>, an image <img src="/bags/b/tiddlers/i.png"
+ alt="i"> and <span style="color: red">colour</span>.</p>
+<ul><li>one</li><li>two<li>three</ul>
+<script type="text/javascript">var x = "<b>" + 1;</script>
+<table><tr><td colspan="2">cell</td></tr></table>
+<!-- a comment -->
+</div>
+"""
+
+SAMPLES = [
+        ('page', PAGE),
+        ('large', PAGE * 200),
+        ('malformed', u'<a title="x <b <i>' * 2000),
+]
+
+REPEAT = 200
+
+
+def escape_only(text):
+    return _escape(u'<pre>' + text + u'</pre>', 'utf-8')
+
+
+def sanitized(text):
+    return _escape(sanitize_html(text, max_size=len(text)), 'utf-8')
+
+
+def feed(text, sanitize, max_size=None):
+    if max_size is None:
+        max_size = max(len(text), DEFAULT_MAX_SIZE)
+    environ = {'tiddlyweb.config': dict(config, **{
+        'atom.sanitize_html': sanitize,
+        'atom.sanitize_max_size': max_size})}
+    tiddler = Tiddler(u'page', u'bench')
+    tiddler.type = 'text/html'
+    tiddler.text = text
+
+    def make_feed():
+        serializer = Serializer('tiddlywebplugins.atom.feed',
+                environ=environ)
+        serializer.object = tiddler
+        return serializer.to_string()
+
+    return make_feed
+
+
+def report(label, name, text, functions):
+    times = [min(timeit.repeat(function, number=REPEAT, repeat=3)) / REPEAT
+            for function in functions]
+    print('%-6s %-10s %8d chars  escape %9.1fus  sanitize %9.1fus  %5.1fx'
+            % (label, name, len(text), times[0] * 1e6, times[1] * 1e6,
+                times[1] / times[0]))
+
+
+def main():
+    tiddlywebwiki.init(config)
+    for name, text in SAMPLES:
+        report('text', name, text, [lambda: escape_only(text),
+            lambda: sanitized(text)])
+    for name, text in SAMPLES:
+        report('feed', name, text, [feed(text, False), feed(text, True)])
+    name, text = SAMPLES[1]
+    report('feed', 'fallback', text, [feed(text, False, DEFAULT_MAX_SIZE),
+        feed(text, True, DEFAULT_MAX_SIZE)])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,327 @@
+"""
+Measure the Atom serializer against synthetic bags in a temporary
+text store.
+
+For each size a bag of that many tiddlers is made, cycling through
+wikitext, markdown, plain text and binary (image/png) tiddlers, with
+three revisions of every tenth tiddler, and a recipe of the bag. Then
+each case is run in its own process, so its peak memory can be
+measured, and the wall time, entries per second and growth in peak
+resident memory reported:
+
+    list_tiddlers         a feed of the whole bag
+    list_tiddlers_recent  a feed of the bag with a default filter of
+                          sort=-modified;limit=20
+    list_tiddlers_recipe  a feed of the whole recipe
+    tiddler_as            feeds of single tiddlers, up to 500 of them
+    revision_feed         a feed of up to 100 tiddlers with revisions,
+                          with a depth of 3
+
+Run from the top of the package with:
+
+    python -m bench.bench_suite --sizes 1000,10000 --output results.json
+
+Results are written as JSON with --output, and compared with an
+earlier run with --compare.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from tiddlyweb.config import config as global_config
+from tiddlyweb.control import get_tiddlers_from_recipe
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.collections import Tiddlers
+from tiddlyweb.model.recipe import Recipe
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.serializer import Serializer
+from tiddlyweb.store import Store
+import tiddlywebwiki
+
+
+BAG = 'bench'
+TYPES = [None, 'text/x-markdown', 'text/plain', 'image/png']
+WIKITEXT = u"""!Heading %s
+Some ''bold'' and //italic// text, a [[link|Other%s]] and a list:
+* one
+* two
+* three
+"""
+MARKDOWN = u"""# Heading %s
+
+Some **bold** and *italic* text, a [link](Other%s) and a list:
+
+* one
+* two
+* three
+"""
+PLAIN = u'Plain text %s with <angle> & ampersand %s.\n'
+BINARY = '\x89PNG\r\n\x1a\n' + os.urandom(2048)
+
+SINGLE_TIDDLERS = 500
+REVISION_TIDDLERS = 100
+REVISION_DEPTH = '3'
+
+
+def make_config(store_root):
+    config = dict(global_config)
+    config['server_store'] = ['text',
+            {'store_root': os.path.join(store_root, 'store')}]
+    config['root_dir'] = store_root
+    config.pop('atom.default_filter', None)
+    return config
+
+
+def make_environ(config, **query):
+    environ = {'tiddlyweb.config': config,
+            'tiddlyweb.usersign': {'name': u'GUEST', 'roles': []},
+            'tiddlyweb.query': dict((key, [value])
+                for key, value in query.items())}
+    environ['tiddlyweb.store'] = Store(config['server_store'][0],
+            config['server_store'][1], environ)
+    return environ
+
+
+def build_store(config, size):
+    """
+    Fill the store of config with a bag of size tiddlers and a
+    recipe of the bag.
+    """
+    store = make_environ(config)['tiddlyweb.store']
+    store.put(Bag(BAG))
+    recipe = Recipe(BAG)
+    recipe.set_recipe([(BAG, '')])
+    store.put(recipe)
+    for index in range(size):
+        tiddler = Tiddler(u'tiddler%06d' % index, BAG)
+        tiddler.type = TYPES[index % len(TYPES)]
+        tiddler.modifier = u'author%s' % (index % 7)
+        tiddler.tags = [u'tag%s' % (index % 5), u'bench']
+        tiddler.modified = u'2012%02d%02d%02d%02d%02d' % (
+                index % 12 + 1, index % 28 + 1, index % 24, index % 60,
+                index % 59)
+        revisions = 3 if index % 10 == 0 else 1
+        for revision in range(revisions):
+            if tiddler.type is None:
+                tiddler.text = WIKITEXT % (index, revision)
+            elif tiddler.type == 'text/x-markdown':
+                tiddler.text = MARKDOWN % (index, revision)
+            elif tiddler.type == 'text/plain':
+                tiddler.text = (PLAIN % (index, revision)) * 5
+            else:
+                tiddler.text = BINARY
+            store.put(tiddler)
+
+
+def bag_tiddlers(environ):
+    store = environ['tiddlyweb.store']
+    tiddlers = Tiddlers(title=u'bench', store=store)
+    tiddlers.bag = BAG
+    for tiddler in store.list_bag_tiddlers(Bag(BAG)):
+        tiddlers.add(tiddler)
+    return tiddlers
+
+
+def case_list_tiddlers(config):
+    environ = make_environ(config)
+    tiddlers = bag_tiddlers(environ)
+    start = time.time()
+    output = Serializer('tiddlywebplugins.atom.feed',
+            environ=environ).list_tiddlers(tiddlers)
+    output = ''.join(output)
+    return time.time() - start, output.count('<entry>')
+
+
+def case_list_tiddlers_recent(config):
+    config = dict(config)
+    config['atom.default_filter'] = 'sort=-modified;limit=20'
+    return case_list_tiddlers(config)
+
+
+def case_list_tiddlers_recipe(config):
+    environ = make_environ(config)
+    store = environ['tiddlyweb.store']
+    recipe = store.get(Recipe(BAG))
+    tiddlers = Tiddlers(title=u'bench recipe', store=store)
+    tiddlers.recipe = BAG
+    for tiddler in get_tiddlers_from_recipe(recipe, environ):
+        tiddlers.add(tiddler)
+    start = time.time()
+    output = Serializer('tiddlywebplugins.atom.feed',
+            environ=environ).list_tiddlers(tiddlers)
+    output = ''.join(output)
+    return time.time() - start, output.count('<entry>')
+
+
+def case_tiddler_as(config):
+    environ = make_environ(config)
+    store = environ['tiddlyweb.store']
+    titles = [tiddler.title for tiddler in
+            store.list_bag_tiddlers(Bag(BAG))][:SINGLE_TIDDLERS]
+    start = time.time()
+    for title in titles:
+        serializer = Serializer('tiddlywebplugins.atom.feed',
+                environ=environ)
+        serializer.object = store.get(Tiddler(title, BAG))
+        serializer.to_string()
+    return time.time() - start, len(titles)
+
+
+def case_revision_feed(config):
+    environ = make_environ(config, depth=REVISION_DEPTH)
+    store = environ['tiddlyweb.store']
+    tiddlers = Tiddlers(title=u'bench revisions')
+    titles = sorted(tiddler.title for tiddler in
+            store.list_bag_tiddlers(Bag(BAG)))
+    for title in titles[::10][:REVISION_TIDDLERS]:
+        tiddlers.add(store.get(Tiddler(title, BAG)))
+    start = time.time()
+    output = Serializer('tiddlywebplugins.atom.feed',
+            environ=environ).list_tiddlers(tiddlers)
+    output = ''.join(output)
+    return time.time() - start, output.count('<entry>')
+
+
+CASES = [
+        ('list_tiddlers', case_list_tiddlers),
+        ('list_tiddlers_recent', case_list_tiddlers_recent),
+        ('list_tiddlers_recipe', case_list_tiddlers_recipe),
+        ('tiddler_as', case_tiddler_as),
+        ('revision_feed', case_revision_feed),
+]
+
+
+def _resident_kb():
+    with open('/proc/self/statm') as statm:
+        pages = int(statm.read().split()[1])
+    return pages * resource.getpagesize() // 1024
+
+
+def _run_case(case, config, results):
+    try:
+        baseline = _resident_kb()
+    except IOError:
+        baseline = 0
+    try:
+        seconds, entries = case(config)
+    except Exception as exc:
+        results.put(exc)
+        raise
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.put((seconds, entries, max(peak - baseline, 0)))
+
+
+def run_case(case, config):
+    """
+    Run case in a process of its own, returning its time, the
+    number of entries made and the growth in peak memory in KB.
+    """
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_run_case,
+            args=(case, config, results))
+    process.start()
+    result = results.get()
+    process.join()
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+def run(sizes, writers):
+    tiddlywebwiki.init(global_config)
+    results = []
+    for size in sizes:
+        store_root = tempfile.mkdtemp(prefix='atombench')
+        try:
+            config = make_config(store_root)
+            start = time.time()
+            build_store(config, size)
+            sys.stderr.write('built %s tiddlers in %.1fs\n'
+                    % (size, time.time() - start))
+            for writer in writers:
+                config['atom.writer'] = writer
+                for name, case in CASES:
+                    seconds, entries, peak_kb = run_case(case, config)
+                    result = {'case': name, 'size': size,
+                            'writer': writer, 'seconds': seconds,
+                            'entries': entries,
+                            'entries_per_second': (entries / seconds
+                                if seconds else None),
+                            'peak_kb': peak_kb}
+                    results.append(result)
+                    print_result(result)
+        finally:
+            shutil.rmtree(store_root, ignore_errors=True)
+    return results
+
+
+def print_result(result, previous=None):
+    line = '%-22s %7s %-6s %9.3fs %7d entries %10.0f entries/s %9d KB' % (
+            result['case'], result['size'], result['writer'],
+            result['seconds'], result['entries'],
+            result['entries_per_second'] or 0, result['peak_kb'])
+    if previous and previous.get('seconds'):
+        line += ' %+6.1f%% time' % (100.0 * (result['seconds']
+            - previous['seconds']) / previous['seconds'])
+    print(line)
+
+
+def compare(results, path):
+    """
+    Print results beside the matching results in the JSON
+    file at path.
+    """
+    with open(path) as previous_file:
+        previous = json.load(previous_file)['results']
+    keyed = dict(((old['case'], old['size'], old['writer']), old)
+            for old in previous)
+    print('\ncompared with %s' % path)
+    for result in results:
+        print_result(result, keyed.get((result['case'], result['size'],
+            result['writer'])))
+
+
+def _version():
+    try:
+        import pkg_resources
+        return pkg_resources.get_distribution(
+                'tiddlywebplugins.atom').version
+    except Exception:
+        return None
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Benchmark the Atom '
+            'serializer against synthetic bags.')
+    parser.add_argument('--sizes', default='1000,10000',
+            help='comma separated bag sizes, e.g. 1000,10000,100000')
+    parser.add_argument('--writers', default='sax,direct',
+            help='comma separated atom.writer values')
+    parser.add_argument('--output', help='write results as JSON here')
+    parser.add_argument('--compare', help='JSON results of an earlier run')
+    options = parser.parse_args(args)
+
+    sizes = [int(size) for size in options.sizes.split(',')]
+    results = run(sizes, options.writers.split(','))
+
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump({'version': _version(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                'results': results}, output, indent=2, sort_keys=True)
+    if options.compare:
+        compare(results, options.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""
+Compare the entries per second written by the SAX style AtomFeed
+and the DirectAtomFeed.
+
+Run from the top of the package with:
+
+    python -m bench.bench_writer
+"""
+
+import datetime
+import timeit
+
+from tiddlywebplugins.atom.feed import AtomFeed, DirectAtomFeed
+
+
+ENTRIES = 5000
+
+
+def make_feed(feed_class):
+    feed = feed_class(title=u'bench', link=u'http://0.0.0.0:8080/',
+            language=u'en', description=u'bench', author_name=u'cdent')
+    date = datetime.datetime(2012, 1, 1)
+    for index in range(ENTRIES):
+        feed.add_item(title=u'tiddler %s' % index,
+                link=u'http://0.0.0.0:8080/bags/b/tiddlers/t%s' % index,
+                base=u'http://0.0.0.0:8080/bags/b/tiddlers/',
+                description=u'<p>some &amp; content</p>' * 20,
+                author_name=u'cdent',
+                author_link=u'http://0.0.0.0:8080/profiles/cdent',
+                pubdate=date, pubdate_string=u'2012-01-01T00:00:00Z',
+                updated=date, updated_string=u'2012-01-01T00:00:00Z',
+                unique_id=u'b/tiddler %s' % index,
+                categories=[u'one', u'two', u'three'])
+    return feed
+
+
+def main():
+    for name, feed_class in [('sax', AtomFeed), ('direct', DirectAtomFeed)]:
+        feed = make_feed(feed_class)
+        elapsed = min(timeit.repeat(lambda: feed.writeString('utf-8'),
+            number=1, repeat=3))
+        print('%-7s %8.4fs %10.0f entries/s' % (name, elapsed,
+            ENTRIES / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""
+Test that aggregate feeds merge the newest tiddlers of several
+bags, reading no more than they need.
+"""
+
+import shutil
+
+from StringIO import StringIO
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.policy import Policy
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import Store, HOOKS
+from tiddlyweb.web.serve import load_app
+
+from tiddlywebplugins.atom.aggregate import merge_newest
+from tiddlywebplugins.atom.recent import INDEXES
+
+BAGS = ['alpha', 'beta', 'gamma']
+
+
+def setup_module(module):
+    shutil.rmtree('store', ignore_errors=True)
+    shutil.rmtree('atomaggregatetest', ignore_errors=True)
+    module.default_filter = config.get('atom.default_filter')
+    config['atom.aggregates'] = {'news': BAGS, 'private': ['alpha', 'secret']}
+    config['atom.recent_index_dir'] = 'atomaggregatetest'
+    module.app = load_app()
+    environ = {'tiddlyweb.config': config}
+    store = Store(config['server_store'][0], config['server_store'][1],
+            environ)
+    module.store = store
+    for position, bag_name in enumerate(BAGS):
+        store.put(Bag(bag_name))
+        for index in range(10):
+            tiddler = Tiddler('%s%s' % (bag_name, index), bag_name)
+            tiddler.text = 'hi'
+            # interleave the bags: alpha0 beta0 gamma0 alpha1 ...
+            tiddler.modified = '2012020100%02d%02d' % (index, position)
+            if index % 3 == 2:
+                tiddler.tags = ['excludeLists']
+            store.put(tiddler)
+    secret = Bag('secret')
+    secret.policy = Policy(read=['cdent'])
+    store.put(secret)
+
+
+def teardown_module(module):
+    for key in ['atom.aggregates', 'atom.aggregate_limit',
+            'atom.recent_index', 'atom.recent_index_dir']:
+        config.pop(key, None)
+    config['atom.default_filter'] = default_filter
+    INDEXES.clear()
+    shutil.rmtree('store', ignore_errors=True)
+    shutil.rmtree('atomaggregatetest', ignore_errors=True)
+
+
+def _get(path):
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path,
+            'SCRIPT_NAME': '', 'QUERY_STRING': '',
+            'SERVER_NAME': 'localhost', 'SERVER_PORT': '8080',
+            'wsgi.url_scheme': 'http', 'wsgi.input': StringIO(''),
+            'wsgi.errors': StringIO()}
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = status
+
+    body = ''.join(app(environ, start_response))
+    return response['status'], body
+
+
+def _titles(body):
+    return [part.split('</title>')[0] for part
+            in body.split('<entry><title>')[1:]]
+
+
+def test_merge_newest():
+    taken = []
+
+    def order(keys, name):
+        for key in keys:
+            taken.append(name)
+            yield key, name, name, None
+
+    merged = merge_newest([order([1, 4, 7, 10], 'a'),
+        order([2, 5, 8, 11], 'b'), order([3, 6, 9, 12], 'c')])
+    first = [next(merged)[0] for _ in range(5)]
+    assert first == [1, 2, 3, 4, 5]
+    # one ahead in each order, no more
+    assert len(taken) == 7
+    assert [record[0] for record in merged] == [6, 7, 8, 9, 10, 11, 12]
+
+
+def test_merge_ties_keep_bag_order():
+    merged = merge_newest([iter([(1, 'x', 'a', None)]),
+        iter([(1, 'x', 'b', None)]), iter([(0, 'y', 'c', None)])])
+    assert [record[2] for record in merged] == ['c', 'a', 'b']
+
+
+def test_aggregate_with_default_filter():
+    config['atom.default_filter'] = ('select=tag:!excludeLists;'
+            'sort=-modified;limit=5')
+    status, body = _get('/aggregates/news/tiddlers.atom')
+    assert status == '200 OK'
+    assert _titles(body) == ['gamma9', 'beta9', 'alpha9', 'gamma7',
+            'beta7']
+
+
+def test_aggregate_limit():
+    config['atom.default_filter'] = ''
+    config['atom.aggregate_limit'] = 4
+    try:
+        status, body = _get('/aggregates/news/tiddlers.atom')
+    finally:
+        config.pop('atom.aggregate_limit')
+    assert status == '200 OK'
+    assert _titles(body) == ['gamma9', 'beta9', 'alpha9', 'gamma8']
+
+
+def test_aggregate_from_recent_index():
+    config['atom.default_filter'] = ('select=tag:!excludeLists;'
+            'sort=-modified;limit=5')
+    config['atom.recent_index'] = True
+    config['atom.recent_index_size'] = 4
+    gets = []
+
+    def count_get(store, tiddler):
+        gets.append(tiddler.title)
+
+    try:
+        # the first request makes the indexes
+        _get('/aggregates/news/tiddlers.atom')
+        HOOKS['tiddler']['get'].append(count_get)
+        status, body = _get('/aggregates/news/tiddlers.atom')
+    finally:
+        HOOKS['tiddler']['get'].remove(count_get)
+        config.pop('atom.recent_index')
+        config.pop('atom.recent_index_size')
+    assert status == '200 OK'
+    assert _titles(body) == ['gamma9', 'beta9', 'alpha9', 'gamma7',
+            'beta7']
+    # only the tiddlers the merge took, not all thirty
+    assert gets == ['gamma9', 'beta9', 'alpha9', 'gamma8', 'beta8',
+            'alpha8', 'gamma7', 'beta7']
+
+
+def test_unknown_aggregate():
+    status, _ = _get('/aggregates/nothing/tiddlers.atom')
+    assert status.startswith('404')
+
+
+def test_unreadable_bag():
+    status, _ = _get('/aggregates/private/tiddlers.atom')
+    assert not status.startswith('200')
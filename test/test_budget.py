@@ -0,0 +1,184 @@
+"""
+Test that feeds which spend their budget send the rest of their
+entries as summaries.
+"""
+
+import shutil
+
+from httpexceptor import HTTP304
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.collections import Tiddlers
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.serializer import Serializer
+from tiddlyweb.store import Store
+import tiddlywebwiki
+
+from tiddlywebplugins.atom.budget import (BUDGET_KEY, LIMITS, NO_BUDGET,
+        register_hooks, start_budget)
+from tiddlywebplugins.atom.conditional import VALIDATOR_KEY
+
+
+def setup_module(module):
+    tiddlywebwiki.init(config)
+    module.default_filter = config.pop('atom.default_filter', None)
+    register_hooks()
+    shutil.rmtree('store', ignore_errors=True)
+    store = Store(config['server_store'][0], config['server_store'][1],
+            {'tiddlyweb.config': config})
+    module.store = store
+    store.put(Bag('budget'))
+    for index in range(10):
+        tiddler = Tiddler('tiddler%s' % index, 'budget')
+        tiddler.text = '!Heading %s' % index
+        tiddler.modified = '2012020100000%s' % index
+        store.put(tiddler)
+    tiddler = Tiddler('changing', 'budget')
+    for index in range(5):
+        tiddler.text = 'line %s\n' % index
+        store.put(tiddler)
+
+
+def teardown_module(module):
+    _clear()
+    if default_filter:
+        config['atom.default_filter'] = default_filter
+    shutil.rmtree('store', ignore_errors=True)
+
+
+def _clear():
+    for _, key, _ in LIMITS:
+        config.pop(key, None)
+
+
+def _environ(query=None):
+    environ = {'tiddlyweb.config': config, 'tiddlyweb.query': query or {}}
+    environ['tiddlyweb.store'] = Store(config['server_store'][0],
+            config['server_store'][1], environ)
+    return environ
+
+
+def _feed(environ):
+    store = environ['tiddlyweb.store']
+    tiddlers = Tiddlers(title='budget', store=store)
+    tiddlers.bag = 'budget'
+    for tiddler in store.list_bag_tiddlers(Bag('budget')):
+        if tiddler.title != 'changing':
+            tiddlers.add(tiddler)
+    return ''.join(Serializer('tiddlywebplugins.atom.feed',
+        environ=environ).list_tiddlers(tiddlers))
+
+
+def test_no_budget():
+    _clear()
+    environ = _environ()
+    assert start_budget(environ) is NO_BUDGET
+    output = _feed(environ)
+    assert output.count('<entry>') == 10
+    assert output.count('<content') == 10
+    assert BUDGET_KEY not in environ
+    assert environ[VALIDATOR_KEY][0]
+
+
+def test_entries_budget():
+    _clear()
+    config['atom.budget_entries'] = 3
+    environ = _environ()
+    output = _feed(environ)
+    assert output.count('<entry>') == 10
+    assert output.count('<content') == 3
+    assert output.count('<link href="http://0.0.0.0:8080/bags/budget/'
+            'tiddlers/tiddler') == 10
+    assert output.count('<updated>') == 11
+    assert environ[BUDGET_KEY].exhausted == 'entries'
+    etag, last_modified = environ[VALIDATOR_KEY]
+    assert etag.startswith('W/"')
+    assert last_modified
+
+    # the weak ETag revalidates
+    environ = _environ()
+    environ['HTTP_IF_NONE_MATCH'] = etag
+    try:
+        _feed(environ)
+    except HTTP304 as exc:
+        assert ('etag', etag) in exc.headers()
+    else:
+        assert False, '304 not raised'
+
+
+def test_bytes_budget():
+    _clear()
+    config['atom.budget_bytes'] = 1
+    environ = _environ()
+    output = _feed(environ)
+    assert output.count('<entry>') == 10
+    assert output.count('<content') == 1
+    assert environ[BUDGET_KEY].exhausted == 'bytes'
+
+
+def test_seconds_budget():
+    _clear()
+    config['atom.budget_seconds'] = 0
+    environ = _environ()
+    output = _feed(environ)
+    assert output.count('<entry>') == 10
+    assert '<content' not in output
+    assert environ[BUDGET_KEY].exhausted == 'seconds'
+
+
+def test_store_gets_budget():
+    _clear()
+    config['atom.budget_store_gets'] = 5
+    environ = _environ()
+    output = _feed(environ)
+    assert output.count('<entry>') == 10
+    # the fifth get, of the fifth tiddler, spends the budget
+    assert output.count('<content') == 4
+    assert environ[BUDGET_KEY].exhausted == 'store_gets'
+
+
+def test_selection_not_counted():
+    _clear()
+    config['atom.budget_store_gets'] = 8
+    config['atom.default_filter'] = 'sort=-modified;limit=5'
+    try:
+        environ = _environ()
+        output = _feed(environ)
+    finally:
+        config.pop('atom.default_filter')
+    # sorting reads all ten tiddlers, more than the budget
+    assert output.count('<entry>') == 5
+    assert output.count('<content') == 5
+    assert environ[BUDGET_KEY].store_gets <= 5
+    assert environ[BUDGET_KEY].exhausted is None
+    assert not environ[VALIDATOR_KEY][0].startswith('W/')
+
+
+def test_direct_writer_same():
+    _clear()
+    config['atom.budget_entries'] = 3
+    sax = _feed(_environ())
+    config['atom.writer'] = 'direct'
+    try:
+        direct = _feed(_environ())
+    finally:
+        config.pop('atom.writer')
+    assert sax == direct
+
+
+def test_revision_budget():
+    _clear()
+    config['atom.budget_entries'] = 1
+    environ = _environ({'depth': ['2']})
+    serializer = Serializer('tiddlywebplugins.atom.feed', environ=environ)
+    serializer.object = environ['tiddlyweb.store'].get(
+            Tiddler('changing', 'budget'))
+    output = serializer.to_string()
+    assert output.count('<entry>') == 3
+    assert output.count('<content') == 1
+    assert '<title>changing comparing version 2 to 3</title><link' in output
+    assert ('<title>changing comparing version 3 to 4</title><link'
+            in output)
+    assert ('<title>changing comparing version 4 to 5</title><link'
+            in output)
@@ -0,0 +1,166 @@
+"""
+Test that feeds are sent gzip compressed when accepted, and
+that cached compressed feeds are sent without rendering.
+"""
+
+import gzip
+import shutil
+
+from StringIO import StringIO
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import Store
+from tiddlyweb.web.serve import load_app
+
+from tiddlywebplugins.atom.compress import (FeedCompressor, accepts_gzip,
+        CACHES)
+from tiddlywebplugins.atom.conditional import base_etag, gzip_etag
+from tiddlywebplugins.atom.feed import Serialization
+
+
+def setup_module(module):
+    shutil.rmtree('store', ignore_errors=True)
+    config['atom.gzip'] = True
+    module.app = load_app()
+    environ = {'tiddlyweb.config': config}
+    store = Store(config['server_store'][0], config['server_store'][1],
+            environ)
+    module.store = store
+    store.put(Bag('zipped'))
+    for index in range(5):
+        tiddler = Tiddler('tiddler%s' % index, 'zipped')
+        tiddler.text = 'hi ' * 100
+        store.put(tiddler)
+
+
+def teardown_module(module):
+    config.pop('atom.gzip', None)
+    config['server_response_filters'].remove(FeedCompressor)
+    CACHES.clear()
+    shutil.rmtree('store', ignore_errors=True)
+
+
+def _get(path, **headers):
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path,
+            'SCRIPT_NAME': '', 'QUERY_STRING': '',
+            'SERVER_NAME': 'localhost', 'SERVER_PORT': '8080',
+            'wsgi.url_scheme': 'http', 'wsgi.input': StringIO(''),
+            'wsgi.errors': StringIO()}
+    environ.update(headers)
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = status
+        response['headers'] = dict((name.lower(), value)
+                for name, value in headers)
+
+    body = ''.join(app(environ, start_response))
+    return response['status'], response['headers'], body
+
+
+def _count_entries():
+    added = []
+    original = Serialization._add_tiddler_to_feed
+
+    def counting_add(self, feed, tiddler):
+        added.append(tiddler.title)
+        return original(self, feed, tiddler)
+
+    Serialization._add_tiddler_to_feed = counting_add
+    return added, original
+
+
+def _gunzip(body):
+    return gzip.GzipFile(fileobj=StringIO(body)).read()
+
+
+def test_accepts_gzip():
+    assert accepts_gzip({'HTTP_ACCEPT_ENCODING': 'gzip, deflate'})
+    assert accepts_gzip({'HTTP_ACCEPT_ENCODING': 'deflate, gzip;q=0.5'})
+    assert accepts_gzip({'HTTP_ACCEPT_ENCODING': '*'})
+    assert not accepts_gzip({'HTTP_ACCEPT_ENCODING': 'gzip;q=0'})
+    assert not accepts_gzip({'HTTP_ACCEPT_ENCODING': 'deflate'})
+    assert not accepts_gzip({})
+
+
+def test_plain_without_accept_encoding():
+    status, headers, body = _get('/bags/zipped/tiddlers.atom')
+    assert status.startswith('200')
+    assert 'content-encoding' not in headers
+    assert headers['vary'] == 'Accept, Accept-Encoding'
+    assert body.count('<entry>') == 5
+
+
+def test_compressed_and_cached():
+    _, _, plain = _get('/bags/zipped/tiddlers.atom')
+    status, headers, body = _get('/bags/zipped/tiddlers.atom',
+            HTTP_ACCEPT_ENCODING='gzip')
+    assert status.startswith('200')
+    assert headers['content-encoding'] == 'gzip'
+    assert headers['vary'] == 'Accept, Accept-Encoding'
+    assert _gunzip(body) == plain
+    assert len(body) < len(plain)
+
+    added, original = _count_entries()
+    try:
+        status, headers, cached = _get('/bags/zipped/tiddlers.atom',
+                HTTP_ACCEPT_ENCODING='gzip')
+    finally:
+        Serialization._add_tiddler_to_feed = original
+    assert status.startswith('200')
+    assert added == []
+    assert cached == body
+    assert headers['content-length'] == str(len(cached))
+
+
+def test_change_makes_new_body():
+    _get('/bags/zipped/tiddlers.atom', HTTP_ACCEPT_ENCODING='gzip')
+    tiddler = Tiddler('tiddler5', 'zipped')
+    tiddler.text = 'new'
+    store.put(tiddler)
+
+    added, original = _count_entries()
+    try:
+        _, headers, body = _get('/bags/zipped/tiddlers.atom',
+                HTTP_ACCEPT_ENCODING='gzip')
+    finally:
+        Serialization._add_tiddler_to_feed = original
+    assert len(added) == 6
+    assert 'tiddler5' in _gunzip(body)
+
+
+def test_not_modified_not_compressed():
+    _, headers, _ = _get('/bags/zipped/tiddlers.atom',
+            HTTP_ACCEPT_ENCODING='gzip')
+    status, headers, body = _get('/bags/zipped/tiddlers.atom',
+            HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=headers['etag'])
+    assert status.startswith('304')
+    assert 'content-encoding' not in headers
+    assert headers['vary'] == 'Accept, Accept-Encoding'
+
+
+def test_gzip_etag_differs():
+    _, plain_headers, _ = _get('/bags/zipped/tiddlers.atom')
+    _, headers, _ = _get('/bags/zipped/tiddlers.atom',
+            HTTP_ACCEPT_ENCODING='gzip')
+    assert headers['etag'] != plain_headers['etag']
+    assert headers['etag'] == gzip_etag(plain_headers['etag'])
+    assert base_etag(headers['etag']) == plain_headers['etag']
+
+    # either form revalidates either request
+    for etag in [headers['etag'], plain_headers['etag']]:
+        for encoding in ['gzip', '']:
+            status, not_modified, _ = _get('/bags/zipped/tiddlers.atom',
+                    HTTP_ACCEPT_ENCODING=encoding, HTTP_IF_NONE_MATCH=etag)
+            assert status.startswith('304')
+            assert not_modified['etag'] == etag
+
+
+def test_etag_forms():
+    assert gzip_etag('"abc:def"') == '"abc:def-gzip"'
+    assert gzip_etag('W/"abc"') == 'W/"abc-gzip"'
+    assert gzip_etag(None) is None
+    assert base_etag('W/"abc-gzip"') == '"abc"'
+    assert base_etag('"abc"') == '"abc"'
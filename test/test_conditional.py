@@ -0,0 +1,95 @@
+"""
+Test that feed validators are computed from the selected
+tiddlers and that matching requests get a 304.
+"""
+
+import py.test
+
+from httpexceptor import HTTP304
+
+from tiddlyweb.serializer import Serializer
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.model.collections import Tiddlers
+from tiddlyweb.config import config
+import tiddlywebwiki
+
+from tiddlywebplugins.atom.conditional import FeedValidator, VALIDATOR_KEY
+
+
+def setup_module(module):
+    tiddlywebwiki.init(config)
+
+
+def _make_tiddlers():
+    tiddlers = Tiddlers(title='conditional')
+    for index in range(3):
+        tiddler = Tiddler('tiddler%s' % index, 'fake')
+        tiddler.text = 'hi'
+        tiddler.revision = index + 1
+        tiddler.modified = '2012020100000%s' % index
+        tiddlers.add(tiddler)
+    return tiddlers
+
+
+def _serializer(**headers):
+    environ = {'tiddlyweb.config': config}
+    environ.update(headers)
+    return Serializer('tiddlywebplugins.atom.feed', environ=environ), environ
+
+
+def test_validator_set():
+    serializer, environ = _serializer()
+    serializer.list_tiddlers(_make_tiddlers())
+    etag, last_modified = environ[VALIDATOR_KEY]
+    assert etag.startswith('"')
+    assert last_modified == 'Wed, 01 Feb 2012 00:00:02 GMT'
+
+
+def test_etag_match():
+    serializer, environ = _serializer()
+    serializer.list_tiddlers(_make_tiddlers())
+    etag, _ = environ[VALIDATOR_KEY]
+
+    serializer, environ = _serializer(HTTP_IF_NONE_MATCH=etag)
+    py.test.raises(HTTP304, 'serializer.list_tiddlers(_make_tiddlers())')
+
+    tiddlers = _make_tiddlers()
+    tiddler = Tiddler('tiddler3', 'fake')
+    tiddler.text = 'new'
+    tiddler.revision = 4
+    tiddler.modified = '20120201000003'
+    tiddlers.add(tiddler)
+    output = serializer.list_tiddlers(tiddlers)
+    assert 'tiddler3' in output
+    assert environ[VALIDATOR_KEY][0] != etag
+
+
+def test_modified_since():
+    serializer, environ = _serializer(
+            HTTP_IF_MODIFIED_SINCE='Wed, 01 Feb 2012 00:00:02 GMT')
+    py.test.raises(HTTP304, 'serializer.list_tiddlers(_make_tiddlers())')
+
+    serializer, environ = _serializer(
+            HTTP_IF_MODIFIED_SINCE='Wed, 01 Feb 2012 00:00:01 GMT')
+    output = serializer.list_tiddlers(_make_tiddlers())
+    assert '<entry>' in output
+
+
+def test_middleware():
+    def app(environ, start_response):
+        environ[VALIDATOR_KEY] = ('"feed"', 'Wed, 01 Feb 2012 00:00:02 GMT')
+        start_response('200 OK', [('Content-Type', 'application/atom+xml'),
+            ('Etag', '"collection"'),
+            ('Last-Modified', 'Thu, 02 Feb 2012 00:00:00 GMT')])
+        return ['feed']
+
+    responses = []
+
+    def start_response(status, headers, exc_info=None):
+        responses.append(headers)
+
+    FeedValidator(app)({}, start_response)
+    headers = dict(responses[0])
+    assert headers['ETag'] == '"feed"'
+    assert headers['Last-Modified'] == 'Wed, 01 Feb 2012 00:00:02 GMT'
+    assert 'Etag' not in headers
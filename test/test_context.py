@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+Test that the per feed context makes the same URLs as
+tiddlyweb.web.util, computing each only once.
+"""
+
+from tiddlyweb.config import config
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.web.util import tiddler_url
+
+from tiddlywebplugins.atom.feed import FeedContext
+
+
+def setup_module(module):
+    config['atom.author_uri_map'] = '/profiles/%s'
+    config['atom.author_avatar_map'] = '/bags/%s_public/tiddlers/SiteIcon'
+    module.environ = {'tiddlyweb.config': config}
+
+
+def test_tiddler_urls():
+    context = FeedContext(environ)
+    for title in [u'simple', u'with space', u'a/b', u'☃', u"it's"]:
+        tiddler = Tiddler(title, u'some bag')
+        tiddler.recipe = u'a recipe'
+        assert context.tiddler_url(tiddler) == tiddler_url(environ, tiddler)
+        assert (context.tiddler_url(tiddler, container='recipes')
+                == tiddler_url(environ, tiddler, container='recipes'))
+        assert (context.container_base(tiddler, container='recipes')
+                == u'http://0.0.0.0:8080/recipes/a%20recipe/tiddlers/')
+
+
+def test_authors_memoized():
+    context = FeedContext(environ)
+    link = context.author_link(u'cdent')
+    assert link == u'http://0.0.0.0:8080/profiles/cdent'
+    assert context.author_link(u'cdent') is link
+    assert (context.author_avatar(u'cdent')
+            == u'http://0.0.0.0:8080/bags/cdent_public/tiddlers/SiteIcon')
+
+
+def test_no_maps():
+    context = FeedContext({'tiddlyweb.config': {}})
+    assert context.author_link(u'cdent') is None
+    assert context.author_avatar(u'cdent') is None
@@ -0,0 +1,41 @@
+"""
+Test that the fast timestamp handling gives the same dates
+as parsing with strptime and formatting with rfc3339_date.
+"""
+
+import time
+import datetime
+
+from feedgenerator import rfc3339_date
+
+from tiddlyweb.config import config
+
+from tiddlywebplugins.atom.feed import Serialization
+
+
+def setup_module(module):
+    module.serialization = Serialization({'tiddlyweb.config': config})
+
+
+def _slow(date_string):
+    date = datetime.datetime(*(time.strptime(
+        date_string, '%Y%m%d%H%M%S')[0:6]))
+    return date, rfc3339_date(date)
+
+
+def test_same_dates():
+    for date_string in ['20120101000000', '19991231235959',
+            '20240229120102', u'20131009112233', '201201010000']:
+        assert serialization._tiddler_date(date_string) == _slow(date_string)
+
+
+def test_memoized():
+    first = serialization._tiddler_date('20120203040506')
+    assert serialization._tiddler_date('20120203040506') is first
+
+
+def test_bad_dates():
+    for date_string in ['20121301000000', 'not a date', '']:
+        date, date_string = serialization._tiddler_date(date_string)
+        assert abs(datetime.datetime.utcnow() - date).seconds < 5
+        assert date_string.endswith('Z')
@@ -0,0 +1,114 @@
+"""
+Test that since and If-Modified-Since give feeds of only
+the tiddlers changed after that time.
+"""
+
+import re
+
+import py.test
+
+from httpexceptor import HTTP304, HTTP400
+
+from tiddlyweb.filters import parse_for_filters
+from tiddlyweb.serializer import Serializer
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.model.collections import Tiddlers
+from tiddlyweb.config import config
+import tiddlywebwiki
+
+from tiddlywebplugins.atom.conditional import VALIDATOR_KEY
+from tiddlywebplugins.atom.delta import modified_since, newest_first
+from tiddlywebplugins.atom.filters import optimize_filters
+
+
+def setup_module(module):
+    tiddlywebwiki.init(config)
+
+
+def teardown_module(module):
+    config.pop('atom.delta_feeds', None)
+
+
+def _make_tiddlers():
+    tiddlers = Tiddlers(title='delta')
+    for index in range(10):
+        tiddler = Tiddler('tiddler%s' % index, 'fake')
+        tiddler.text = 'hi'
+        tiddler.modified = '2012020100000%s' % index
+        tiddlers.add(tiddler)
+    return tiddlers
+
+
+def _titles(environ):
+    serializer = Serializer('tiddlywebplugins.atom.feed', environ=environ)
+    output = serializer.list_tiddlers(_make_tiddlers())
+    return re.findall(r'<title>(tiddler\d+)</title>', output)
+
+
+def test_since_query():
+    environ = {'tiddlyweb.config': config,
+            'tiddlyweb.query': {'since': ['20120201000006']}}
+    titles = _titles(environ)
+    assert sorted(titles) == ['tiddler7', 'tiddler8', 'tiddler9']
+
+    environ['tiddlyweb.query'] = {'since': ['20120201000009']}
+    assert _titles(environ) == []
+
+
+def test_short_since():
+    environ = {'tiddlyweb.config': config,
+            'tiddlyweb.query': {'since': ['2013']}}
+    assert _titles(environ) == []
+    environ['tiddlyweb.query'] = {'since': ['2011']}
+    assert len(_titles(environ)) == 10
+
+
+def test_bad_since():
+    environ = {'tiddlyweb.config': config,
+            'tiddlyweb.query': {'since': ['yesterday']}}
+    py.test.raises(HTTP400, '_titles(environ)')
+
+
+def test_if_modified_since():
+    environ = {'tiddlyweb.config': config,
+            'HTTP_IF_MODIFIED_SINCE': 'Wed, 01 Feb 2012 00:00:07 GMT'}
+    # without atom.delta_feeds the header only gives a 304 or all
+    assert len(_titles(environ)) == 10
+
+    config['atom.delta_feeds'] = True
+    try:
+        assert sorted(_titles(environ)) == ['tiddler8', 'tiddler9']
+        etag, last_modified = environ[VALIDATOR_KEY]
+        assert etag is None
+        assert last_modified == 'Wed, 01 Feb 2012 00:00:09 GMT'
+
+        environ['HTTP_IF_MODIFIED_SINCE'] = 'Wed, 01 Feb 2012 00:00:09 GMT'
+        py.test.raises(HTTP304, '_titles(environ)')
+    finally:
+        config.pop('atom.delta_feeds', None)
+
+
+def test_newest_first():
+    def _filters(string):
+        return optimize_filters(parse_for_filters(string)[0])
+    assert newest_first(_filters('sort=-modified'))
+    assert newest_first(_filters('select=tag:x;sort=-modified;limit=20'))
+    assert newest_first(_filters('sort=-modified;limit=5;limit=2'))
+    assert not newest_first(_filters('sort=modified;limit=20'))
+    assert not newest_first(_filters('sort=-modified;select=tag:x'))
+    assert not newest_first([])
+
+
+def test_stop_early():
+    seen = []
+
+    def _newest_first():
+        for tiddler in reversed(list(_make_tiddlers())):
+            seen.append(tiddler.title)
+            yield tiddler
+
+    changed = list(modified_since(_newest_first(), '20120201000007',
+        newest_first=True))
+    assert [tiddler.title for tiddler in changed] == [
+            'tiddler9', 'tiddler8']
+    assert seen == ['tiddler9', 'tiddler8', 'tiddler7']
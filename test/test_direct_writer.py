@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+Test that the direct writer makes exactly the same feed
+as the SAX style AtomFeed.
+"""
+
+import datetime
+
+from feedgenerator import Enclosure
+
+from tiddlyweb.serializer import Serializer
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.model.collections import Tiddlers
+from tiddlyweb.config import config
+import tiddlywebwiki
+
+from tiddlywebplugins.atom.feed import AtomFeed, DirectAtomFeed
+
+
+def setup_module(module):
+    tiddlywebwiki.init(config)
+
+
+def teardown_module(module):
+    config.pop('atom.writer', None)
+
+
+def _fill(feed_class, **extra):
+    feed = feed_class(title=u'a <feed> & "more"',
+            link=u'http://0.0.0.0:8080/bags/b/tiddlers?select=x&y=z',
+            language=u'en', description=u'd\xe9scription',
+            author_name=u'cdent', author_link=u'http://0.0.0.0/c',
+            author_email=u'c@example.com', categories=[u'one', u'two'],
+            feed_copyright=u'\xa9 me', hub=u'http://hub/',
+            author_avatar=u'http://0.0.0.0/avatar',
+            pages=[(u'first', u'http://0.0.0.0/feed?a=1&b=2'),
+                (u'next', u'http://0.0.0.0/feed?cursor=YWJj')], **extra)
+    feed.add_item(title=u'it\'s "quoted" <b>',
+            link=u'http://0.0.0.0:8080/bags/b/tiddlers/it%27s',
+            description='<pre>plain bytes & such</pre>',
+            base=u'http://0.0.0.0:8080/bags/b/tiddlers/',
+            author_name=u'fnd', author_link=u"it's \"both\"",
+            pubdate=datetime.datetime(2012, 1, 1, 1, 2, 3),
+            updated=datetime.datetime(2012, 2, 1, 1, 2, 3),
+            updated_string=u'2012-02-01T01:02:03Z',
+            unique_id=u'b/it\'s', categories=[u'tab\there', u'new\nline'],
+            item_copyright=u'mine',
+            enclosure=Enclosure(u'http://0.0.0.0/image.png', u'1234',
+                u'image/png'))
+    feed.add_item(title=u'☃ snowman', link=u'http://0.0.0.0/s',
+            description=None, unique_id=None)
+    feed.add_item(title=u'no base', link=u'http://0.0.0.0/n',
+            description=u'<p>☃</p>', unique_id=u'b/n',
+            pubdate=datetime.datetime(2012, 3, 1))
+    return feed
+
+
+def test_same_string():
+    expected = _fill(AtomFeed).writeString('utf-8')
+    output = _fill(DirectAtomFeed).writeString('utf-8')
+    assert isinstance(output, str)
+    assert output == expected
+
+
+def test_no_language():
+    arguments = dict(title=u't', link=u'http://x/', description=None,
+            language=None, feed_url=u'http://x/feed', subtitle=u'sub')
+    expected = AtomFeed(**arguments).writeString('utf-8')
+    output = DirectAtomFeed(**arguments).writeString('utf-8')
+    assert output == expected
+
+
+def test_same_stream():
+    updated = datetime.datetime(2013, 1, 1)
+    expected_feed = _fill(AtomFeed, updated=updated)
+    expected = list(expected_feed.write_stream('utf-8', expected_feed.items))
+    direct_feed = _fill(DirectAtomFeed, updated=updated)
+    output = list(direct_feed.write_stream('utf-8', direct_feed.items))
+    assert output == expected
+
+
+def test_serializer_choice():
+    tiddlers = Tiddlers(title='writer')
+    for index in range(3):
+        tiddler = Tiddler(u'tiddler <%s>' % index, 'fake')
+        tiddler.text = u'text & ☃ %s' % index
+        tiddler.tags = [u'a', u'b c']
+        tiddler.modified = '2012020100000%s' % index
+        tiddler.created = '20120101000000'
+        tiddlers.add(tiddler)
+    serializer = Serializer('tiddlywebplugins.atom.feed',
+            environ={'tiddlyweb.config': config})
+    config['atom.writer'] = 'sax'
+    expected = serializer.list_tiddlers(tiddlers)
+    config['atom.writer'] = 'direct'
+    output = serializer.list_tiddlers(tiddlers)
+    assert output == expected
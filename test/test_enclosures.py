@@ -0,0 +1,98 @@
+"""
+Test that binary tiddlers are given enclosure links, with their
+type and length, and that their content is not kept for the feed.
+"""
+
+import shutil
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.collections import Tiddlers
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.serializer import Serializer
+from tiddlyweb.store import Store
+import tiddlywebwiki
+
+from tiddlywebplugins.atom.feed import Serialization
+
+PNG = '\x89PNG\r\n\x1a\n' + 'x' * 100
+
+
+def setup_module(module):
+    tiddlywebwiki.init(config)
+    shutil.rmtree('store', ignore_errors=True)
+    environ = {'tiddlyweb.config': config}
+    store = Store(config['server_store'][0], config['server_store'][1],
+            environ)
+    environ['tiddlyweb.store'] = store
+    module.environ = environ
+    module.store = store
+    store.put(Bag('enclosures'))
+    tiddler = Tiddler('picture', 'enclosures')
+    tiddler.type = 'image/png'
+    tiddler.text = PNG
+    store.put(tiddler)
+    tiddler = Tiddler('elsewhere', 'enclosures')
+    tiddler.type = 'application/pdf'
+    tiddler.fields['_canonical_uri'] = 'http://example.com/paper.pdf'
+    store.put(tiddler)
+    tiddler = Tiddler('words', 'enclosures')
+    tiddler.text = 'some words'
+    store.put(tiddler)
+
+
+def teardown_module(module):
+    config.pop('atom.writer', None)
+    shutil.rmtree('store', ignore_errors=True)
+
+
+def _feed(writer='sax'):
+    config['atom.writer'] = writer
+    tiddlers = Tiddlers(title='enclosures', store=store)
+    tiddlers.bag = 'enclosures'
+    for tiddler in store.list_bag_tiddlers(Bag('enclosures')):
+        tiddlers.add(tiddler)
+    serializer = Serializer('tiddlywebplugins.atom.feed', environ=environ)
+    return ''.join(serializer.list_tiddlers(tiddlers))
+
+
+def test_binary_enclosure():
+    output = _feed()
+    assert ('<link href="http://0.0.0.0:8080/bags/enclosures/tiddlers/'
+            'picture" length="108" rel="enclosure" type="image/png">'
+            '</link>' in output)
+    assert ('&lt;img src="http://0.0.0.0:8080/bags/enclosures/tiddlers/'
+            'picture" /&gt;' in output)
+
+
+def test_canonical_uri_enclosure():
+    output = _feed()
+    assert ('<link href="http://example.com/paper.pdf" rel="enclosure" '
+            'type="application/pdf"></link>' in output)
+    assert ('&lt;a href="http://example.com/paper.pdf"&gt;elsewhere'
+            '&lt;/a&gt;' in output)
+
+
+def test_text_no_enclosure():
+    output = _feed()
+    assert output.count('rel="enclosure"') == 2
+
+
+def test_direct_writer_same():
+    assert _feed('direct') == _feed('sax')
+
+
+def test_body_not_kept():
+    serialization = Serialization(environ)
+    tiddler = store.get(Tiddler('picture', 'enclosures'))
+    reference = serialization._without_body(tiddler)
+    assert reference.text == ''
+    assert reference.type == 'image/png'
+    assert reference.revision == tiddler.revision
+    assert reference.modified == tiddler.modified
+    assert reference.store is tiddler.store
+    enclosure = serialization._enclosure(reference, 'http://example.com/')
+    assert enclosure.length == u'108'
+
+    tiddler = store.get(Tiddler('words', 'enclosures'))
+    assert serialization._without_body(tiddler) is tiddler
@@ -0,0 +1,44 @@
+"""
+Test the Entry records held by AtomFeed.
+"""
+
+import datetime
+
+import py.test
+
+from tiddlywebplugins.atom.feed import AtomFeed, Entry
+
+
+def _feed():
+    feed = AtomFeed(title=u'entries', link=u'http://0.0.0.0:8080/',
+            description=u'entries')
+    feed.add_item(title=u'one', link=u'http://0.0.0.0:8080/one',
+            description=u'<p>one</p>', unique_id=u'b/one',
+            pubdate=datetime.datetime(2012, 1, 1),
+            updated=datetime.datetime(2012, 3, 1), color=u'blue')
+    feed.add_item(title=u'two', link=u'http://0.0.0.0:8080/two',
+            description=u'<p>two</p>', unique_id=u'b/two',
+            pubdate=datetime.datetime(2012, 4, 1),
+            updated=datetime.datetime(2012, 2, 1))
+    return feed
+
+
+def test_entry_slots():
+    item = _feed().items[0]
+    assert isinstance(item, Entry)
+    assert not hasattr(item, '__dict__')
+    assert item.title == u'one'
+    assert item['title'] == u'one'
+    assert item['color'] == u'blue'
+    assert item.get('nothing', u'default') == u'default'
+    assert item['updateddate'] == datetime.datetime(2012, 3, 1)
+    py.test.raises(KeyError, 'item["nothing"]')
+
+
+def test_latest_post_date():
+    feed = _feed()
+    assert feed.latest_post_date() == datetime.datetime(2012, 4, 1)
+    output = feed.writeString('utf-8')
+    assert '<updated>2012-04-01T00:00:00Z</updated>' in output
+    assert '<published>2012-01-01T00:00:00Z</published>' in output
+    assert '<content type="html">&lt;p&gt;two&lt;/p&gt;</content>' in output
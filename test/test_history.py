@@ -0,0 +1,140 @@
+"""
+Test that history feeds give the newest revisions across a bag,
+opening only the tiddlers they need.
+"""
+
+import re
+import shutil
+
+from StringIO import StringIO
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import Store, HOOKS
+from tiddlyweb.web.serve import load_app
+
+from tiddlywebplugins.atom.history import revision_stream
+from tiddlywebplugins.atom.recent import INDEXES
+
+TIDDLERS = 20
+REVISIONS = 3
+
+
+def setup_module(module):
+    shutil.rmtree('store', ignore_errors=True)
+    shutil.rmtree('atomhistorytest', ignore_errors=True)
+    module.default_filter = config.get('atom.default_filter')
+    config['atom.history'] = True
+    config['atom.recent_index_dir'] = 'atomhistorytest'
+    module.app = load_app()
+    environ = {'tiddlyweb.config': config}
+    store = Store(config['server_store'][0], config['server_store'][1],
+            environ)
+    environ['tiddlyweb.store'] = store
+    module.environ = environ
+    store.put(Bag('history'))
+    revisions = []
+    for index in range(TIDDLERS):
+        tiddler = Tiddler('t%02d' % index, 'history')
+        for revision in range(REVISIONS):
+            # the revisions of different tiddlers interleave
+            seconds = (index + 7 * revision) * 100 + index
+            tiddler.modified = '20120201%06d' % seconds
+            tiddler.text = 'revision %s' % revision
+            if index % 4 == 3 and revision == REVISIONS - 1:
+                tiddler.tags = ['excludeLists']
+            store.put(tiddler)
+            revisions.append((seconds, tiddler.title, revision + 1))
+    module.newest = ['history/%s/%s' % (title, revision)
+            for _, title, revision in sorted(revisions, reverse=True)]
+
+
+def teardown_module(module):
+    for key in ['atom.history', 'atom.history_limit', 'atom.recent_index',
+            'atom.recent_index_dir', 'atom.recent_index_size']:
+        config.pop(key, None)
+    config['atom.default_filter'] = default_filter
+    INDEXES.clear()
+    shutil.rmtree('store', ignore_errors=True)
+    shutil.rmtree('atomhistorytest', ignore_errors=True)
+
+
+def _get(path):
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path,
+            'SCRIPT_NAME': '', 'QUERY_STRING': '',
+            'SERVER_NAME': 'localhost', 'SERVER_PORT': '8080',
+            'wsgi.url_scheme': 'http', 'wsgi.input': StringIO(''),
+            'wsgi.errors': StringIO()}
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = status
+
+    body = ''.join(app(environ, start_response))
+    return response['status'], body
+
+
+def _ids(body):
+    return re.findall(r'<id>(history/[^<]*)</id>', body)
+
+
+def test_revision_stream():
+    ids = ['history/%s/%s' % (tiddler.title, tiddler.revision)
+            for tiddler in revision_stream(environ, 'history')]
+    assert ids == newest
+
+
+def test_history_feed():
+    config['atom.default_filter'] = ''
+    config['atom.history_limit'] = 8
+    try:
+        status, body = _get('/bags/history/revisions.atom')
+    finally:
+        config.pop('atom.history_limit')
+    assert status == '200 OK'
+    assert _ids(body) == newest[:8]
+
+
+def test_history_default_filter():
+    config['atom.default_filter'] = ('select=tag:!excludeLists;'
+            'sort=-modified;limit=6')
+    status, body = _get('/bags/history/revisions.atom')
+    assert status == '200 OK'
+    excluded = ['history/t%02d/%s' % (index, REVISIONS)
+            for index in range(3, TIDDLERS, 4)]
+    assert _ids(body) == [revision_id for revision_id in newest
+            if revision_id not in excluded][:6]
+
+
+def test_history_opens_few_tiddlers():
+    config['atom.default_filter'] = ''
+    config['atom.history_limit'] = 5
+    config['atom.recent_index'] = True
+    config['atom.recent_index_size'] = 10
+    gets = []
+
+    def count_get(store, tiddler):
+        gets.append(tiddler.title)
+
+    try:
+        # the first request makes the index
+        _get('/bags/history/revisions.atom')
+        HOOKS['tiddler']['get'].append(count_get)
+        status, body = _get('/bags/history/revisions.atom')
+    finally:
+        HOOKS['tiddler']['get'].remove(count_get)
+        for key in ['atom.history_limit', 'atom.recent_index',
+                'atom.recent_index_size']:
+            config.pop(key)
+    assert status == '200 OK'
+    assert _ids(body) == newest[:5]
+    # the five revisions and the next older revision of four of
+    # them, not all sixty revisions
+    assert gets == ['t19', 't19', 't18', 't18', 't17', 't17', 't16',
+            't16', 't15']
+
+
+def test_history_missing_bag():
+    status, _ = _get('/bags/nothing/revisions.atom')
+    assert status.startswith('404')
@@ -0,0 +1,178 @@
+"""
+Test that hot feeds are made ahead of time, served from their
+files and remade when their bags change.
+"""
+
+import os
+import shutil
+import time
+
+from StringIO import StringIO
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.policy import Policy
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import HOOKS, Store
+from tiddlyweb.web.serve import load_app
+
+from tiddlywebplugins.atom.hot import HotFeeds, GENERATORS
+
+
+HOT_PATH = '/bags/hot/tiddlers.atom'
+PRIVATE_PATH = '/bags/private/tiddlers.atom'
+
+
+def setup_module(module):
+    shutil.rmtree('store', ignore_errors=True)
+    shutil.rmtree('atomhottest', ignore_errors=True)
+    config['atom.hot_feeds'] = [HOT_PATH, PRIVATE_PATH]
+    config['atom.hot_feeds_dir'] = 'atomhottest'
+    config['atom.hot_feeds_delay'] = 0
+    module.app = load_app()
+    module.generator = GENERATORS[-1]
+    environ = {'tiddlyweb.config': config}
+    store = Store(config['server_store'][0], config['server_store'][1],
+            environ)
+    module.store = store
+    store.put(Bag('hot'))
+    private = Bag('private')
+    private.policy = Policy(read=['cdent'])
+    store.put(private)
+    for index in range(3):
+        tiddler = Tiddler('tiddler%s' % index, 'hot')
+        tiddler.text = 'hi'
+        store.put(tiddler)
+
+
+def teardown_module(module):
+    for key in ['atom.hot_feeds', 'atom.hot_feeds_dir',
+            'atom.hot_feeds_delay']:
+        config.pop(key, None)
+    config['server_response_filters'].remove(HotFeeds)
+    del GENERATORS[:]
+    shutil.rmtree('store', ignore_errors=True)
+    shutil.rmtree('atomhottest', ignore_errors=True)
+
+
+def _get(path, **headers):
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path,
+            'SCRIPT_NAME': '', 'QUERY_STRING': '',
+            'SERVER_NAME': 'localhost', 'SERVER_PORT': '8080',
+            'wsgi.url_scheme': 'http', 'wsgi.input': StringIO(''),
+            'wsgi.errors': StringIO()}
+    environ.update(headers)
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = status
+        response['headers'] = dict((name.lower(), value)
+                for name, value in headers)
+
+    body = ''.join(app(environ, start_response))
+    return response['status'], response['headers'], body
+
+
+def _wait_for(path, exists=True):
+    for _ in range(200):
+        if os.path.exists(generator._path(path)) == exists:
+            return
+        time.sleep(0.01)
+    raise AssertionError('%s never %s' % (path,
+        'made' if exists else 'removed'))
+
+
+def _wait_for_timers():
+    for _ in range(200):
+        if not generator._timers:
+            return
+        time.sleep(0.01)
+
+
+def test_hot_feed_made_and_served():
+    status, headers, body = _get(HOT_PATH)
+    assert status.startswith('200')
+    assert 'tiddler2' in body
+    _wait_for(HOT_PATH)
+
+    status, headers, served = _get(HOT_PATH)
+    assert status.startswith('200')
+    assert served.count('<entry>') == 3
+    assert headers['content-length'] == str(len(served))
+    assert headers['content-type'].startswith('application/atom+xml')
+
+    status, _, body = _get(HOT_PATH,
+            HTTP_IF_NONE_MATCH=headers['etag'])
+    assert status.startswith('304')
+    assert body == ''
+
+
+def test_file_wrapper_used():
+    wrapped = []
+
+    def file_wrapper(filelike, block_size):
+        wrapped.append(filelike)
+        return iter(lambda: filelike.read(block_size), '')
+
+    status, _, body = _get(HOT_PATH, **{'wsgi.file_wrapper':
+        file_wrapper})
+    assert status.startswith('200')
+    assert len(wrapped) == 1
+    assert body.startswith('<?xml')
+
+
+def test_change_remakes_feed():
+    _wait_for(HOT_PATH)
+    tiddler = Tiddler('newtiddler', 'hot')
+    tiddler.text = 'new'
+    store.put(tiddler)
+    _wait_for_timers()
+    _wait_for(HOT_PATH)
+    _, _, served = _get(HOT_PATH)
+    assert 'newtiddler' in served
+    assert served.count('<entry>') == 4
+
+
+def test_query_string_not_hot():
+    status, _, body = _get(HOT_PATH, QUERY_STRING='select=title:tiddler1')
+    assert status.startswith('200')
+    assert body.count('<entry>') == 1
+
+
+def test_unreadable_feed_not_made():
+    status, _, _ = _get(PRIVATE_PATH)
+    assert not status.startswith('200')
+    _wait_for_timers()
+    assert not os.path.exists(generator._path(PRIVATE_PATH))
+    assert PRIVATE_PATH in generator._failed
+
+
+def test_change_elsewhere_not_written():
+    _wait_for(HOT_PATH)
+    generator.discard(HOT_PATH)
+    application = generator.application
+
+    def changing_application(environ, start_response):
+        output = application(environ, start_response)
+        if 'HTTP_IF_NONE_MATCH' not in environ:
+            # another process puts a tiddler, without our store hooks
+            hooks = HOOKS['tiddler']['put'][:]
+            del HOOKS['tiddler']['put'][:]
+            try:
+                tiddler = Tiddler('elsewhere', 'hot')
+                tiddler.text = 'other process'
+                store.put(tiddler)
+            finally:
+                HOOKS['tiddler']['put'][:] = hooks
+        return output
+
+    generator.application = changing_application
+    try:
+        assert not generator.generate(HOT_PATH)
+    finally:
+        generator.application = application
+    assert not os.path.exists(generator._path(HOT_PATH))
+
+    assert generator.generate(HOT_PATH)
+    _, _, served = _get(HOT_PATH)
+    assert 'elsewhere' in served
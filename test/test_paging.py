@@ -0,0 +1,128 @@
+"""
+Test that paged feeds link to their first, next and previous
+pages and that cursors keep pages in place.
+"""
+
+import re
+
+import py.test
+
+from httpexceptor import HTTP400
+
+from tiddlyweb.serializer import Serializer
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.model.collections import Tiddlers
+from tiddlyweb.config import config
+import tiddlywebwiki
+
+from tiddlywebplugins.atom.paging import (select_page, encode_cursor,
+        decode_cursor, page_url, AFTER)
+
+
+def setup_module(module):
+    tiddlywebwiki.init(config)
+    module.default_filter = config.pop('atom.default_filter', None)
+    config['atom.page_size'] = 10
+
+
+def teardown_module(module):
+    config.pop('atom.page_size', None)
+    if default_filter:
+        config['atom.default_filter'] = default_filter
+
+
+def _make_tiddlers(count=25):
+    tiddlers = Tiddlers(title='paged')
+    for index in range(count):
+        tiddler = Tiddler('tiddler%02d' % index, 'fake')
+        tiddler.text = 'hi'
+        # pairs of tiddlers share a modified time
+        tiddler.modified = '201202010000%02d' % (index // 2)
+        tiddlers.add(tiddler)
+    return tiddlers
+
+
+def _titles(tiddlers):
+    return [tiddler.title for tiddler in tiddlers]
+
+
+def _fetch(tiddlers, cursor=None):
+    query_string = 'select=tag:x'
+    query = {}
+    if cursor:
+        query_string += '&cursor=%s' % cursor
+        query['cursor'] = [cursor]
+    environ = {'tiddlyweb.config': config, 'tiddlyweb.query': query,
+            'SCRIPT_NAME': '/bags/fake/tiddlers.atom',
+            'QUERY_STRING': query_string}
+    serializer = Serializer('tiddlywebplugins.atom.feed', environ=environ)
+    output = serializer.list_tiddlers(tiddlers)
+    links = dict((rel, href) for href, rel in
+            re.findall(r'<link href="([^"]*)" rel="(first|next|previous)"',
+                output))
+    titles = re.findall(r'<title>(tiddler\d+)</title>', output)
+    return titles, links
+
+
+def _cursor(href):
+    return href.rsplit('cursor=', 1)[1]
+
+
+def test_cursor_round_trip():
+    key = (u'20120201000000', u'b\xe4g', u'a title')
+    assert decode_cursor(encode_cursor(AFTER, key)) == (AFTER, key)
+    py.test.raises(HTTP400, 'decode_cursor("notacursor")')
+
+
+def test_page_url():
+    assert (page_url(u'http://x/feed', 'a=1&cursor=old&b=2', 'new')
+            == u'http://x/feed?a=1&b=2&cursor=new')
+    assert page_url(u'http://x/feed', 'cursor=old') == u'http://x/feed'
+
+
+def test_walk_pages():
+    expected = list(reversed(_titles(_make_tiddlers())))
+    seen = []
+    titles, links = _fetch(_make_tiddlers())
+    assert links['first'] == (
+            'http://0.0.0.0:8080/bags/fake/tiddlers.atom?select=tag:x')
+    assert 'previous' not in links
+    seen.extend(titles)
+    while 'next' in links:
+        titles, links = _fetch(_make_tiddlers(), _cursor(links['next']))
+        assert 'previous' in links
+        seen.extend(titles)
+    assert seen == expected
+
+
+def test_previous_page():
+    _, links = _fetch(_make_tiddlers())
+    second, links = _fetch(_make_tiddlers(), _cursor(links['next']))
+    third, links = _fetch(_make_tiddlers(), _cursor(links['next']))
+    titles, links = _fetch(_make_tiddlers(), _cursor(links['previous']))
+    assert titles == second
+    titles, links = _fetch(_make_tiddlers(), _cursor(links['previous']))
+    assert len(titles) == 10
+    assert 'previous' not in links
+    assert 'next' in links
+
+
+def test_pages_stay_in_place():
+    _, links = _fetch(_make_tiddlers())
+    second, _ = _fetch(_make_tiddlers(), _cursor(links['next']))
+
+    # a new tiddler arrives between fetches
+    tiddlers = _make_tiddlers()
+    tiddler = Tiddler('tiddler99', 'fake')
+    tiddler.modified = '20130101000000'
+    tiddlers.add(tiddler)
+    titles, _ = _fetch(tiddlers, _cursor(links['next']))
+    assert titles == second
+
+
+def test_select_page_bounded():
+    selected, next_cursor, previous_cursor = select_page(
+            _make_tiddlers(), 3)
+    assert _titles(selected) == ['tiddler24', 'tiddler23', 'tiddler22']
+    assert next_cursor
+    assert previous_cursor is None
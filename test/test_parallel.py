@@ -0,0 +1,149 @@
+"""
+Test that rendering entries with a pool of workers gives
+the same feed, in the same order, as rendering serially.
+"""
+
+from tiddlyweb.serializer import Serializer
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.model.collections import Tiddlers
+from tiddlyweb.config import config
+import tiddlywebwiki
+
+from tiddlywebplugins.atom.parallel import POOLS, get_pool
+
+
+def setup_module(module):
+    tiddlywebwiki.init(config)
+    module.serializer = Serializer('tiddlywebplugins.atom.feed',
+            environ={'tiddlyweb.config': config})
+
+
+def teardown_module(module):
+    for key in ['atom.render_workers', 'atom.render_pool',
+            'atom.render_parallel_min', 'atom.render_batch']:
+        config.pop(key, None)
+    for pool in POOLS.values():
+        pool.terminate()
+    POOLS.clear()
+
+
+def _make_tiddlers():
+    tiddlers = Tiddlers(title='parallel')
+    for index in range(30):
+        tiddler = Tiddler('tiddler%02d' % index, 'fake')
+        tiddler.text = '# Heading %s\n\n* item %s\n' % (index, index)
+        tiddler.type = 'text/x-markdown'
+        tiddler.modifier = 'cdent'
+        tiddler.created = '20120101000000'
+        tiddler.modified = '201202010000%02d' % index
+        tiddlers.add(tiddler)
+    tiddler = Tiddler('plain', 'fake')
+    tiddler.text = 'plain text'
+    tiddler.type = 'text/plain'
+    tiddler.created = tiddler.modified = '20120101000000'
+    tiddlers.add(tiddler)
+    return tiddlers
+
+
+def _serial_output():
+    config['atom.render_workers'] = 0
+    return serializer.list_tiddlers(_make_tiddlers())
+
+
+def test_no_pool():
+    config['atom.render_workers'] = 1
+    assert get_pool(config) is None
+
+
+def test_thread_pool():
+    expected = _serial_output()
+    config['atom.render_workers'] = 4
+    config['atom.render_pool'] = 'thread'
+    config['atom.render_parallel_min'] = 2
+    config['atom.render_batch'] = 7
+    output = serializer.list_tiddlers(_make_tiddlers())
+    assert 'Heading 29&lt;/h1&gt;' in output
+    assert output == expected
+    assert ('thread', 4) in POOLS
+
+
+def test_process_pool():
+    expected = _serial_output()
+    config['atom.render_workers'] = 2
+    config['atom.render_pool'] = 'process'
+    config['atom.render_parallel_min'] = 2
+    config['atom.render_batch'] = 10
+    output = serializer.list_tiddlers(_make_tiddlers())
+    assert output == expected
+    assert ('process', 2) in POOLS
+
+
+def test_small_batch_serial():
+    expected = _serial_output()
+    config['atom.render_workers'] = 3
+    config['atom.render_pool'] = 'thread'
+    config['atom.render_parallel_min'] = 100
+    output = serializer.list_tiddlers(_make_tiddlers())
+    assert output == expected
+
+
+def test_prerendered_cleared():
+    config['atom.render_workers'] = 2
+    config['atom.render_pool'] = 'thread'
+    config['atom.render_parallel_min'] = 2
+    config['atom.render_batch'] = 7
+    config['atom.budget_entries'] = 3
+    try:
+        output = serializer.list_tiddlers(_make_tiddlers())
+        assert output.count('<entry>') == 20
+        assert serializer.serialization._prerendered == {}
+    finally:
+        config.pop('atom.budget_entries')
+
+    config['atom.stream'] = True
+    try:
+        output = serializer.list_tiddlers(_make_tiddlers())
+        chunks = iter(output)
+        for _ in range(3):
+            chunks.next()
+        assert serializer.serialization._prerendered
+        output.close()
+        assert serializer.serialization._prerendered == {}
+    finally:
+        config.pop('atom.stream')
+
+
+def test_process_worker_renders_as_user():
+    from tiddlywebplugins.atom import feed
+    from tiddlywebplugins.atom.parallel import (WORKER_ENVIRON,
+            _init_worker, _render_worker, _tiddler_data, render_batch)
+
+    seen = []
+    original = feed.render_description
+
+    def recording_render(tiddler, environ):
+        seen.append(environ['tiddlyweb.usersign'])
+        return u'rendered'
+
+    feed.render_description = recording_render
+    try:
+        _init_worker(config)
+        usersign = {'name': u'cdent', 'roles': [u'ADMIN']}
+        tiddler = Tiddler('private', 'fake')
+        tiddler.text = '<<tiddler Secret>>'
+        assert _render_worker((usersign,
+            _tiddler_data(tiddler))) == u'rendered'
+        assert seen == [usersign]
+
+        # and the task carries the user of the request
+        class MapPool(object):
+            def map(self, function, tasks):
+                return [task[0] for task in tasks]
+        config['atom.render_pool'] = 'process'
+        config['atom.render_parallel_min'] = 1
+        tasks = render_batch(MapPool(), {'tiddlyweb.config': config,
+            'tiddlyweb.usersign': usersign}, [tiddler], None)
+        assert tasks == [usersign]
+    finally:
+        feed.render_description = original
+        WORKER_ENVIRON.clear()
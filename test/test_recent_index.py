@@ -0,0 +1,205 @@
+"""
+Test that feeds of the newest tiddlers in a bag can be made
+from the recent index, and that store writes keep it current.
+"""
+
+import re
+import shutil
+
+from tiddlyweb.config import config
+from tiddlyweb.filters import parse_for_filters, recursive_filter
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.collections import Tiddlers
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.serializer import Serializer
+from tiddlyweb.store import Store
+import tiddlywebwiki
+
+from tiddlywebplugins.atom import init
+from tiddlywebplugins.atom.filters import optimize_filters
+from tiddlywebplugins.atom.recent import INDEXES, get_index, recent_limit
+
+
+def setup_module(module):
+    tiddlywebwiki.init(config)
+    config['atom.recent_index'] = True
+    config['atom.recent_index_size'] = 30
+    config['atom.recent_index_dir'] = 'atomrecenttest'
+    init(config)
+    shutil.rmtree('store', ignore_errors=True)
+    shutil.rmtree('atomrecenttest', ignore_errors=True)
+    environ = {'tiddlyweb.config': config}
+    store = Store(config['server_store'][0], config['server_store'][1],
+            environ)
+    environ['tiddlyweb.store'] = store
+    module.environ = environ
+    module.store = store
+    store.put(Bag('recent'))
+    for index in range(40):
+        tiddler = Tiddler('tiddler%02d' % index, 'recent')
+        tiddler.text = 'hi'
+        tiddler.modified = '201202010000%02d' % index
+        if index % 4 == 0:
+            tiddler.tags = ['excludeLists']
+        store.put(tiddler)
+
+
+def teardown_module(module):
+    for key in ['atom.recent_index', 'atom.recent_index_size',
+            'atom.recent_index_dir']:
+        config.pop(key, None)
+    INDEXES.clear()
+    shutil.rmtree('store', ignore_errors=True)
+    shutil.rmtree('atomrecenttest', ignore_errors=True)
+
+
+def _bag_tiddlers():
+    tiddlers = Tiddlers(title='recent', store=store)
+    tiddlers.bag = 'recent'
+    for tiddler in store.list_bag_tiddlers(Bag('recent')):
+        tiddlers.add(tiddler)
+    return tiddlers
+
+
+def _feed_titles(count_gets=False):
+    tiddlers = _bag_tiddlers()
+    gets = []
+    original_get = store.get
+
+    def counting_get(thing):
+        gets.append(thing)
+        return original_get(thing)
+
+    store.get = counting_get
+    try:
+        serializer = Serializer('tiddlywebplugins.atom.feed',
+                environ=environ)
+        output = serializer.list_tiddlers(tiddlers)
+    finally:
+        del store.get
+    return re.findall(r'<title>(tiddler\d+)</title>', output), gets
+
+
+def _without_index():
+    config['atom.recent_index'] = False
+    try:
+        return _feed_titles()[0]
+    finally:
+        config['atom.recent_index'] = True
+
+
+def test_recent_limit():
+    def _limit(string):
+        return recent_limit(optimize_filters(parse_for_filters(string)[0]))
+    assert _limit('sort=-modified;limit=20') == (0, 20)
+    assert _limit('select=tag:!x;sort=-modified;limit=5,10') == (5, 10)
+    assert _limit('sort=modified;limit=20') is None
+    assert _limit('sort=-modified;select=tag:x') is None
+    assert _limit('limit=20') is None
+
+
+def test_index_feed():
+    expected = _without_index()
+    assert len(expected) == 20
+
+    # the first feed makes the index
+    titles, _ = _feed_titles()
+    assert titles == expected
+    assert len(get_index(config).read('recent')) == 30
+
+    titles, gets = _feed_titles()
+    assert titles == expected
+    assert len(gets) <= 30
+
+
+def test_put_updates_index():
+    tiddler = Tiddler('newest', 'recent')
+    tiddler.text = 'new'
+    tiddler.modified = '20130101000000'
+    store.put(tiddler)
+    records = get_index(config).read('recent')
+    assert records[0][0] == 'newest'
+    assert len(records) == 30
+
+    expected = _without_index()
+    titles, gets = _feed_titles()
+    assert titles == expected
+    assert len(gets) <= 30
+
+
+def test_delete_drops_full_index():
+    store.delete(Tiddler('tiddler39', 'recent'))
+    assert get_index(config).read('recent') is None
+    titles, _ = _feed_titles()
+    assert 'tiddler39' not in titles
+    assert titles == _without_index()
+    assert get_index(config).read('recent') is not None
+
+
+def test_falls_back_when_too_few_selected():
+    for index in range(15, 40):
+        if index == 39:
+            continue
+        tiddler = store.get(Tiddler('tiddler%02d' % index, 'recent'))
+        tiddler.tags = ['excludeLists']
+        store.put(tiddler)
+    titles, gets = _feed_titles()
+    assert titles == _without_index()
+    assert len(gets) > 30
+
+
+def _put_filtered_bag():
+    store.put(Bag('filtered'))
+    for index in range(10):
+        tiddler = Tiddler('t%02d' % index, 'filtered')
+        tiddler.text = 'hi'
+        tiddler.modified = '201202010000%02d' % index
+        if index < 3:
+            tiddler.tags = ['keep']
+        store.put(tiddler)
+    get_index(config).drop('filtered')
+
+
+def _filtered_feed(filter_string):
+    filters = parse_for_filters(filter_string)[0]
+    tiddlers = Tiddlers(title='filtered', store=store)
+    tiddlers.bag = 'filtered'
+    for tiddler in recursive_filter(filters, [store.get(tiddler)
+            for tiddler in store.list_bag_tiddlers(Bag('filtered'))]):
+        tiddlers.add(tiddler)
+    request = dict(environ, **{'tiddlyweb.filters': filters})
+    output = Serializer('tiddlywebplugins.atom.feed',
+            environ=request).list_tiddlers(tiddlers)
+    return re.findall(r'<title>(t\d+)</title>', output)
+
+
+def test_request_filters_not_skipped():
+    _put_filtered_bag()
+    assert _filtered_feed('select=tag:keep') == ['t02', 't01', 't00']
+    # the filtered request did not make the index from its tiddlers
+    assert _filtered_feed('') == ['t%02d' % index
+            for index in range(9, -1, -1)]
+    assert len(get_index(config).read('filtered')) == 10
+
+
+def test_hook_write_failure_drops_index():
+    index = get_index(config)
+    assert index.read('filtered') is not None
+
+    def broken_write(bag, records):
+        raise IOError('disk full')
+
+    index._write = broken_write
+    try:
+        tiddler = Tiddler('t10', 'filtered')
+        tiddler.text = 'hi'
+        store.put(tiddler)
+    finally:
+        del index._write
+    assert store.get(Tiddler('t10', 'filtered')).text == 'hi'
+    assert index.read('filtered') is None
+
+
+def test_bag_delete_drops_index():
+    store.delete(Bag('recent'))
+    assert get_index(config).read('recent') is None
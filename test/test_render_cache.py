@@ -0,0 +1,137 @@
+"""
+Test that rendered content is cached and that the cache
+is invalidated when tiddlers change in the store.
+"""
+
+import shutil
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.serializer import Serializer
+from tiddlyweb.store import Store
+import tiddlywebwiki
+
+from tiddlywebplugins.atom import init
+from tiddlywebplugins.atom.cache import (MemoryCache, DiskCache, CACHES,
+        cache_key, get_cache)
+
+
+def setup_module(module):
+    tiddlywebwiki.init(config)
+    config['atom.render_cache'] = 'memory'
+    init(config)
+    shutil.rmtree('store', ignore_errors=True)
+    environ = {'tiddlyweb.config': config}
+    module.store = Store(config['server_store'][0],
+            config['server_store'][1], environ)
+    environ['tiddlyweb.store'] = module.store
+    module.serializer = Serializer('tiddlywebplugins.atom.feed',
+            environ=environ)
+    module.store.put(Bag('cached'))
+
+
+def teardown_module(module):
+    config.pop('atom.render_cache', None)
+    CACHES.clear()
+    shutil.rmtree('store', ignore_errors=True)
+
+
+def test_cache_hit():
+    cache = get_cache(config)
+    tiddler = Tiddler('one', 'cached')
+    tiddler.text = '# Hello'
+    tiddler.type = 'text/x-markdown'
+    store.put(tiddler)
+    tiddler = store.get(Tiddler('one', 'cached'))
+
+    serializer.object = tiddler
+    output = serializer.to_string()
+    assert '&lt;h1' in output
+    assert cache.stats()['misses'] == 1
+    assert cache.stats()['hits'] == 0
+
+    serializer.object = tiddler
+    second_output = serializer.to_string()
+    assert cache.stats()['hits'] == 1
+    assert second_output == output
+
+
+def test_cache_invalidated():
+    cache = get_cache(config)
+    tiddler = store.get(Tiddler('one', 'cached'))
+    assert cache.stats()['entries'] == 1
+    tiddler.text = '# Goodbye'
+    store.put(tiddler)
+    assert cache.stats()['entries'] == 0
+
+    tiddler = store.get(Tiddler('one', 'cached'))
+    serializer.object = tiddler
+    output = serializer.to_string()
+    assert 'Goodbye' in output
+
+
+def test_unstored_not_cached():
+    cache = get_cache(config)
+    entries = cache.stats()['entries']
+    tiddler = Tiddler('two', 'cached')
+    tiddler.text = '!Unsaved'
+    serializer.object = tiddler
+    serializer.to_string()
+    assert cache.stats()['entries'] == entries
+
+
+def test_memory_lru():
+    cache = MemoryCache({'atom.render_cache_size': 2})
+    cache.put(('bag', 'a', '1', 'default'), 'a')
+    cache.put(('bag', 'b', '1', 'default'), 'b')
+    assert cache.get(('bag', 'a', '1', 'default')) == 'a'
+    cache.put(('bag', 'c', '1', 'default'), 'c')
+    assert cache.get(('bag', 'b', '1', 'default')) is None
+    assert cache.get(('bag', 'a', '1', 'default')) == 'a'
+    cache.invalidate('bag')
+    assert cache.get(('bag', 'c', '1', 'default')) is None
+    assert cache.stats() == {'hits': 2, 'misses': 2, 'entries': 0}
+
+
+def test_disk_cache():
+    cache = DiskCache({'atom.render_cache_dir': 'store/atomcache'})
+    key = ('bag', u'\u00e9t\u00e9', '3', 'default')
+    assert cache.get(key) is None
+    cache.put(key, u'<p>\u00e9t\u00e9</p>')
+    assert cache.get(key) == u'<p>\u00e9t\u00e9</p>'
+    cache.invalidate('bag', u'\u00e9t\u00e9')
+    assert cache.get(key) is None
+    assert cache.stats() == {'hits': 1, 'misses': 2}
+
+
+def test_key_per_recipe_and_user():
+    tiddler = store.get(Tiddler('one', 'cached'))
+    guest = cache_key(tiddler, {})
+    user = cache_key(tiddler, {'tiddlyweb.usersign': {'name': u'cdent'}})
+    assert guest != user
+    tiddler.recipe = u'public'
+    assert cache_key(tiddler, {}) not in (guest, user)
+
+
+def test_transcluding_not_cached():
+    cache = get_cache(config)
+    entries = cache.stats()['entries']
+    tiddler = Tiddler('three', 'cached')
+    tiddler.text = '{{one}}'
+    tiddler.type = 'text/x-markdown'
+    store.put(tiddler)
+    tiddler = store.get(Tiddler('three', 'cached'))
+    assert cache_key(tiddler, {}) is None
+    serializer.object = tiddler
+    serializer.to_string()
+    assert cache.stats()['entries'] == entries
+
+
+def test_disk_put_error_skipped():
+    with open('store/notadir', 'w') as blocker:
+        blocker.write('x')
+    cache = DiskCache({'atom.render_cache_dir': 'store/notadir/atomcache'})
+    key = ('bag', u'title', '3', 'default')
+    cache.put(key, u'<p>lost</p>')
+    assert cache.get(key) is None
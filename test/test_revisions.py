@@ -0,0 +1,96 @@
+"""
+Test that revision feeds read each revision once and
+reuse cached diffs.
+"""
+
+import shutil
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.serializer import Serializer
+from tiddlyweb.store import Store
+import tiddlywebwiki
+
+from tiddlywebplugins.atom import init
+from tiddlywebplugins.atom.cache import CACHES, DIFF_CACHE, get_cache
+
+
+def setup_module(module):
+    tiddlywebwiki.init(config)
+    config['atom.diff_cache'] = 'memory'
+    init(config)
+    shutil.rmtree('store', ignore_errors=True)
+    environ = {'tiddlyweb.config': config,
+            'tiddlyweb.query': {'depth': ['2']}}
+    store = Store(config['server_store'][0], config['server_store'][1],
+            environ)
+    environ['tiddlyweb.store'] = store
+    module.serializer = Serializer('tiddlywebplugins.atom.feed',
+            environ=environ)
+    module.store = store
+    store.put(Bag('revised'))
+    for index in range(5):
+        tiddler = Tiddler('changing', 'revised')
+        tiddler.text = 'line %s\n' % index
+        store.put(tiddler)
+
+
+def teardown_module(module):
+    config.pop('atom.diff_cache', None)
+    CACHES.clear()
+    shutil.rmtree('store', ignore_errors=True)
+
+
+def _count_gets():
+    gets = []
+    original_get = store.get
+
+    def counting_get(thing):
+        gets.append(thing)
+        return original_get(thing)
+
+    store.get = counting_get
+    return gets
+
+
+def test_revision_feed():
+    tiddler = store.get(Tiddler('changing', 'revised'))
+    gets = _count_gets()
+    try:
+        serializer.object = tiddler
+        output = serializer.to_string()
+    finally:
+        del store.get
+
+    assert 'changing comparing version 2 to 3' in output
+    assert 'changing comparing version 3 to 4' in output
+    assert 'changing comparing version 4 to 5' in output
+    assert 'version 1 to 2' not in output
+    # four revisions, each read once
+    assert len(gets) == 4
+    assert get_cache(config, DIFF_CACHE).stats()['misses'] == 3
+
+
+def test_cached_diffs():
+    tiddler = store.get(Tiddler('changing', 'revised'))
+    cache = get_cache(config, DIFF_CACHE)
+    hits = cache.stats()['hits']
+    gets = _count_gets()
+    try:
+        serializer.object = tiddler
+        output = serializer.to_string()
+    finally:
+        del store.get
+
+    assert 'line 4' in output
+    assert cache.stats()['hits'] == hits + 3
+    # the older revision of the first pair is not needed
+    assert len(gets) == 3
+
+
+def test_deleted_tiddler_removed():
+    cache = get_cache(config, DIFF_CACHE)
+    assert cache.stats()['entries'] == 3
+    store.delete(Tiddler('changing', 'revised'))
+    assert cache.stats()['entries'] == 0
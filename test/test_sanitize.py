@@ -0,0 +1,128 @@
+"""
+Test the sanitizing of HTML tiddlers.
+"""
+
+import time
+
+from tiddlyweb.config import config
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.serializer import Serializer
+import tiddlywebwiki
+
+from tiddlywebplugins.atom.sanitize import sanitize_html
+
+
+def setup_module(module):
+    tiddlywebwiki.init(config)
+    config['atom.sanitize_html'] = True
+    module.serializer = Serializer('tiddlywebplugins.atom.feed',
+            environ={'tiddlyweb.config': config})
+
+
+def teardown_module(module):
+    config.pop('atom.sanitize_html', None)
+    config.pop('atom.sanitize_max_size', None)
+
+
+def test_allowed_kept():
+    html = u'<p class="x">Hi <b>there</b> <a href="http://example.com/" title="t">link</a></p>'
+    assert sanitize_html(html) == (u'<p>Hi <b>there</b> <a '
+            u'href="http://example.com/" title="t">link</a></p>')
+
+
+def test_script_dropped():
+    html = u'<p>a<script>alert("<b>")</script>b<style>p {}</STYLE >c</p>'
+    assert sanitize_html(html) == u'<p>abc</p>'
+
+
+def test_unknown_elements_keep_text():
+    html = u'<html><body><font color="red">red</font></body></html>'
+    assert sanitize_html(html) == u'red'
+
+
+def test_event_attributes_dropped():
+    html = u'<img src="/a.png" onerror="alert(1)" alt="a">'
+    assert sanitize_html(html) == u'<img src="/a.png" alt="a">'
+
+
+def test_unsafe_urls_dropped():
+    for url in [u'javascript:alert(1)', u'JavaScript:alert(1)',
+            u' java\tscript:alert(1)', u'javascript&#58;alert(1)',
+            u'&#106;avascript:alert(1)', u'data:text/html,hi',
+            u'vbscript:msgbox']:
+        html = u'<a href="%s">x</a>' % url
+        assert sanitize_html(html) == u'<a>x</a>', url
+    assert (sanitize_html(u'<a href="mailto:cdent@example.com">x</a>')
+            == u'<a href="mailto:cdent@example.com">x</a>')
+    assert (sanitize_html(u'<a href="/bags/b/tiddlers/t?x=1:2">x</a>')
+            == u'<a href="/bags/b/tiddlers/t?x=1:2">x</a>')
+
+
+def test_attribute_values_escaped():
+    html = u"<a title='say \"hi\" &amp; <bye>'>x</a>"
+    assert sanitize_html(html) == u'&lt;a title=\'say "hi" &amp; \'&gt;x'
+    html = u"<a title='say \"hi\" &amp; bye'>x</a>"
+    assert (sanitize_html(html)
+            == u'<a title="say &quot;hi&quot; &amp; bye">x</a>')
+
+
+def test_text_escaped():
+    html = u'1 < 2 & 3 > 2 &amp; &#169; &copy; &bogus'
+    assert (sanitize_html(html)
+            == u'1 &lt; 2 &amp; 3 &gt; 2 &amp; &#169; &copy; &amp;bogus')
+
+
+def test_nesting_repaired():
+    assert sanitize_html(u'<ul><li><b>one</li></i>') == (
+            u'<ul><li><b>one</b></li></ul>')
+    assert sanitize_html(u'</p>text<br/><hr>') == u'text<br><hr>'
+
+
+def test_comments_dropped():
+    html = u'<!DOCTYPE html><!-- <script>x</script> -->a<?php x ?>b<!-- c'
+    assert sanitize_html(html) == u'ab'
+
+
+def test_max_size():
+    assert sanitize_html(u'<p>hello</p>', max_size=5) is None
+
+
+def test_linear_on_malformed():
+    for html in [u'<a ' * 50000, u'<a title="' * 50000,
+            u'<b>' * 50000 + u'</i>' * 50000, u'<script>' * 50000,
+            u'<!--' * 50000]:
+        start = time.time()
+        sanitize_html(html, max_size=len(html))
+        assert time.time() - start < 2, html[:10]
+
+
+def test_html_tiddler():
+    tiddler = Tiddler('html thing', 'fake')
+    tiddler.text = u'<h1 onclick="x()">Hi</h1><script>evil()</script>'
+    tiddler.type = 'text/html'
+
+    serializer.object = tiddler
+    output = serializer.to_string()
+    assert '>&lt;h1&gt;Hi&lt;/h1&gt;</content>' in output
+
+
+def test_html_tiddler_too_long():
+    config['atom.sanitize_max_size'] = 5
+    tiddler = Tiddler('html thing', 'fake')
+    tiddler.text = u'<h1>Hi</h1>'
+    tiddler.type = 'text/html'
+
+    serializer.object = tiddler
+    output = serializer.to_string()
+    config.pop('atom.sanitize_max_size')
+    assert '>&lt;pre&gt;&lt;h1&gt;Hi&lt;/h1&gt;&lt;/pre&gt;</content>' in output
+
+
+def test_other_types_not_sanitized():
+    tiddler = Tiddler('html thing', 'fake')
+    tiddler.text = u'<h1>Hi</h1>'
+    tiddler.type = 'text/nothtml'
+
+    serializer.object = tiddler
+    output = serializer.to_string()
+    assert '>&lt;pre&gt;&lt;h1&gt;Hi&lt;/h1&gt;&lt;/pre&gt;</content>' in output
@@ -0,0 +1,53 @@
+"""
+Test that a streamed feed is generated in chunks and matches
+the feed made in one string.
+"""
+
+import types
+
+from tiddlyweb.serializer import Serializer
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.model.collections import Tiddlers
+from tiddlyweb.config import config
+import tiddlywebwiki
+
+def setup_module(module):
+    tiddlywebwiki.init(config)
+    module.serializer = Serializer('tiddlywebplugins.atom.feed',
+            environ={'tiddlyweb.config': config})
+
+def teardown_module(module):
+    config.pop('atom.stream', None)
+
+def _make_tiddlers():
+    tiddlers = Tiddlers(title='streamed')
+    for index in range(5):
+        tiddler = Tiddler('tiddler%s' % index, 'fake')
+        tiddler.text = '!Hi %s' % index
+        tiddler.modifier = 'cdent'
+        tiddler.created = '2012010100000%s' % index
+        tiddler.modified = '2012020100000%s' % index
+        tiddlers.add(tiddler)
+    return tiddlers
+
+def test_stream_matches_string():
+    config['atom.stream'] = False
+    whole = serializer.list_tiddlers(_make_tiddlers())
+
+    config['atom.stream'] = True
+    output = serializer.list_tiddlers(_make_tiddlers())
+    assert isinstance(output, types.GeneratorType)
+
+    chunks = list(output)
+    # header, five entries, closing
+    assert len(chunks) == 7
+    assert chunks[0].startswith('<?xml')
+    assert '<entry>' not in chunks[0]
+    assert chunks[-1] == '</feed>'
+    assert ''.join(chunks) == whole
+
+def test_stream_empty():
+    config['atom.stream'] = True
+    output = ''.join(serializer.list_tiddlers(Tiddlers(title='empty')))
+    assert output.endswith('</feed>')
+    assert '<entry>' not in output
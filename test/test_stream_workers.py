@@ -0,0 +1,145 @@
+"""
+Test that streamed feeds made by the worker pool match those made
+in the response, and that the pool is bounded ahead of the response.
+"""
+
+import threading
+import time
+
+from tiddlyweb.serializer import Serializer
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.model.collections import Tiddlers
+from tiddlyweb.config import config
+import tiddlywebwiki
+
+from tiddlywebplugins.atom.background import (BackgroundChunks,
+        StreamStalled, background_chunks, get_pool)
+
+def setup_module(module):
+    tiddlywebwiki.init(config)
+    module.serializer = Serializer('tiddlywebplugins.atom.feed',
+            environ={'tiddlyweb.config': config})
+
+def teardown_module(module):
+    for key in ['atom.stream', 'atom.stream_workers', 'atom.stream_queue']:
+        config.pop(key, None)
+
+def _make_tiddlers():
+    tiddlers = Tiddlers(title='streamed')
+    for index in range(5):
+        tiddler = Tiddler('tiddler%s' % index, 'fake')
+        tiddler.text = '!Hi %s' % index
+        tiddler.modifier = 'cdent'
+        tiddler.created = '2012010100000%s' % index
+        tiddler.modified = '2012020100000%s' % index
+        tiddlers.add(tiddler)
+    return tiddlers
+
+def test_no_workers():
+    chunks = iter(['a'])
+    assert get_pool({}) is None
+    assert background_chunks({}, chunks) is chunks
+
+def test_workers_match_response():
+    config['atom.stream'] = True
+    config.pop('atom.stream_workers', None)
+    whole = ''.join(serializer.list_tiddlers(_make_tiddlers()))
+
+    config['atom.stream_workers'] = 2
+    output = serializer.list_tiddlers(_make_tiddlers())
+    assert isinstance(output, BackgroundChunks)
+    chunks = list(output)
+    assert len(chunks) == 7
+    assert ''.join(chunks) == whole
+
+def test_made_in_worker():
+    threads = []
+    def chunks():
+        for index in range(3):
+            threads.append(threading.current_thread())
+            yield str(index)
+    config['atom.stream_workers'] = 2
+    assert list(background_chunks(config, chunks())) == ['0', '1', '2']
+    assert threading.current_thread() not in threads
+
+def test_backpressure():
+    made = []
+    def chunks():
+        for index in range(20):
+            made.append(index)
+            yield index
+    output = BackgroundChunks(get_pool({'atom.stream_workers': 2}),
+            chunks(), 2)
+    taken = []
+    for chunk in output:
+        time.sleep(0.01)
+        taken.append(chunk)
+        # two on the queue and one waiting to be put
+        assert len(made) <= len(taken) + 3
+    assert taken == range(20)
+
+def test_close_stops_worker():
+    made = []
+    closed = threading.Event()
+    def chunks():
+        try:
+            for index in range(1000):
+                made.append(index)
+                yield index
+        finally:
+            closed.set()
+    output = BackgroundChunks(get_pool({'atom.stream_workers': 2}),
+            chunks(), 1)
+    iterator = iter(output)
+    assert iterator.next() == 0
+    output.close()
+    assert closed.wait(5)
+    assert len(made) < 5
+
+def test_dropped_wrapper_stops_worker():
+    pool = get_pool({'atom.stream_workers': 1})
+    closed = threading.Event()
+    def chunks():
+        try:
+            for index in range(1000):
+                yield index
+        finally:
+            closed.set()
+    output = BackgroundChunks(pool, chunks(), 1)
+    # as EncodeUTF8 wraps the response, without passing on close()
+    wrapped = (chunk for chunk in output)
+    assert wrapped.next() == 0
+    del wrapped
+    assert closed.wait(5)
+
+    # the only worker is free for the next feed
+    assert list(BackgroundChunks(pool, iter(['a', 'b']), 1)) == ['a', 'b']
+
+def test_stalled_response():
+    def chunks():
+        yield 'one'
+        time.sleep(0.5)
+        yield 'two'
+    output = iter(BackgroundChunks(get_pool({'atom.stream_workers': 2}),
+            chunks(), 1, 0.1))
+    assert output.next() == 'one'
+    try:
+        output.next()
+    except StreamStalled:
+        pass
+    else:
+        assert False, 'stall not raised'
+
+def test_error_raised_in_response():
+    def chunks():
+        yield 'one'
+        raise ValueError('broken store')
+    output = iter(BackgroundChunks(get_pool({'atom.stream_workers': 2}),
+            chunks()))
+    assert output.next() == 'one'
+    try:
+        output.next()
+    except ValueError as exc:
+        assert 'broken store' in str(exc)
+    else:
+        assert False, 'error not raised'
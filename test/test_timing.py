@@ -0,0 +1,156 @@
+"""
+Test that the phases of making a feed are timed and counted
+when atom.timing is on, and sent and logged by FeedTimer.
+"""
+
+import logging
+import shutil
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.collections import Tiddlers
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.serializer import Serializer
+from tiddlyweb.store import Store
+import tiddlywebwiki
+
+from tiddlywebplugins.atom.cache import CACHES
+from tiddlywebplugins.atom.timing import (FeedTimer, FeedTiming, NO_TIMING,
+        TIMING_KEY, register_hooks, start_timing)
+
+
+def setup_module(module):
+    tiddlywebwiki.init(config)
+    register_hooks()
+    shutil.rmtree('store', ignore_errors=True)
+    environ = {'tiddlyweb.config': config}
+    store = Store(config['server_store'][0], config['server_store'][1],
+            environ)
+    module.store = store
+    store.put(Bag('timed'))
+    for index in range(6):
+        tiddler = Tiddler('tiddler%s' % index, 'timed')
+        tiddler.text = '# Heading %s' % index
+        tiddler.type = 'text/x-markdown' if index % 2 else 'text/plain'
+        store.put(tiddler)
+
+
+def teardown_module(module):
+    config.pop('atom.timing', None)
+    config.pop('atom.render_cache', None)
+    CACHES.clear()
+    shutil.rmtree('store', ignore_errors=True)
+
+
+def _feed(**extra):
+    environ = {'tiddlyweb.config': config}
+    environ.update(extra)
+    environ['tiddlyweb.store'] = Store(config['server_store'][0],
+            config['server_store'][1], environ)
+    tiddlers = Tiddlers(store=environ['tiddlyweb.store'])
+    tiddlers.bag = 'timed'
+    for tiddler in store.list_bag_tiddlers(Bag('timed')):
+        tiddlers.add(tiddler)
+    serializer = Serializer('tiddlywebplugins.atom.feed', environ=environ)
+    serializer.list_tiddlers(tiddlers)
+    return environ
+
+
+def test_timing_off():
+    config.pop('atom.timing', None)
+    environ = _feed()
+    assert TIMING_KEY not in environ
+    assert start_timing(environ) is NO_TIMING
+    with NO_TIMING.phase('anything'):
+        NO_TIMING.count('anything')
+
+
+def test_phases_and_counts():
+    config['atom.timing'] = True
+    try:
+        environ = _feed()
+    finally:
+        config.pop('atom.timing', None)
+    timing = environ[TIMING_KEY]
+    for phase in ['filter', 'validate', 'entries', 'render', 'write']:
+        assert phase in timing.durations
+        assert timing.durations[phase] >= 0
+    assert timing.counts['entries'] == 6
+    assert timing.counts['renders'] == 3
+    assert timing.counts['store_gets'] >= 6
+    assert 'cache_hits' not in timing.counts
+
+
+def test_filter_stages():
+    config['atom.timing'] = True
+    default_filter = config.get('atom.default_filter')
+    config['atom.default_filter'] = 'select=type:!text/plain;sort=title;limit=2'
+    try:
+        environ = _feed()
+    finally:
+        config.pop('atom.timing', None)
+        config['atom.default_filter'] = default_filter
+    timing = environ[TIMING_KEY]
+    report = timing.stage_report()
+    assert [(name, selectivity) for name, _, selectivity in report] == [
+            ('load', '?/6'), ('select=type:!text/plain', '6/3'),
+            ('sort_limit=title;2', '3/2')]
+    assert all(seconds >= 0 for _, seconds, _ in report)
+    server_timing = timing.server_timing()
+    assert 'stage1;desc="select=type:!text/plain 6/3";dur=' in server_timing
+    assert 'stage2;desc="sort_limit=title;2 3/2";dur=' in server_timing
+
+
+def test_cache_hits_counted():
+    config['atom.timing'] = True
+    config['atom.render_cache'] = 'memory'
+    try:
+        _feed()
+        environ = _feed()
+    finally:
+        config.pop('atom.timing', None)
+        config.pop('atom.render_cache', None)
+    timing = environ[TIMING_KEY]
+    assert timing.counts['cache_hits'] == 3
+    assert 'renders' not in timing.counts
+
+
+def test_server_timing_and_log():
+    records = []
+
+    class Handler(logging.Handler):
+        def emit(self, record):
+            records.append(record.getMessage())
+
+    logger = logging.getLogger('tiddlywebplugins.atom.timing')
+    handler = Handler()
+    logger.addHandler(handler)
+    old_level = logger.level
+    logger.setLevel(logging.INFO)
+
+    def app(environ, start_response):
+        timing = environ[TIMING_KEY] = FeedTiming()
+        with timing.phase('filter'):
+            pass
+        timing.count('entries', 2)
+        start_response('200 OK', [('Content-Type', 'application/atom+xml')])
+        return ['<feed/>']
+
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['headers'] = dict(headers)
+
+    try:
+        environ = {'PATH_INFO': '/bags/timed/tiddlers.atom'}
+        output = ''.join(FeedTimer(app)(environ, start_response))
+    finally:
+        logger.removeHandler(handler)
+        logger.setLevel(old_level)
+
+    assert output == '<feed/>'
+    assert response['headers']['Server-Timing'].startswith('filter;dur=')
+    assert len(records) == 1
+    assert 'uri=/bags/timed/tiddlers.atom' in records[0]
+    assert 'entries=2' in records[0]
+    assert 'filter=' in records[0]
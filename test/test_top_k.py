@@ -0,0 +1,122 @@
+"""
+Test that sort and limit filters done as a top k selection
+give the same results as the filters themselves.
+"""
+
+import random
+
+import py.test
+
+from tiddlyweb.filters import (parse_for_filters, recursive_filter,
+        FilterError, FILTER_PARSERS)
+from tiddlyweb.model.tiddler import Tiddler
+
+from tiddlywebplugins.atom.filters import (optimize_filters,
+        compiled_filters, COMPILED)
+
+
+def setup_module(module):
+    random.seed(1)
+    tiddlers = []
+    for index in range(200):
+        tiddler = Tiddler('tiddler%s' % index, 'fake')
+        # plenty of ties to check stability
+        tiddler.modified = '201201%02d000000' % random.randint(1, 10)
+        tiddler.tags = ['tag%s' % (index % 3)]
+        tiddlers.append(tiddler)
+    module.tiddlers = tiddlers
+
+
+def _titles(filter_string, optimize):
+    filters, _ = parse_for_filters(filter_string)
+    if optimize:
+        filters = optimize_filters(filters)
+    return [tiddler.title for tiddler in recursive_filter(filters, tiddlers)]
+
+
+def test_filters_replaced():
+    filters, _ = parse_for_filters('select=tag:tag1;sort=-modified;limit=20')
+    optimized = optimize_filters(filters)
+    assert len(optimized) == 2
+    assert optimized[0] is filters[0]
+    assert optimized[1][1] == ('sort_limit', '-modified;20')
+
+
+def test_not_replaced():
+    filters, _ = parse_for_filters('limit=20;sort=-modified')
+    assert optimize_filters(filters) == filters
+
+
+def test_same_results():
+    for filter_string in ['sort=-modified;limit=20',
+            'sort=modified;limit=20',
+            'sort=title;limit=5,10',
+            'select=tag:!tag1;sort=-modified;limit=7',
+            'sort=-modified;limit=0',
+            'sort=-modified;limit=500',
+            'sort=-modified;limit=150,100',
+            'sort=title;limit=5,-3']:
+        assert (_titles(filter_string, True)
+                == _titles(filter_string, False)), filter_string
+
+
+def test_bad_attribute():
+    py.test.raises(FilterError, '_titles("sort=nothing;limit=5", True)')
+
+
+def test_negative_limit():
+    for filter_string in ['sort=-modified;limit=-2,5',
+            'sort=-modified;limit=-1', 'sort=title;limit=2,-3']:
+        py.test.raises(FilterError, '_titles(filter_string, False)')
+        py.test.raises(FilterError, '_titles(filter_string, True)')
+
+
+def test_compiled_once():
+    COMPILED.clear()
+    first_environ = {'first': True}
+    second_environ = {'second': True}
+    first = compiled_filters('select=tag:tag1;sort=-modified;limit=7',
+            first_environ)
+    second = compiled_filters('select=tag:tag1;sort=-modified;limit=7',
+            second_environ)
+    assert len(COMPILED) == 1
+    assert [spec for _, spec, _ in first] == [('select', 'tag:tag1'),
+            ('sort_limit', '-modified;7')]
+    assert [function for function, _, _ in first] == [function
+            for function, _, _ in second]
+    assert [environ for _, _, environ in first] == [first_environ] * 2
+    assert [environ for _, _, environ in second] == [second_environ] * 2
+    assert ([tiddler.title for tiddler in recursive_filter(second, tiddlers)]
+            == _titles('select=tag:tag1;sort=-modified;limit=7', False))
+
+
+def test_compiled_parsers_change():
+    COMPILED.clear()
+    compiled_filters('sort=-modified;limit=7', {})
+    original = FILTER_PARSERS['sort']
+    FILTER_PARSERS['sort'] = lambda argument: original(argument)
+    try:
+        filters = compiled_filters('sort=-modified;limit=7', {})
+    finally:
+        FILTER_PARSERS['sort'] = original
+    assert len(COMPILED) == 2
+    assert [spec for _, spec, _ in filters] == [('sort', '-modified'),
+            ('limit', '7')]
+
+
+def test_compiled_other_parsers_change():
+    COMPILED.clear()
+    compiled_filters('sort=-modified;limit=7', {})
+    FILTER_PARSERS['unused'] = lambda argument: None
+    try:
+        compiled_filters('sort=-modified;limit=7', {})
+        assert len(COMPILED) == 1
+
+        # a name that was left over now has a parser
+        compiled_filters('unused=1;limit=7', {})
+        del FILTER_PARSERS['unused']
+        filters = compiled_filters('unused=1;limit=7', {})
+    finally:
+        FILTER_PARSERS.pop('unused', None)
+    assert len(COMPILED) == 3
+    assert [spec for _, spec, _ in filters] == [('limit', '7')]
@@ -0,0 +1,172 @@
+"""
+Test that changes to tiddlers are gathered for each topic and sent
+to a hub as fat pings, using a stand-in hub on a local port.
+"""
+
+import shutil
+import threading
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from urlparse import urlparse, parse_qs
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.policy import Policy
+from tiddlyweb.model.recipe import Recipe
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import Store
+
+from tiddlywebplugins.atom.websub import (Publisher, PUBLISHERS,
+        get_publisher, register_hooks)
+
+
+PUBLIC_TOPIC = 'http://0.0.0.0:8080/bags/public/tiddlers.atom'
+RECIPE_TOPIC = 'http://0.0.0.0:8080/recipes/news/tiddlers.atom'
+
+
+class StandInHub(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        query = parse_qs(urlparse(self.path).query)
+        hub.pings.append((query, dict(self.headers), body))
+        hub.gate.wait(5)
+        status = hub.statuses.pop(0) if hub.statuses else 204
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def setup_module(module):
+    shutil.rmtree('store', ignore_errors=True)
+    server = HTTPServer(('127.0.0.1', 0), StandInHub)
+    server.pings = []
+    server.statuses = []
+    server.gate = threading.Event()
+    server.gate.set()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    module.hub = server
+
+    config['atom.hub'] = 'http://127.0.0.1:%s/hub' % server.server_port
+    config['atom.hub_publish'] = True
+    config['atom.hub_window'] = 0.05
+    config['atom.hub_retry_delay'] = 0.01
+    register_hooks()
+    module.store = Store(config['server_store'][0],
+            config['server_store'][1], {'tiddlyweb.config': config})
+    store.put(Bag('public'))
+    private = Bag('private')
+    private.policy = Policy(read=['cdent'])
+    store.put(private)
+    recipe = Recipe('news')
+    recipe.set_recipe([('public', '')])
+    store.put(recipe)
+    module.publisher = get_publisher(config)
+    publisher.flush()
+
+
+def teardown_module(module):
+    for key in ['atom.hub', 'atom.hub_publish', 'atom.hub_window',
+            'atom.hub_retry_delay', 'atom.hub_topics']:
+        config.pop(key, None)
+    PUBLISHERS.clear()
+    hub.shutdown()
+    shutil.rmtree('store', ignore_errors=True)
+
+
+def setup_function(function):
+    del hub.pings[:]
+    del hub.statuses[:]
+    config.pop('atom.hub_topics', None)
+
+
+def _put(title, bag='public'):
+    tiddler = Tiddler(title, bag)
+    tiddler.text = u'hello from %s' % title
+    store.put(tiddler)
+    return tiddler
+
+
+def test_changes_coalesced():
+    for index in range(3):
+        _put('tiddler%s' % index)
+    publisher.flush()
+
+    assert len(hub.pings) == 1
+    query, headers, body = hub.pings[0]
+    assert query == {'hub.mode': ['publish'], 'hub.url': [PUBLIC_TOPIC]}
+    assert headers['content-type'].startswith('application/atom+xml')
+    assert '<%s>; rel="self"' % PUBLIC_TOPIC in headers['link']
+    assert body.count('<entry>') == 3
+    for index in range(3):
+        assert 'hello from tiddler%s' % index in body
+
+
+def test_delete_sent_without_entry():
+    tiddler = _put('gone')
+    publisher.flush()
+    store.delete(tiddler)
+    publisher.flush()
+
+    assert len(hub.pings) == 2
+    assert 'gone' in hub.pings[0][2]
+    assert '<entry>' not in hub.pings[1][2]
+
+
+def test_private_not_sent():
+    _put('secret', 'private')
+    publisher.flush()
+    assert hub.pings == []
+
+
+def test_configured_topics():
+    config['atom.hub_topics'] = ['/recipes/news/tiddlers.atom',
+            '/bags/other/tiddlers.atom']
+    _put('news')
+    publisher.flush()
+
+    assert [query['hub.url'] for query, _, _ in hub.pings] == [[RECIPE_TOPIC]]
+
+
+def test_retried_on_server_error():
+    hub.statuses.extend([503, 502])
+    _put('retried')
+    publisher.flush()
+    assert len(hub.pings) == 3
+    assert all('retried' in body for _, _, body in hub.pings)
+
+
+def test_not_retried_when_refused():
+    hub.statuses.append(400)
+    _put('refused')
+    publisher.flush()
+    assert len(hub.pings) == 1
+
+
+def test_queue_bounded():
+    bounded = Publisher(dict(config, **{'atom.hub_queue': 1,
+        'atom.hub_window': 60}))
+    for bag_name in ['one', 'two', 'three']:
+        store.put(Bag(bag_name))
+        bounded.changed(store, Tiddler('tiddler', bag_name))
+    hub.gate.clear()
+    try:
+        bounded._release('/bags/one/tiddlers.atom')
+        for _ in range(500):
+            if hub.pings:
+                break
+            hub.gate.wait(0.01)
+        # one being sent, one waiting, and the third dropped
+        bounded._release('/bags/two/tiddlers.atom')
+        bounded._release('/bags/three/tiddlers.atom')
+    finally:
+        hub.gate.set()
+    bounded.flush()
+
+    assert [query['hub.url'][0].split('/')[-2] for query, _, _
+            in hub.pings] == ['one', 'two']
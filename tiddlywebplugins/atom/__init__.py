@@ -21,7 +21,51 @@ SERIALIZERS = {
 
 def init(config):
     """
-    Update serialization info to include atom.
+    Update serialization info to include atom and add the
+    middleware which sets feed validators on responses, and
+    if configured the middleware which compresses or times feeds.
+    If a render or diff cache, the recent index or hot feeds are
+    configured, register the store hooks which keep them current,
+    and if a store gets budget is set the hook which counts them.
+    If publishing to a hub is configured, register the hooks which
+    notify it of changes.
+    If aggregates or history feeds are configured, add their routes.
     """
+    from tiddlywebplugins.atom.conditional import FeedValidator
     config['extension_types'].update(EXTENSION_TYPES)
     config['serializers'].update(SERIALIZERS)
+    if FeedValidator not in config['server_response_filters']:
+        config['server_response_filters'].insert(0, FeedValidator)
+    if config.get('atom.gzip'):
+        from tiddlywebplugins.atom.compress import FeedCompressor
+        if FeedCompressor not in config['server_response_filters']:
+            config['server_response_filters'].insert(0, FeedCompressor)
+    if config.get('atom.timing'):
+        from tiddlywebplugins.atom.timing import FeedTimer, register_hooks
+        if FeedTimer not in config['server_response_filters']:
+            config['server_response_filters'].insert(0, FeedTimer)
+        register_hooks()
+    if config.get('atom.aggregates') and 'selector' in config:
+        from tiddlywebplugins.atom.aggregate import (AGGREGATE_ROUTE,
+                get_aggregate)
+        config['selector'].add(AGGREGATE_ROUTE, GET=get_aggregate)
+    if config.get('atom.history') and 'selector' in config:
+        from tiddlywebplugins.atom.history import HISTORY_ROUTE, get_history
+        config['selector'].add(HISTORY_ROUTE, GET=get_history)
+    if config.get('atom.budget_store_gets') is not None:
+        from tiddlywebplugins.atom.budget import register_hooks
+        register_hooks()
+    if config.get('atom.render_cache') or config.get('atom.diff_cache'):
+        from tiddlywebplugins.atom.cache import register_hooks
+        register_hooks()
+    if config.get('atom.recent_index'):
+        from tiddlywebplugins.atom.recent import register_hooks
+        register_hooks()
+    if config.get('atom.hub_publish'):
+        from tiddlywebplugins.atom.websub import register_hooks
+        register_hooks()
+    if config.get('atom.hot_feeds'):
+        from tiddlywebplugins.atom.hot import HotFeeds, register_hooks
+        if HotFeeds not in config['server_response_filters']:
+            config['server_response_filters'].append(HotFeeds)
+        register_hooks()
@@ -0,0 +1,182 @@
+"""
+Feeds of the newest tiddlers across several bags.
+
+Name sets of bags in 'atom.aggregates':
+
+    'atom.aggregates': {'news': ['announcements', 'blog', 'releases']},
+
+and /aggregates/news/tiddlers.atom is a feed of the most recently
+modified tiddlers in those bags, newest first. The reader must be able
+to read every bag.
+
+Rather than gathering every tiddler of every bag and sorting them all,
+each bag gives its tiddlers newest first and the k bags are merged
+with a heap, stopping once the feed has enough. Tiddlers are loaded
+from the store only as the merge takes them. With 'atom.recent_index'
+set each bag's order comes from its index (see
+tiddlywebplugins.atom.recent) and the merge costs O(limit log k);
+without it each bag is read once to order it.
+
+If 'atom.default_filter' is select filters then 'sort=-modified' and a
+limit, as for the recent index, the select filters are applied as the
+merge goes and the merge stops at the limit. Otherwise the merge stops
+at 'atom.aggregate_limit' (default 20) tiddlers and the default filter
+is applied to those as for any other feed.
+"""
+
+import heapq
+import itertools
+
+from httpexceptor import HTTP404
+
+from tiddlyweb.filters import recursive_filter
+from tiddlyweb.filters.sort import date_to_canonical
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.collections import Tiddlers
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import NoBagError, StoreError
+from tiddlyweb.web.sendtiddlers import send_tiddlers
+from tiddlyweb.web.util import get_route_value
+
+from tiddlywebplugins.atom.filters import compiled_filters
+from tiddlywebplugins.atom.recent import (bag_tiddlers, get_index,
+        recent_limit)
+
+
+AGGREGATE_ROUTE = '/aggregates/{aggregate_name:segment}/tiddlers[.{format}]'
+
+DEFAULT_LIMIT = 20
+
+FILTERED_KEY = 'tiddlyweb.atom.filtered'
+
+
+def get_aggregate(environ, start_response):
+    """
+    Send the tiddlers of the aggregate named in the route.
+    """
+    name = get_route_value(environ, 'aggregate_name')
+    config = environ['tiddlyweb.config']
+    try:
+        bag_names = config.get('atom.aggregates', {})[name]
+    except KeyError:
+        raise HTTP404('aggregate %s not found' % name)
+
+    store = environ['tiddlyweb.store']
+    usersign = environ['tiddlyweb.usersign']
+    for bag_name in bag_names:
+        try:
+            bag = store.get(Bag(bag_name))
+        except NoBagError as exc:
+            raise HTTP404('aggregate %s bag %s not found, %s'
+                    % (name, bag_name, exc))
+        bag.policy.allows(usersign, 'read')
+
+    tiddlers = Tiddlers(title=name, store=store)
+    for tiddler in aggregate_tiddlers(environ, bag_names):
+        tiddlers.add(tiddler)
+    return send_tiddlers(environ, start_response, tiddlers=tiddlers)
+
+
+def aggregate_tiddlers(environ, bag_names):
+    """
+    Return the newest tiddlers in bag_names, newest first, loaded
+    from the store, as many as the default filter or the aggregate
+    limit allows.
+    """
+    store = environ['tiddlyweb.store']
+    tiddlers = _loaded(store, merge_newest([bag_order(environ, bag_name)
+        for bag_name in bag_names]))
+    return take_newest(environ, tiddlers, 'atom.aggregate_limit')
+
+
+def take_newest(environ, tiddlers, limit_key):
+    """
+    Return as many of tiddlers, an iterator newest first, as the
+    default filter or the config limit_key allows. If the default
+    filter is select filters then a sort on -modified and a limit,
+    the select filters are applied here and FILTERED_KEY is set so
+    the feed does not apply it again.
+    """
+    config = environ.get('tiddlyweb.config', {})
+    filters = compiled_filters(config.get('atom.default_filter', ''),
+            environ)
+    limit = recent_limit(filters)
+    if limit is None:
+        start, count = 0, int(config.get(limit_key, DEFAULT_LIMIT))
+    else:
+        start, count = limit
+        tiddlers = recursive_filter(filters[:-1], tiddlers)
+        environ[FILTERED_KEY] = True
+    return list(itertools.islice(tiddlers, start, start + count))
+
+
+def merge_newest(orders):
+    """
+    Merge orders, each an iterator of (key, title, bag, revision)
+    in key order, into one iterator in key order, reading from
+    each only as far as is needed.
+    """
+    heap = []
+    for position, order in enumerate(orders):
+        for record in order:
+            heap.append(((record[0], position), record, order))
+            break
+    heapq.heapify(heap)
+    while heap:
+        (_, position), record, order = heap[0]
+        yield record
+        for record in order:
+            heapq.heapreplace(heap, ((record[0], position), record, order))
+            break
+        else:
+            heapq.heappop(heap)
+
+
+def bag_order(environ, bag_name):
+    """
+    Yield a (key, title, bag, revision) for each tiddler in
+    bag_name, newest first, from the recent index when there is
+    one and after that from the whole bag.
+    """
+    config = environ.get('tiddlyweb.config', {})
+    store = environ['tiddlyweb.store']
+    seen = set()
+    if config.get('atom.recent_index', False):
+        index = get_index(config)
+        records = index.read(bag_name)
+        if records is None:
+            records = index.build(store, bag_name)
+        for title, revision, modified, _ in records:
+            seen.add(title)
+            yield newest_first_key(modified), title, bag_name, revision
+        if len(records) < index.size:
+            return
+
+    records = []
+    for tiddler in bag_tiddlers(store, bag_name):
+        if tiddler.title not in seen:
+            records.append((newest_first_key(tiddler.modified), tiddler.title,
+                bag_name, tiddler.revision))
+    records.sort()
+    for record in records:
+        yield record
+
+
+def _loaded(store, records):
+    for _, title, bag_name, revision in records:
+        tiddler = Tiddler(title, bag_name)
+        tiddler.revision = revision
+        try:
+            yield store.get(tiddler)
+        except StoreError:
+            continue
+
+
+def newest_first_key(modified):
+    """
+    A key which sorts later modified times first.
+    """
+    try:
+        return -int(date_to_canonical(u'%s' % modified))
+    except ValueError:
+        return 0
@@ -0,0 +1,165 @@
+"""
+Make streamed feeds in worker threads, a chunk ahead of the response.
+
+A streamed feed (see 'atom.stream') makes each entry as the server asks
+for it, so the reads from the store and the rendering for the entry,
+and for a depth feed the revisions and diffs, happen in the thread
+serving the response. If 'atom.stream_workers' is set in config to a
+number above zero, streamed feeds are instead made by a pool of that
+many threads, shared by all requests:
+
+    each feed is made by one worker, which puts its chunks, the feed
+    header and then one per entry, on a queue of at most
+    'atom.stream_queue' chunks (default 16) and waits when the queue
+    is full, so a slow client holds back the making of its feed
+
+    the response takes chunks from the queue as the server sends them,
+    waiting between entries rather than doing the work itself
+
+    at most 'atom.stream_workers' feeds are made at once, and those
+    after them wait, in the order they came, for a worker to be free
+
+If the response is closed or dropped early, because the client has
+gone, the worker stops at its next chunk. This does not depend on the
+server calling close() on the response, which middleware that wraps
+the response in a generator, such as tiddlyweb's EncodeUTF8, does not
+pass on. An exception in the worker is raised in the response, as is
+StreamStalled if the response waits more than 'atom.stream_timeout'
+seconds (default 60) for a chunk, for example while every worker is
+busy; the worker is then told to stop.
+
+This is Python 2, which has no async generators: the worker pool and
+bounded queue give the same bounded concurrency and backpressure to
+any WSGI server. Pools are created on first use and kept for the life
+of the process.
+"""
+
+import sys
+import threading
+
+from multiprocessing.pool import ThreadPool
+from Queue import Queue, Empty, Full
+
+
+DEFAULT_QUEUE = 16
+DEFAULT_TIMEOUT = 60
+
+# how often a worker waiting on a full queue checks if it is cancelled
+PUT_TIMEOUT = 1.0
+
+POOLS = {}
+POOLS_LOCK = threading.Lock()
+
+_DONE = object()
+
+
+class StreamStalled(IOError):
+    """
+    No chunk of a streamed feed was made in time.
+    """
+    pass
+
+
+class _Failure(object):
+
+    __slots__ = ('exc_info',)
+
+    def __init__(self, exc_info):
+        self.exc_info = exc_info
+
+
+class BackgroundChunks(object):
+    """
+    An iterator over chunks which are made by a worker of pool,
+    at most size chunks ahead, waiting at most timeout seconds
+    for each.
+    """
+
+    def __init__(self, pool, chunks, size=DEFAULT_QUEUE,
+            timeout=DEFAULT_TIMEOUT):
+        self.queue = Queue(size)
+        self.timeout = timeout
+        self.cancelled = threading.Event()
+        pool.apply_async(self._produce, (chunks,))
+
+    def __iter__(self):
+        # the finally runs when the iterator is closed or collected,
+        # even if close() is not passed on to this object
+        try:
+            while True:
+                try:
+                    chunk = self.queue.get(timeout=self.timeout)
+                except Empty:
+                    raise StreamStalled('no feed chunk made in %s seconds'
+                            % self.timeout)
+                if chunk is _DONE:
+                    return
+                if isinstance(chunk, _Failure):
+                    exc_type, exc_value, traceback = chunk.exc_info
+                    raise exc_type, exc_value, traceback
+                yield chunk
+        finally:
+            self.cancelled.set()
+
+    def close(self):
+        """
+        Stop the worker making any more chunks.
+        """
+        self.cancelled.set()
+
+    def _produce(self, chunks):
+        try:
+            if self.cancelled.is_set():
+                # the response went while waiting for a worker
+                return
+            for chunk in chunks:
+                if not self._put(chunk):
+                    return
+            self._put(_DONE)
+        except Exception:
+            self._put(_Failure(sys.exc_info()))
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+
+    def _put(self, chunk):
+        """
+        Put chunk on the queue, waiting while it is full. Return
+        False if cancelled first.
+        """
+        while not self.cancelled.is_set():
+            try:
+                self.queue.put(chunk, timeout=PUT_TIMEOUT)
+                return True
+            except Full:
+                continue
+        return False
+
+
+def get_pool(config):
+    """
+    Return the pool of feed workers configured in config, creating
+    it on first use, or None if feeds are made in the response.
+    """
+    workers = int(config.get('atom.stream_workers', 0) or 0)
+    if workers <= 0:
+        return None
+    with POOLS_LOCK:
+        try:
+            return POOLS[workers]
+        except KeyError:
+            pool = POOLS[workers] = ThreadPool(workers)
+            return pool
+
+
+def background_chunks(config, chunks):
+    """
+    Return chunks, made by a feed worker if there is a pool of
+    them, otherwise as they are.
+    """
+    pool = get_pool(config)
+    if pool is None:
+        return chunks
+    return BackgroundChunks(pool, chunks,
+            int(config.get('atom.stream_queue', DEFAULT_QUEUE)),
+            float(config.get('atom.stream_timeout', DEFAULT_TIMEOUT)))
@@ -0,0 +1,142 @@
+"""
+Limits on the work done for one feed.
+
+A feed of a huge recipe, or one with a deep depth argument, can keep a
+worker busy for seconds. Any of these may be set in config to bound
+the work of a feed:
+
+    'atom.budget_entries'     entries given full content
+    'atom.budget_bytes'       characters of content
+    'atom.budget_seconds'     seconds since the entries were started
+    'atom.budget_store_gets'  tiddlers read from the store
+
+The budget is started once the tiddlers of the feed are selected, so
+filtering, sorting and paging them spend none of it. Once one of them
+runs out, each remaining entry, including each remaining revision of a
+depth feed, is a summary entry of its title, link, author and dates,
+with no content. The feed is still complete
+and valid, and what is left costs little more than reading the
+tiddlers.
+
+A feed cut short by its budget is not the whole feed, so it is sent
+with the weak form of its ETag, which still lets a reader revalidate
+it, and is neither kept in the gzip cache nor made into a hot feed
+file. A streamed feed has sent its headers before it knows, so it
+keeps its strong ETag.
+
+When none is set the serialization uses NO_BUDGET, which never runs
+out.
+"""
+
+import logging
+import time
+
+from tiddlyweb.store import HOOKS
+
+
+BUDGET_KEY = 'tiddlyweb.atom.budget'
+
+LIMITS = [
+        ('entries', 'atom.budget_entries', int),
+        ('bytes', 'atom.budget_bytes', int),
+        ('seconds', 'atom.budget_seconds', float),
+        ('store_gets', 'atom.budget_store_gets', int),
+]
+
+LOGGER = logging.getLogger(__name__)
+
+
+class FeedBudget(object):
+    """
+    What one feed may still spend, and what it has spent.
+    """
+
+    def __init__(self, limits):
+        self.limits = limits
+        self.started = time.time()
+        self.entries = 0
+        self.bytes = 0
+        self.store_gets = 0
+        self.exhausted = None
+
+    def spent(self):
+        """
+        True if any of the budgets has run out. The first one
+        to do so is kept as exhausted.
+        """
+        if self.exhausted:
+            return True
+        for name, limit in self.limits:
+            if name == 'seconds':
+                used = time.time() - self.started
+            else:
+                used = getattr(self, name)
+            if used >= limit:
+                self.exhausted = name
+                LOGGER.info('atom feed %s budget of %s spent, sending '
+                        'summary entries', name, limit)
+                return True
+        return False
+
+    def charge(self, description):
+        """
+        Count an entry given description as its content.
+        """
+        self.entries += 1
+        if description:
+            self.bytes += len(description)
+
+
+class _NoBudget(object):
+    """
+    Stands in for FeedBudget when no budget is set.
+    """
+
+    __slots__ = ()
+
+    exhausted = None
+
+    def spent(self):
+        return False
+
+    def charge(self, description):
+        pass
+
+
+NO_BUDGET = _NoBudget()
+
+
+def start_budget(environ):
+    """
+    Return a new FeedBudget, kept in environ, if any budget is
+    set in config, otherwise NO_BUDGET.
+    """
+    config = environ.get('tiddlyweb.config', {})
+    limits = [(name, convert(config[key])) for name, key, convert
+            in LIMITS if config.get(key) is not None]
+    if not limits:
+        return NO_BUDGET
+    budget = environ[BUDGET_KEY] = FeedBudget(limits)
+    return budget
+
+
+def cut_short(environ):
+    """
+    True if the feed made for environ ran out of budget.
+    """
+    budget = environ.get(BUDGET_KEY)
+    return budget is not None and budget.exhausted is not None
+
+
+def register_hooks():
+    """
+    Add the store HOOK which counts tiddler gets.
+    """
+    if _count_get not in HOOKS['tiddler']['get']:
+        HOOKS['tiddler']['get'].append(_count_get)
+
+
+def _count_get(store, tiddler):
+    budget = store.environ.get(BUDGET_KEY)
+    if budget is not None:
+        budget.store_gets += 1
@@ -0,0 +1,303 @@
+"""
+Caches of rendered tiddler content and revision diffs for Atom feeds.
+
+Rendering wikitext or markdown is by far the most expensive part of
+making a feed, yet feed readers poll the same unchanged tiddlers again
+and again. When 'atom.render_cache' is set in config, the HTML made for
+each renderable tiddler is kept, keyed on bag, title, revision and
+render type, and reused on later requests.
+
+Rendering can depend on the request as well as the tiddler: links and
+transclusion resolve through the tiddler's recipe, and what is
+transcluded depends on what the current user may read. So the key
+also holds the recipe and the name of the user. A tiddler whose text
+may transclude another, holding one of TRANSCLUSION_MARKERS, is not
+cached at all, since the other tiddler can change without changing
+the key.
+
+Two backends are provided:
+
+    'atom.render_cache': 'memory'
+
+keeps a size bounded least recently used cache in the process. Its
+size is set with 'atom.render_cache_size' (default 1000 entries).
+
+    'atom.render_cache': 'disk'
+
+keeps one file per entry below 'atom.render_cache_dir' (default
+'atomcache', relative to the instance). An entry which can not be
+written is logged and skipped.
+
+Any other value is taken as the name of a module which provides a
+Cache class with the same interface as MemoryCache.
+
+In the same way 'atom.diff_cache', with 'atom.diff_cache_size' and
+'atom.diff_cache_dir', keeps the diffs between tiddler revisions made
+for feeds with a depth argument, keyed on bag, title and the two
+revisions compared. Old revisions never change so these can be kept
+for a long time; 'disk' is a good choice.
+
+When a tiddler is put the store HOOKS remove its rendered content.
+When a tiddler or bag is deleted its entries are removed from both
+caches. Since the revision is part of the key, other processes will
+not serve stale content for stores which increment revisions.
+
+Each cache counts its hits and misses, available from stats().
+"""
+
+import logging
+import os
+import shutil
+import threading
+
+from collections import OrderedDict
+
+from tiddlyweb.store import HOOKS
+from tiddlyweb.util import sha, read_utf8_file, write_utf8_file
+
+
+LOGGER = logging.getLogger(__name__)
+
+RENDER_CACHE = 'atom.render_cache'
+DIFF_CACHE = 'atom.diff_cache'
+
+DEFAULT_SIZE = 1000
+DEFAULT_DIR = {
+        RENDER_CACHE: 'atomcache',
+        DIFF_CACHE: 'atomdiffcache',
+}
+
+# markdown {{transclusion}} and the wikitext tiddler macro
+TRANSCLUSION_MARKERS = (u'{{', u'<<tiddler')
+
+CACHES = {}
+
+
+class MemoryCache(object):
+    """
+    A least recently used cache of content held in memory.
+    """
+
+    def __init__(self, config, name=RENDER_CACHE):
+        self.size = int(config.get(name + '_size', DEFAULT_SIZE))
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._titles = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Return the content stored at key, or None.
+        """
+        with self._lock:
+            try:
+                content = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            self._entries[key] = content
+            self.hits += 1
+            return content
+
+    def put(self, key, content):
+        """
+        Store content at key, evicting the least recently
+        used entry if the cache is full.
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = content
+            self._titles.setdefault(key[:2], set()).add(key)
+            while len(self._entries) > self.size:
+                old_key, _ = self._entries.popitem(last=False)
+                self._forget(old_key)
+
+    def invalidate(self, bag, title=None):
+        """
+        Remove all entries for the tiddler title in bag, or
+        for the entire bag if title is None.
+        """
+        with self._lock:
+            if title is None:
+                groups = [group for group in self._titles
+                        if group[0] == bag]
+            else:
+                groups = [(bag, title)]
+            for group in groups:
+                for key in self._titles.pop(group, ()):
+                    self._entries.pop(key, None)
+
+    def stats(self):
+        """
+        Report on the use of the cache.
+        """
+        return {'hits': self.hits, 'misses': self.misses,
+                'entries': len(self._entries)}
+
+    def _forget(self, key):
+        group = self._titles.get(key[:2])
+        if group is not None:
+            group.discard(key)
+            if not group:
+                del self._titles[key[:2]]
+
+
+class DiskCache(object):
+    """
+    A cache of content stored in files, one directory
+    per bag, one directory per tiddler.
+    """
+
+    def __init__(self, config, name=RENDER_CACHE):
+        self.root = config.get(name + '_dir', DEFAULT_DIR[name])
+        if not os.path.isabs(self.root):
+            self.root = os.path.join(config.get('root_dir', ''), self.root)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Return the content stored at key, or None.
+        """
+        try:
+            content = read_utf8_file(self._path(key))
+        except (IOError, OSError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return content
+
+    def put(self, key, content):
+        """
+        Store content at key. The file is written to the side
+        and then moved into place so readers never see a partial
+        entry.
+        """
+        path = self._path(key)
+        directory = os.path.dirname(path)
+        temp_path = '%s.%s.tmp' % (path, threading.current_thread().ident)
+        try:
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+            write_utf8_file(temp_path, content)
+            os.rename(temp_path, path)
+        except (IOError, OSError) as exc:
+            LOGGER.warn('unable to write cache entry %s: %s', path, exc)
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+
+    def invalidate(self, bag, title=None):
+        """
+        Remove all entries for the tiddler title in bag, or
+        for the entire bag if title is None.
+        """
+        if title is None:
+            path = os.path.join(self.root, _digest(bag))
+        else:
+            path = os.path.join(self.root, _digest(bag), _digest(title))
+        shutil.rmtree(path, ignore_errors=True)
+
+    def stats(self):
+        """
+        Report on the use of the cache.
+        """
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def _path(self, key):
+        bag, title = key[:2]
+        return os.path.join(self.root, _digest(bag), _digest(title),
+                _digest(u':'.join(u'%s' % part for part in key[2:])))
+
+
+BACKENDS = {
+        'memory': MemoryCache,
+        'disk': DiskCache,
+}
+
+
+def get_cache(config, name=RENDER_CACHE):
+    """
+    Return the cache configured at name in config, creating it
+    on first use. Return None if no cache is configured.
+    """
+    backend = config.get(name, None)
+    if not backend:
+        return None
+    try:
+        return CACHES[(name, backend)]
+    except KeyError:
+        try:
+            cache_class = BACKENDS[backend]
+        except KeyError:
+            module = __import__(backend, {}, {}, ['Cache'])
+            cache_class = module.Cache
+        cache = CACHES[(name, backend)] = cache_class(config, name)
+        return cache
+
+
+def cache_key(tiddler, environ):
+    """
+    The key for the rendered content of tiddler in the request
+    environ, or None if it has no revision with which to identify
+    its content or its content may depend on other tiddlers.
+    """
+    if not tiddler.revision or not tiddler.bag:
+        return None
+    text = tiddler.text or u''
+    for marker in TRANSCLUSION_MARKERS:
+        if marker in text:
+            return None
+    username = environ.get('tiddlyweb.usersign', {}).get('name', u'GUEST')
+    return (tiddler.bag, tiddler.title, u'%s' % tiddler.revision,
+            tiddler.type or u'default', tiddler.recipe or u'', username)
+
+
+def diff_key(tiddler, older_revision, newer_revision):
+    """
+    The key for the diff between two revisions of tiddler.
+    """
+    return (tiddler.bag, tiddler.title, u'%s' % older_revision,
+            u'%s' % newer_revision)
+
+
+def register_hooks():
+    """
+    Add the store HOOKS that keep the caches current.
+    """
+    for method, hook in [('put', _tiddler_put),
+            ('delete', _tiddler_deleted)]:
+        if hook not in HOOKS['tiddler'][method]:
+            HOOKS['tiddler'][method].append(hook)
+    if _bag_deleted not in HOOKS['bag']['delete']:
+        HOOKS['bag']['delete'].append(_bag_deleted)
+
+
+def _tiddler_put(store, tiddler):
+    _invalidate(store, [RENDER_CACHE], tiddler.bag, tiddler.title)
+
+
+def _tiddler_deleted(store, tiddler):
+    _invalidate(store, [RENDER_CACHE, DIFF_CACHE], tiddler.bag,
+            tiddler.title)
+
+
+def _bag_deleted(store, bag):
+    _invalidate(store, [RENDER_CACHE, DIFF_CACHE], bag.name)
+
+
+def _invalidate(store, names, bag, title=None):
+    config = store.environ.get('tiddlyweb.config', {})
+    for name in names:
+        cache = get_cache(config, name)
+        if cache is not None:
+            cache.invalidate(bag, title)
+
+
+def _digest(value):
+    return sha(value).hexdigest()
@@ -0,0 +1,196 @@
+"""
+Gzip compressed feed bodies, made once and kept with the feed's ETag.
+
+Atom compresses very well, but compressing the same feed for every
+request costs as much as it saves. When 'atom.gzip' is set True in
+config, a feed requested with an Accept-Encoding that allows gzip is
+sent compressed, and the compressed body is kept in a least recently
+used cache of 'atom.gzip_cache_size' (default 1000) bodies, keyed on
+the feed's ETag.
+
+The ETag of a feed is known before anything is rendered, so when a
+later request for the same feed finds its compressed body in the cache
+the feed is neither rendered nor compressed again: the stored bytes
+are sent as they are.
+
+Every feed response, compressed or not, and every 304 for a feed has
+Accept-Encoding in its Vary header while 'atom.gzip' is set, so shared
+caches do not send a body in the wrong encoding. A compressed feed is
+sent with its ETag marked as that of the gzip body (see
+tiddlywebplugins.atom.conditional), so caches do not take it for the
+uncompressed feed, and either ETag revalidates.
+
+Streamed feeds are compressed as they are sent and kept once they are
+complete. Feeds sent without an ETag, such as delta feeds, are
+compressed but not kept, as are feeds cut short by their budget (see
+tiddlywebplugins.atom.budget). Hot feeds (see tiddlywebplugins.atom.hot)
+keep a compressed copy next to their file.
+"""
+
+import zlib
+
+from tiddlyweb.config import config as global_config
+
+from tiddlywebplugins.atom.budget import cut_short
+from tiddlywebplugins.atom.cache import MemoryCache
+from tiddlywebplugins.atom.conditional import VALIDATOR_KEY, gzip_etag
+
+
+GZIP_CACHE = 'atom.gzip_cache'
+
+ACCEPTS_GZIP_KEY = 'tiddlyweb.atom.gzip'
+COMPRESSED_KEY = 'tiddlyweb.atom.compressed'
+
+CACHES = {}
+
+
+class FeedCompressor(object):
+    """
+    Send feeds gzip compressed to clients which accept it, from
+    the cache when it has them.
+    """
+
+    def __init__(self, application, config=None):
+        self.application = application
+        self.config = config or global_config
+
+    def __call__(self, environ, start_response):
+        config = self.config
+        if not config.get('atom.gzip', False):
+            return self.application(environ, start_response)
+        if not accepts_gzip(environ):
+
+            def varying_start_response(status, headers, exc_info=None):
+                # the feed could have been sent compressed
+                if (environ.get(VALIDATOR_KEY) is not None
+                        and status.startswith('200')):
+                    headers = vary_on_encoding(headers)
+                return start_response(status, headers, exc_info)
+
+            return self.application(environ, varying_start_response)
+
+        environ[ACCEPTS_GZIP_KEY] = True
+        response = {}
+
+        def compressing_start_response(status, headers, exc_info=None):
+            response['compress'] = (environ.get(VALIDATOR_KEY) is not None
+                    and status.startswith('200'))
+            if response['compress']:
+                etag, last_modified = environ[VALIDATOR_KEY]
+                response['etag'] = etag
+                # read by FeedValidator, which sets the ETag header
+                environ[VALIDATOR_KEY] = (gzip_etag(etag), last_modified)
+                headers = vary_on_encoding([header for header in headers
+                        if header[0].lower() != 'content-length'])
+                headers.append(('Content-Encoding', 'gzip'))
+                compressed = environ.get(COMPRESSED_KEY)
+                if compressed is not None:
+                    headers.append(('Content-Length', str(len(compressed))))
+            return start_response(status, headers, exc_info)
+
+        output = self.application(environ, compressing_start_response)
+        if not response.get('compress'):
+            return output
+        compressed = environ.get(COMPRESSED_KEY)
+        if compressed is not None:
+            return [compressed]
+        return _compress_and_keep(output, get_gzip_cache(config),
+                response['etag'], environ)
+
+
+def accepts_gzip(environ):
+    """
+    True if the Accept-Encoding of the request allows gzip.
+    """
+    for coding in environ.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        parameters = coding.strip().split(';')
+        if parameters[0].strip().lower() not in ('gzip', 'x-gzip', '*'):
+            continue
+        for parameter in parameters[1:]:
+            name, _, value = parameter.partition('=')
+            if name.strip() == 'q':
+                try:
+                    return float(value) > 0
+                except ValueError:
+                    return False
+        return True
+    return False
+
+
+def vary_on_encoding(headers):
+    """
+    Return headers with Accept-Encoding added to their Vary.
+    """
+    varied = []
+    found = False
+    for name, value in headers:
+        if name.lower() == 'vary':
+            found = True
+            fields = [field.strip().lower() for field in value.split(',')]
+            if 'accept-encoding' not in fields:
+                value = '%s, Accept-Encoding' % value
+        varied.append((name, value))
+    if not found:
+        varied.append(('Vary', 'Accept-Encoding'))
+    return varied
+
+
+def get_gzip_cache(config):
+    """
+    The cache of compressed feed bodies, created on first use.
+    """
+    try:
+        return CACHES[GZIP_CACHE]
+    except KeyError:
+        cache = CACHES[GZIP_CACHE] = MemoryCache(config, GZIP_CACHE)
+        return cache
+
+
+def cached_body(environ, etag):
+    """
+    If the request accepts gzip and the compressed body of the
+    feed with etag is cached, put it in the environ to be sent
+    and return True.
+    """
+    if not environ.get(ACCEPTS_GZIP_KEY) or not etag:
+        return False
+    compressed = get_gzip_cache(environ['tiddlyweb.config']).get((etag,))
+    if compressed is None:
+        return False
+    environ[COMPRESSED_KEY] = compressed
+    return True
+
+
+def gzip_bytes(content):
+    """
+    Compress content, a str, in the gzip format.
+    """
+    compressor = _compressor()
+    return compressor.compress(content) + compressor.flush()
+
+
+def _compress_and_keep(output, cache, etag, environ):
+    compressor = _compressor()
+    chunks = []
+    try:
+        for chunk in output:
+            if isinstance(chunk, unicode):
+                chunk = chunk.encode('utf-8')
+            chunk = compressor.compress(chunk)
+            if chunk:
+                chunks.append(chunk)
+                yield chunk
+        chunk = compressor.flush()
+        chunks.append(chunk)
+        yield chunk
+    finally:
+        if hasattr(output, 'close'):
+            output.close()
+    # a feed cut short by its budget is not kept
+    if etag and not cut_short(environ):
+        cache.put((etag,), ''.join(chunks))
+
+
+def _compressor():
+    # wbits of 16 plus the window size makes a gzip header and trailer
+    return zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
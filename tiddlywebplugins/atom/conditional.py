@@ -0,0 +1,106 @@
+"""
+WSGI middleware that puts the validators of an Atom feed on the
+response.
+
+TiddlyWeb sets ETag and Last-Modified headers for a collection of
+tiddlers from the whole collection, before the feed serialization
+selects from it with 'atom.default_filter'. The feed serialization
+computes its own, tighter, validators from the selected tiddlers and
+leaves them in the environ as 'tiddlyweb.atom.validator'. This
+middleware replaces the collection headers with them, so that the
+next request from a feed reader can be answered with a 304 before
+any rendering is done. A validator without an ETag, as used for
+partial feeds, removes the collection's ETag.
+
+A feed cut short by its budget (see tiddlywebplugins.atom.budget) is
+sent with the weak form of its ETag, and a gzip compressed feed (see
+tiddlywebplugins.atom.compress) with its ETag marked with GZIP_SUFFIX,
+as a strong ETag may not be shared by different content codings. An
+If-None-Match holding any of these forms of the feed's ETag is
+answered with a 304.
+"""
+
+from httpexceptor import HTTP304
+
+
+WEAK_PREFIX = 'W/'
+GZIP_SUFFIX = '-gzip'
+
+VALIDATOR_KEY = 'tiddlyweb.atom.validator'
+
+REPLACED_HEADERS = ['etag', 'last-modified']
+
+
+class FeedValidator(object):
+    """
+    Replace ETag and Last-Modified on feed responses.
+    """
+
+    def __init__(self, application):
+        self.application = application
+
+    def __call__(self, environ, start_response):
+
+        def replacing_start_response(status, headers, exc_info=None):
+            validator = environ.get(VALIDATOR_KEY)
+            if validator:
+                etag, last_modified = validator
+                headers = [header for header in headers
+                        if header[0].lower() not in REPLACED_HEADERS]
+                headers.append(('Last-Modified', last_modified))
+                if etag:
+                    headers.append(('ETag', etag))
+            return start_response(status, headers, exc_info)
+
+        return self.application(environ, replacing_start_response)
+
+
+def check_feed_etag(environ, etag, last_modified=None):
+    """
+    Raise 304 if the If-None-Match of the request holds etag,
+    in any of its forms. Return the If-None-Match, if there is one.
+    """
+    incoming_etag = environ.get('HTTP_IF_NONE_MATCH', None)
+    if incoming_etag:
+        vary = 'Accept'
+        if environ.get('tiddlyweb.config', {}).get('atom.gzip', False):
+            vary = 'Accept, Accept-Encoding'
+        for candidate in incoming_etag.split(','):
+            candidate = candidate.strip()
+            if base_etag(candidate) == etag:
+                raise HTTP304(candidate, vary=vary,
+                        cache_control='no-cache',
+                        last_modified=last_modified)
+    return incoming_etag
+
+
+def base_etag(etag):
+    """
+    The feed's own ETag of etag, without the marks of a weak or
+    a gzip ETag.
+    """
+    if etag.startswith(WEAK_PREFIX):
+        etag = etag[len(WEAK_PREFIX):]
+    suffix = GZIP_SUFFIX + '"'
+    if etag.endswith(suffix):
+        etag = etag[:-len(suffix)] + '"'
+    return etag
+
+
+def gzip_etag(etag):
+    """
+    The ETag of the gzip compressed body of the feed with etag,
+    or None if there is no etag.
+    """
+    if not etag or not etag.endswith('"'):
+        return etag
+    return etag[:-1] + GZIP_SUFFIX + '"'
+
+
+def weak_etag(etag):
+    """
+    The weak form of etag, or None if there is no etag.
+    """
+    if not etag or etag.startswith(WEAK_PREFIX):
+        return etag
+    return WEAK_PREFIX + etag
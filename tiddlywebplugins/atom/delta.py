@@ -0,0 +1,88 @@
+"""
+Delta feeds: only the entries changed since a given time.
+
+A request for a collection feed with a 'since' query parameter, a
+TiddlyWeb timestamp of up to fourteen digits (YYYYMMDDhhmmss), gets a
+feed of only those of the selected tiddlers modified after that time.
+They are cut out before any content is rendered, so a poller whose
+last fetch was recent gets an empty or very small feed.
+
+If 'atom.delta_feeds' is set True in config, an If-Modified-Since
+header is used in the same way when the feed has changed since that
+time: instead of the whole feed the response holds only the entries
+modified since. As that response is not the whole feed, it is sent
+without an ETag.
+
+When the selected tiddlers are known to be newest first, because
+'atom.default_filter' ends by sorting on -modified, the scan stops at
+the first tiddler which is not new enough.
+"""
+
+from httpexceptor import HTTP400
+
+from tiddlyweb.filters.sort import date_to_canonical
+from tiddlyweb.store import get_entity
+from tiddlyweb.web.util import datetime_from_http_date
+
+
+SINCE_PARAMETER = 'since'
+
+
+def since_from_query(environ):
+    """
+    The canonical timestamp in the since query parameter, or
+    None. Raise 400 if it is not a timestamp.
+    """
+    since = environ.get('tiddlyweb.query', {}).get(SINCE_PARAMETER,
+            [None])[0]
+    if not since:
+        return None
+    since = since.strip()
+    if not since.isdigit() or len(since) > 14:
+        raise HTTP400('since must be a timestamp of up to 14 digits')
+    return date_to_canonical(str(since))
+
+
+def since_from_header(environ):
+    """
+    The canonical timestamp of the If-Modified-Since header, or
+    None if there is no header or it can not be read.
+    """
+    header = environ.get('HTTP_IF_MODIFIED_SINCE', None)
+    if not header:
+        return None
+    since = datetime_from_http_date(header)
+    if since is None:
+        return None
+    return since.strftime('%Y%m%d%H%M%S')
+
+
+def newest_first(filters):
+    """
+    True if the tiddlers coming out of filters, as made by
+    parse_for_filters and optimize_filters, are sorted on
+    -modified. Limit filters after the sort keep the order.
+    """
+    for _, (key, argument), _ in reversed(filters):
+        if key == 'limit':
+            continue
+        if key == 'sort':
+            return argument == '-modified'
+        if key == 'sort_limit':
+            return argument.split(';', 1)[0] == '-modified'
+        return False
+    return False
+
+
+def modified_since(tiddlers, since, newest_first=False, store=None):
+    """
+    Yield those of tiddlers modified after the canonical timestamp
+    since. If newest_first the tiddlers are known to be sorted on
+    -modified, and no more are looked at once one is too old.
+    """
+    for tiddler in tiddlers:
+        stored_tiddler = get_entity(tiddler, store)
+        if date_to_canonical(u'%s' % stored_tiddler.modified) > since:
+            yield tiddler
+        elif newest_first:
+            break
@@ -10,7 +10,9 @@ For example:
     'atom.default_filter': 'select=tag:!excludeLists;sort=-modified;limit=20',
 
 would give the 20 most recently modified tiddlers which are not tagged
-'excludeLists'.
+'excludeLists'. A sort filter followed by a limit filter is done as a
+single bounded selection rather than a sort of the whole collection.
+The filter is parsed once and kept for later requests.
 
 The atom feed will include author elements for each tiddler. If all
 the tiddlers have the same modifier, then there will also be a feed
@@ -24,27 +26,226 @@ For example:
 
 will result in a uri element value for the user cdent on server_host
 0.0.0.0:8080 (with no server_prefix) of "http://0.0.0.0/profiles/cdent".
+
+If 'atom.stream' is set True in config then collection feeds are returned
+as a generator of encoded chunks: the feed header, then each entry as it
+is rendered, then the closing of the document. Memory used is then bounded
+by the largest entry rather than the whole feed. The feed level updated
+element is taken from the modified time of the collection. If
+'atom.stream_workers' is also set then streamed feeds are made by a
+bounded pool of workers, a few entries ahead of the response. See
+tiddlywebplugins.atom.background for details.
+
+Before anything is rendered, an ETag and Last-Modified time are computed
+for the feed from the revisions and modified times of the selected
+tiddlers. If the request's If-None-Match or If-Modified-Since headers
+match, a 304 is raised and no feed is generated.
+
+Binary tiddlers are given an enclosure link with their type and length,
+to their '_canonical_uri' field if they have one. Their content is not
+kept once the tiddlers for the feed have been selected.
+
+If 'atom.sanitize_html' is set True in config then HTML tiddlers are
+sent as HTML, with anything that is not allowed removed, rather than as
+source in a <pre>. See tiddlywebplugins.atom.sanitize for details.
+
+If any of 'atom.budget_entries', 'atom.budget_bytes',
+'atom.budget_seconds' or 'atom.budget_store_gets' is set in config then
+once a feed has done that much work its remaining entries are sent as
+summaries without content. See tiddlywebplugins.atom.budget for details.
+
+If 'atom.aggregates' is set in config then feeds of the newest tiddlers
+across sets of bags are made by merging the bags in order. See
+tiddlywebplugins.atom.aggregate for details.
+
+If 'atom.history' is set True in config then /bags/{bag}/revisions.atom
+is a feed of the newest revisions across the bag. See
+tiddlywebplugins.atom.history for details.
+
+If 'atom.hub' is set in config then feeds advertise it as their hub,
+and if 'atom.hub_publish' is also set True then changes to tiddlers are
+sent to the hub as they happen. See tiddlywebplugins.atom.websub for
+details.
+
+A 'since' query parameter, or with 'atom.delta_feeds' set an
+If-Modified-Since header, limits the feed to the tiddlers changed after
+that time. See tiddlywebplugins.atom.delta for details.
+
+If 'atom.gzip' is set True in config then feeds are sent compressed to
+clients that accept it, and a request for a feed whose compressed body
+is already cached is answered without rendering. See
+tiddlywebplugins.atom.compress for details.
+
+If 'atom.page_size' is set in config then collection feeds are paged,
+newest first, with first, next and previous links. See
+tiddlywebplugins.atom.paging for details.
+
+If 'atom.recent_index' is set True in config then feeds of the most
+recently modified tiddlers in a bag are made from a small index of
+them, kept current as tiddlers are stored. See
+tiddlywebplugins.atom.recent for details.
+
+If 'atom.render_cache' is set in config then rendered tiddler content is
+cached between requests. If 'atom.diff_cache' is set then the diffs
+between revisions shown in feeds with a depth argument are cached. See
+tiddlywebplugins.atom.cache for details.
+
+If 'atom.writer' is set to 'direct' in config then the XML is written
+directly as strings instead of through feedgenerator's SAX style
+generator. The output is the same, but is made much faster.
+
+If 'atom.render_workers' is set in config then entry content is rendered
+by a pool of workers. See tiddlywebplugins.atom.parallel for details.
+
+If 'atom.timing' is set True in config then the time spent in each phase
+of making a feed is recorded and sent in a Server-Timing header. See
+tiddlywebplugins.atom.timing for details.
 """
 
+import io
 import time
 import datetime
 import logging
 
-from feedgenerator import Atom1Feed, rfc3339_date
+from feedgenerator import Atom1Feed, Enclosure, rfc3339_date
+from feedgenerator.django.utils.xmlutils import SimplerXMLGenerator
 
-from tiddlyweb.filters import parse_for_filters, recursive_filter
+from tiddlyweb.filters import recursive_filter
 from tiddlyweb.model.tiddler import Tiddler
 from tiddlyweb.serializations import SerializationInterface
-from tiddlyweb.util import binary_tiddler, renderable
+from tiddlyweb.util import binary_tiddler, renderable, sha
 from tiddlyweb.wikitext import render_wikitext
-from tiddlyweb.web.util import server_base_url, server_host_url, tiddler_url
+from tiddlyweb.web.util import (server_base_url, server_host_url,
+        tiddler_url, encode_name, http_date_from_timestamp,
+        check_last_modified)
+
+from tiddlywebplugins.atom.aggregate import FILTERED_KEY
+from tiddlywebplugins.atom.background import background_chunks
+from tiddlywebplugins.atom.budget import start_budget, NO_BUDGET
+from tiddlywebplugins.atom.cache import (get_cache, cache_key, diff_key,
+        DIFF_CACHE)
+from tiddlywebplugins.atom.compress import cached_body
+from tiddlywebplugins.atom.conditional import (VALIDATOR_KEY,
+        check_feed_etag, weak_etag)
+from tiddlywebplugins.atom.delta import (since_from_query,
+        since_from_header, newest_first, modified_since)
+from tiddlywebplugins.atom.filters import compiled_filters
+from tiddlywebplugins.atom.paging import (select_page, page_url,
+        CURSOR_PARAMETER)
+from tiddlywebplugins.atom.parallel import get_pool, batch_size, render_batch
+from tiddlywebplugins.atom.recent import recent_selection
+from tiddlywebplugins.atom.sanitize import (sanitize_html, sanitizing,
+        HTML_TYPES, DEFAULT_MAX_SIZE)
+from tiddlywebplugins.atom.timing import (start_timing, measured_filters,
+        NO_TIMING)
 
 
 LOGGER = logging.getLogger(__name__)
 
+UNRENDERABLE = 'Tiddler cannot be rendered.'
+
+CANONICAL_URI_FIELD = '_canonical_uri'
+
+
+def render_description(tiddler, environ):
+    """
+    Render the tiddler to HTML for the content of an entry.
+    """
+    try:
+        return render_wikitext(tiddler, environ)
+    except KeyError:
+        return UNRENDERABLE
+
+
+class FeedContext(object):
+    """
+    Values which are the same for every entry in a feed, worked out
+    once per feed rather than once per entry: the server URLs, the
+    author uri and avatar links, and the base URL of the tiddlers in
+    each bag or recipe.
+    """
+
+    def __init__(self, environ):
+        self.environ = environ
+        config = environ.get('tiddlyweb.config', {})
+        self.author_uri_map = config.get('atom.author_uri_map', None)
+        self.author_avatar_map = config.get('atom.author_avatar_map', None)
+        self._host_url = None
+        self._base_url = None
+        self._author_links = {}
+        self._author_avatars = {}
+        self._container_bases = {}
+
+    def host_url(self):
+        if self._host_url is None:
+            self._host_url = server_host_url(self.environ)
+        return self._host_url
+
+    def base_url(self):
+        if self._base_url is None:
+            self._base_url = server_base_url(self.environ)
+        return self._base_url
+
+    def author_link(self, author_name):
+        if not self.author_uri_map:
+            return None
+        try:
+            return self._author_links[author_name]
+        except KeyError:
+            link = self._author_links[author_name] = (self.base_url()
+                    + self.author_uri_map % author_name)
+            return link
+
+    def author_avatar(self, author_name):
+        if not self.author_avatar_map:
+            return None
+        try:
+            return self._author_avatars[author_name]
+        except KeyError:
+            avatar = self._author_avatars[author_name] = (self.base_url()
+                    + self.author_avatar_map % author_name)
+            return avatar
+
+    def container_base(self, tiddler, container='bags'):
+        """
+        The URL, ending in '/', of the tiddlers in the bag or
+        recipe of tiddler.
+        """
+        name = tiddler.recipe if container == 'recipes' else tiddler.bag
+        try:
+            return self._container_bases[(container, name)]
+        except KeyError:
+            url = tiddler_url(self.environ, tiddler, container=container)
+            base = self._container_bases[(container, name)] = (
+                    url.rsplit('/', 1)[0] + '/')
+            return base
+
+    def tiddler_url(self, tiddler, container='bags'):
+        return (self.container_base(tiddler, container)
+                + encode_name(tiddler.title))
+
 
 class Serialization(SerializationInterface):
 
+    def __init__(self, environ=None):
+        SerializationInterface.__init__(self, environ)
+        self._dates = {}
+        self._prerendered = {}
+        self._context = None
+        self._timing = NO_TIMING
+        self._budget = NO_BUDGET
+        self._binary_lengths = {}
+        self._revision_ids = False
+
+    @property
+    def context(self):
+        """
+        The FeedContext of the feed being made.
+        """
+        if self._context is None:
+            self._context = FeedContext(self.environ)
+        return self._context
+
     def _current_url(self):
         script_name = self.environ.get('SCRIPT_NAME', '')
         query_string = self.environ.get('QUERY_STRING', None)
@@ -57,28 +258,60 @@ class Serialization(SerializationInterface):
         """
         Turn the contents of a Tiddlers into an Atom Feed.
         """
+        self._context = FeedContext(self.environ)
+        timing = self._timing = start_timing(self.environ)
+        self._revision_ids = tiddlers.is_revisions
 
         authors = set()
-        try:
-            from tiddlyweb.model.collections import Tiddlers
-            config = self.environ['tiddlyweb.config']
-            default_filter = config['atom.default_filter']
-            filters, _ = parse_for_filters(default_filter, self.environ)
-            new_tiddlers = Tiddlers()
-            new_tiddlers.is_search = tiddlers.is_search
-            new_tiddlers.is_revisions = tiddlers.is_revisions
-            new_tiddlers.bag = tiddlers.bag
-            new_tiddlers.recipe = tiddlers.recipe
-            new_tiddlers.link = tiddlers.link
-            for tiddler in recursive_filter(filters, tiddlers):
-                new_tiddlers.add(tiddler)
-                authors.add(tiddler.modifier)
-            new_tiddlers.title = tiddlers.title
-            new_tiddlers.is_search = tiddlers.is_search
-            new_tiddlers.is_revisions = tiddlers.is_revisions
-            tiddlers = new_tiddlers
-        except (KeyError, ImportError):
-            pass
+        ordered = False
+        with timing.phase('filter'):
+            try:
+                config = self.environ['tiddlyweb.config']
+                default_filter = config['atom.default_filter']
+                if self.environ.get(FILTERED_KEY):
+                    # already selected with the default filter
+                    default_filter = ''
+                filters = compiled_filters(default_filter, self.environ)
+                ordered = newest_first(filters)
+                new_tiddlers = self._new_tiddlers(tiddlers)
+                source = tiddlers
+                if timing.stages is not None:
+                    filters, source = measured_filters(filters, tiddlers,
+                            timing)
+                selected = recent_selection(self.environ, tiddlers, filters)
+                if selected is None:
+                    selected = recursive_filter(filters, source)
+                for tiddler in selected:
+                    new_tiddlers.add(self._without_body(tiddler))
+                    authors.add(tiddler.modifier)
+                tiddlers = new_tiddlers
+            except (KeyError, ImportError):
+                pass
+
+        with timing.phase('validate'):
+            self._validate_feed(tiddlers)
+
+        config = self.environ.get('tiddlyweb.config', {})
+        with timing.phase('filter'):
+            since = since_from_query(self.environ)
+            if not since and config.get('atom.delta_feeds', False):
+                since = since_from_header(self.environ)
+                if since:
+                    # not the whole feed, so not the feed's ETag
+                    self.environ[VALIDATOR_KEY] = (None,
+                            self.environ[VALIDATOR_KEY][1])
+            if since:
+                tiddlers = self._since(tiddlers, since, ordered)
+
+        if cached_body(self.environ, self.environ[VALIDATOR_KEY][0]):
+            # the compressed feed is sent instead
+            return ''
+
+        pages = None
+        page_size = int(config.get('atom.page_size', 0) or 0)
+        if page_size:
+            with timing.phase('filter'):
+                tiddlers, pages = self._page(tiddlers, page_size)
 
         author_name = None
         author_link = None
@@ -88,7 +321,8 @@ class Serialization(SerializationInterface):
             author_link = self._get_author_link(author_name)
             author_avatar = self._get_author_avatar(author_name)
 
-        hub = self.environ.get('tiddlyweb.config', {}).get('atom.hub', None)
+        hub = config.get('atom.hub', None)
+        stream = config.get('atom.stream', False)
 
         if tiddlers.link:
             link = tiddlers.link
@@ -97,116 +331,402 @@ class Serialization(SerializationInterface):
         if not link.startswith('http'):
             link = u'%s%s' % (self._host_url(), link)
 
-        feed = AtomFeed(link=link,
+        feed = self._feed_class()(link=link,
             language=u'en',
             hub=hub,
             author_name=author_name,
             author_link=author_link,
             author_avatar=author_avatar,
+            pages=pages,
             title=tiddlers.title,
             description=tiddlers.title)
 
-        for tiddler in tiddlers:
-            self._add_tiddler_to_feed(feed, tiddler)
+        # the budget is for the entries, not for selecting the tiddlers
+        self._budget = start_budget(self.environ)
+
+        if stream:
+            feed.feed['updated'] = self._tiddler_datetime(tiddlers.modified)
+            return background_chunks(config, feed.write_stream('utf-8',
+                    self._generate_items(feed, tiddlers)))
+
+        with timing.phase('entries'):
+            for tiddler in self._render_ahead(tiddlers):
+                self._add_tiddler_to_feed(feed, tiddler)
+
+        if self._budget.exhausted:
+            # not the whole feed, so only a weak match for the feed's ETag
+            etag, last_modified = self.environ[VALIDATOR_KEY]
+            self.environ[VALIDATOR_KEY] = (weak_etag(etag), last_modified)
 
         # can we avoid sending utf-8 and let the wrapper handle it?
-        return feed.writeString('utf-8')
+        with timing.phase('write'):
+            return feed.writeString('utf-8')
+
+    def _page(self, tiddlers, page_size):
+        """
+        Select the page of tiddlers named by the cursor in the
+        query. Return a Tiddlers of the page and a list of rel and
+        href pairs linking to the first, next and previous pages.
+        """
+        cursor = self.environ.get('tiddlyweb.query', {}).get(
+                CURSOR_PARAMETER, [None])[0]
+        selected, next_cursor, previous_cursor = select_page(tiddlers,
+                page_size, cursor, self.environ.get('tiddlyweb.store'))
+
+        page = self._new_tiddlers(tiddlers)
+        for tiddler in selected:
+            page.add(tiddler)
+
+        base_url = u'%s%s' % (self._host_url(), self.environ.get(
+            'SCRIPT_NAME', '').decode('utf-8', 'replace'))
+        query_string = self.environ.get('QUERY_STRING', '')
+        pages = [(u'first', page_url(base_url, query_string))]
+        if next_cursor:
+            pages.append((u'next',
+                page_url(base_url, query_string, next_cursor)))
+        if previous_cursor:
+            pages.append((u'previous',
+                page_url(base_url, query_string, previous_cursor)))
+        return page, pages
+
+    def _new_tiddlers(self, tiddlers):
+        """
+        Make an empty Tiddlers with the title, link and containers
+        of tiddlers.
+        """
+        from tiddlyweb.model.collections import Tiddlers
+        new_tiddlers = Tiddlers(title=tiddlers.title)
+        new_tiddlers.is_search = tiddlers.is_search
+        new_tiddlers.is_revisions = tiddlers.is_revisions
+        new_tiddlers.bag = tiddlers.bag
+        new_tiddlers.recipe = tiddlers.recipe
+        new_tiddlers.link = tiddlers.link
+        return new_tiddlers
+
+    def _since(self, tiddlers, since, ordered=False):
+        """
+        Keep only those of tiddlers modified after since. The feed
+        keeps the modified time of all of tiddlers.
+        """
+        changed = self._new_tiddlers(tiddlers)
+        for tiddler in modified_since(tiddlers, since, ordered,
+                self.environ.get('tiddlyweb.store')):
+            changed.add(tiddler)
+        changed.modified = tiddlers.modified
+        return changed
+
+    def _validate_feed(self, tiddlers):
+        """
+        Compute an ETag and Last-Modified for the feed from the
+        selected tiddlers, raising 304 if the request already has
+        the current feed. Otherwise keep them in the environ for
+        the response.
+        """
+        last_modified = http_date_from_timestamp(tiddlers.modified)
+        username = self.environ.get('tiddlyweb.usersign', {}).get('name', '')
+        feed_digest = sha('%s:%s' % (tiddlers.hexdigest(),
+            self._current_url())).hexdigest()
+        etag = '"%s:%s"' % (feed_digest,
+                sha('%s:%s' % (username, 'application/atom+xml')).hexdigest())
+
+        incoming_etag = check_feed_etag(self.environ, etag,
+                last_modified=last_modified)
+        if not incoming_etag:  # only check last modified when no etag
+            check_last_modified(self.environ, last_modified, etag=etag)
+
+        self.environ[VALIDATOR_KEY] = (etag, last_modified)
+
+    def _generate_items(self, feed, tiddlers):
+        """
+        Yield the feed items for each tiddler, one tiddler at a time,
+        without keeping them on the feed.
+        """
+        for tiddler in self._render_ahead(tiddlers):
+            with self._timing.phase('entries'):
+                self._add_tiddler_to_feed(feed, tiddler)
+            for item in feed.items:
+                yield item
+            del feed.items[:]
 
     def tiddler_as(self, tiddler):
-        feed = AtomFeed(
+        self._context = FeedContext(self.environ)
+        timing = self._timing = start_timing(self.environ)
+        self._budget = start_budget(self.environ)
+        feed = self._feed_class()(
                 title=u'%s' % tiddler.title,
-                link=tiddler_url(self.environ, tiddler),
+                link=self.context.tiddler_url(tiddler),
                 language=u'en',
                 description=u'tiddler %s' % tiddler.title)
-        self._add_tiddler_to_feed(feed, tiddler)
-        return feed.writeString('utf-8')
+        with timing.phase('entries'):
+            self._add_tiddler_to_feed(feed, tiddler)
+        with timing.phase('write'):
+            return feed.writeString('utf-8')
+
+    def _feed_class(self):
+        """
+        The feed class chosen by 'atom.writer' in config.
+        """
+        return FEED_WRITERS[self.environ.get('tiddlyweb.config', {}).get(
+            'atom.writer', 'sax')]
 
     def _add_tiddler_to_feed(self, feed, tiddler):
-        do_revisions = self.environ.get('tiddlyweb.query', {}).get(
-                'depth', [None])[0]
+        do_revisions = self._revisions_depth()
+
+        link = self.context.tiddler_url(tiddler)
+
+        if self._budget.spent():
+            self._add_summary(feed, tiddler, link, tiddler.title)
+            return
 
         if not do_revisions:
+            enclosure = None
             if binary_tiddler(tiddler):
-                # XXX: ought to be enclosures?
+                enclosure = self._enclosure(tiddler, link)
                 if tiddler.type.startswith('image/'):
-                    description = ('\n<img src="%s" />\n'
-                            % tiddler_url(self.environ, tiddler))
+                    description = '\n<img src="%s" />\n' % enclosure.url
                 else:
                     description = ('\n<a href="%s">%s</a>\n'
-                            % (tiddler_url(self.environ, tiddler),
-                                tiddler.title))
+                            % (enclosure.url, tiddler.title))
             elif (renderable(tiddler, self.environ)):
-                try:
-                    description = render_wikitext(tiddler, self.environ)
-                except KeyError:
-                    description = 'Tiddler cannot be rendered.'
+                description = self._render(tiddler)
             else:
-                description = '<pre>' + tiddler.text + '</pre>'
+                description = self._sanitized(tiddler)
+                if description is None:
+                    description = '<pre>' + tiddler.text + '</pre>'
 
-            self._add_item(feed, tiddler, tiddler_url(self.environ, tiddler),
-                    tiddler.title, description)
+            self._budget.charge(description)
+            self._add_item(feed, tiddler, link, tiddler.title, description,
+                    enclosure=enclosure)
         else:
-            self._process_tiddler_revisions(feed, tiddler,
-                    tiddler_url(self.environ, tiddler), do_revisions)
+            with self._timing.phase('revisions'):
+                self._process_tiddler_revisions(feed, tiddler, link,
+                        do_revisions)
+
+    def _sanitized(self, tiddler):
+        """
+        The text of an HTML tiddler made safe to show as HTML, if
+        sanitizing is on and the text is not too long. Otherwise
+        None.
+        """
+        if tiddler.type not in HTML_TYPES or not sanitizing(self.environ):
+            return None
+        max_size = int(self.environ.get('tiddlyweb.config', {}).get(
+            'atom.sanitize_max_size', DEFAULT_MAX_SIZE))
+        with self._timing.phase('render'):
+            return sanitize_html(tiddler.text, max_size)
+
+    def _enclosure(self, tiddler, link):
+        """
+        The enclosure of a binary tiddler, made from its type and
+        length and linking to its canonical uri if it has one.
+        The content itself is not needed.
+        """
+        url = tiddler.fields.get(CANONICAL_URI_FIELD, link)
+        return Enclosure(url, self._binary_length(tiddler), tiddler.type)
+
+    def _binary_length(self, tiddler):
+        try:
+            return self._binary_lengths[_tiddler_key(tiddler)]
+        except KeyError:
+            pass
+        if tiddler.text:
+            return u'%s' % len(tiddler.text)
+        return None
+
+    def _without_body(self, tiddler):
+        """
+        Return tiddler, or if it is binary a copy without its
+        content, so that the content is not held while the feed
+        is made. Its length is kept for its enclosure.
+        """
+        if not binary_tiddler(tiddler) or not tiddler.text:
+            return tiddler
+        self._binary_lengths[_tiddler_key(tiddler)] = u'%s' % len(
+                tiddler.text)
+        reference = Tiddler(tiddler.title, tiddler.bag)
+        for attribute in ('recipe', 'revision', 'type', 'tags', 'fields',
+                'modifier', 'modified', 'creator', 'created'):
+            setattr(reference, attribute, getattr(tiddler, attribute))
+        reference.text = u''
+        reference.store = tiddler.store
+        return reference
+
+    def _render_ahead(self, tiddlers):
+        """
+        Yield tiddlers. If there is a render pool, gather them
+        in batches and render the renderable ones in each batch
+        together before yielding them.
+        """
+        config = self.environ.get('tiddlyweb.config', {})
+        pool = get_pool(config)
+        if pool is None or self._revisions_depth():
+            for tiddler in tiddlers:
+                yield tiddler
+            return
+        size = batch_size(config)
+        batch = []
+        try:
+            for tiddler in tiddlers:
+                batch.append(tiddler)
+                if len(batch) >= size:
+                    self._render_batch(pool, batch)
+                    for rendered_tiddler in batch:
+                        yield rendered_tiddler
+                    # drop what was not taken, as when the budget ran out
+                    self._prerendered.clear()
+                    batch = []
+            self._render_batch(pool, batch)
+            for rendered_tiddler in batch:
+                yield rendered_tiddler
+        finally:
+            # also when a stream is closed part way
+            self._prerendered.clear()
+
+    def _render_batch(self, pool, tiddlers):
+        if self._budget.spent():
+            return
+        with self._timing.phase('render'):
+            pending = []
+            for tiddler in tiddlers:
+                if (binary_tiddler(tiddler)
+                        or not renderable(tiddler, self.environ)):
+                    continue
+                key, description = self._cached_description(tiddler)
+                if description is None:
+                    pending.append((tiddler, key))
+                else:
+                    self._prerendered[_tiddler_key(tiddler)] = description
+            descriptions = render_batch(pool, self.environ,
+                    [tiddler for tiddler, _ in pending], render_description)
+            self._timing.count('renders', len(pending))
+            for (tiddler, key), description in zip(pending, descriptions):
+                self._cache_description(key, description)
+                self._prerendered[_tiddler_key(tiddler)] = description
+
+    def _render(self, tiddler):
+        """
+        Render the tiddler to HTML, using the render cache
+        if there is one.
+        """
+        try:
+            return self._prerendered.pop(_tiddler_key(tiddler))
+        except KeyError:
+            pass
+        with self._timing.phase('render'):
+            key, description = self._cached_description(tiddler)
+            if description is not None:
+                return description
+            description = render_description(tiddler, self.environ)
+            self._timing.count('renders')
+            self._cache_description(key, description)
+            return description
+
+    def _cached_description(self, tiddler):
+        """
+        Return the render cache key for tiddler and its content
+        from the cache, if any.
+        """
+        cache = get_cache(self.environ.get('tiddlyweb.config', {}))
+        if cache is None:
+            return None, None
+        key = cache_key(tiddler, self.environ)
+        if key is None:
+            return None, None
+        description = cache.get(key)
+        if description is not None:
+            self._timing.count('cache_hits')
+        return key, description
+
+    def _cache_description(self, key, description):
+        if key is not None and description != UNRENDERABLE:
+            get_cache(self.environ.get('tiddlyweb.config', {})).put(key,
+                    description)
+
+    def _revisions_depth(self):
+        return self.environ.get('tiddlyweb.query', {}).get(
+                'depth', [None])[0]
 
     def _get_author_link(self, author_name):
-        author_link = None
-        author_uri_map = self.environ.get(
-                'tiddlyweb.config', {}).get(
-                        'atom.author_uri_map', None)
-        if author_uri_map:
-            author_link = (server_base_url(self.environ) +
-                    author_uri_map % author_name)
-        return author_link
+        return self.context.author_link(author_name)
 
     def _get_author_avatar(self, author_name):
-        author_avatar = None
-        author_avatar_map = self.environ.get(
-                'tiddlyweb.config', {}).get(
-                        'atom.author_avatar_map', None)
-        if author_avatar_map:
-            author_avatar = (server_base_url(self.environ) +
-                    author_avatar_map % author_name)
-        return author_avatar
+        return self.context.author_avatar(author_name)
 
     def _process_tiddler_revisions(self, feed, tiddler, link, do_revisions):
+        """
+        Add an entry for each of the last depth revisions of tiddler,
+        showing the difference from the revision before it.
+
+        Each revision is read from the store at most once. If a diff
+        cache is configured diffs are taken from there, and the
+        older revision is only read when a diff must be made.
+        """
         try:
             from tiddlywebplugins.differ import compare_tiddlers
         except ImportError:
             self._add_item(feed, tiddler, link, tiddler.title,
                     'unable to diff without tiddlywebplugins.differ')
+            return
         try:
             depth = int(do_revisions)
         except ValueError:
             depth = 1
         store = self.environ['tiddlyweb.store']
         revision_ids = store.list_tiddler_revisions(tiddler)
+        depth = min(depth, len(revision_ids) - 2)
+
+        if binary_tiddler(tiddler):
+            for _ in range(depth + 1):
+                self._add_item(feed, tiddler, link, tiddler.title,
+                        'Binary Content')
+            return
+
+        cache = get_cache(self.environ.get('tiddlyweb.config', {}),
+                DIFF_CACHE)
+        previous = None
         while depth >= 0:
-            try:
-                rev_older = Tiddler(tiddler.title, tiddler.bag)
-                rev_older.revision = revision_ids[depth + 1]
-                rev_older = store.get(rev_older)
-            except IndexError:
+            older_id = revision_ids[depth + 1]
+            current_id = revision_ids[depth]
+            title = '%s comparing version %s to %s' % (tiddler.title,
+                    older_id, current_id)
+            if self._budget.spent():
+                self._add_summary(feed, tiddler, link, title)
                 depth -= 1
                 continue
-            rev_current = Tiddler(tiddler.title, tiddler.bag)
-            rev_current.revision = revision_ids[depth]
-            rev_current = store.get(rev_current)
-            if binary_tiddler(tiddler):
-                self._add_item(feed, tiddler, link, tiddler.title,
-                        'Binary Content')
-            else:
-                title = '%s comparing version %s to %s' % (tiddler.title,
-                        rev_older.revision, rev_current.revision)
-                self._add_item(feed, rev_current, link, title,
-                        '<pre>' + compare_tiddlers(rev_older, rev_current)
-                        + '</pre>')
+            rev_current = self._get_revision(store, tiddler, current_id)
+
+            key = diff_key(tiddler, older_id, current_id)
+            diff = None
+            if cache is not None:
+                diff = cache.get(key)
+            if diff is None:
+                if previous is not None and previous.revision == older_id:
+                    rev_older = previous
+                else:
+                    rev_older = self._get_revision(store, tiddler, older_id)
+                diff = compare_tiddlers(rev_older, rev_current)
+                if cache is not None:
+                    cache.put(key, diff)
+
+            description = '<pre>' + diff + '</pre>'
+            self._budget.charge(description)
+            self._add_item(feed, rev_current, link, title, description)
+            previous = rev_current
             depth -= 1
 
-    def _add_item(self, feed, tiddler, link, title, description):
+    def _get_revision(self, store, tiddler, revision_id):
+        revision = Tiddler(tiddler.title, tiddler.bag)
+        revision.revision = revision_id
+        return store.get(revision)
+
+    def _add_item(self, feed, tiddler, link, title, description,
+            enclosure=None):
         LOGGER.debug('adding %s', title)
+        self._timing.count('entries')
         author_link = self._get_author_link(tiddler.modifier)
         entry_base = self._get_entry_base(tiddler)
+        pubdate, pubdate_string = self._tiddler_date(tiddler.created)
+        updated, updated_string = self._tiddler_date(tiddler.modified)
         feed.add_item(title=title,
                 unique_id=self._tiddler_id(tiddler),
                 link=link,
@@ -215,30 +735,126 @@ class Serialization(SerializationInterface):
                 description=description,
                 author_name=tiddler.modifier,
                 author_link=author_link,
-                pubdate=self._tiddler_datetime(tiddler.created),
-                updated=self._tiddler_datetime(tiddler.modified),
-                # modern feedgenerators need updateddate
-                updateddate=self._tiddler_datetime(tiddler.modified))
+                pubdate=pubdate,
+                pubdate_string=pubdate_string,
+                updated=updated,
+                updated_string=updated_string,
+                enclosure=enclosure)
+
+    def _add_summary(self, feed, tiddler, link, title):
+        """
+        Add an entry for tiddler without content, once the budget
+        of the feed is spent.
+        """
+        self._timing.count('summaries')
+        self._add_item(feed, tiddler, link, title, None)
 
     def _get_entry_base(self, tiddler):
         if tiddler.recipe:
-            url = tiddler_url(self.environ, tiddler, container='recipes')
-        else:
-            url = tiddler_url(self.environ, tiddler)
-        return url.rsplit('/', 1)[0] + '/'
+            return self.context.container_base(tiddler, container='recipes')
+        return self.context.container_base(tiddler)
 
     def _tiddler_id(self, tiddler):
+        if self._revision_ids:
+            return '%s/%s/%s' % (tiddler.bag, tiddler.title,
+                    tiddler.revision)
         return '%s/%s' % (tiddler.bag, tiddler.title)
 
     def _tiddler_datetime(self, date_string):
+        return self._tiddler_date(date_string)[0]
+
+    def _tiddler_date(self, date_string):
+        """
+        Turn a TiddlyWeb timestamp into a tuple of a datetime
+        and its RFC 3339 string. Results are remembered for the
+        life of this serialization as the same timestamps tend to
+        be seen many times in one feed.
+        """
+        try:
+            return self._dates[date_string]
+        except KeyError:
+            pass
+        # the common case of a full 14 digit timestamp is sliced
+        # rather than going through strptime
         try:
-            return datetime.datetime(*(time.strptime(
-                date_string, '%Y%m%d%H%M%S')[0:6]))
-        except ValueError:  # bad format in timestring
-            return datetime.datetime.utcnow()
+            if len(date_string) == 14 and date_string.isdigit():
+                date = datetime.datetime(int(date_string[0:4]),
+                        int(date_string[4:6]), int(date_string[6:8]),
+                        int(date_string[8:10]), int(date_string[10:12]),
+                        int(date_string[12:14]))
+                date_rfc3339 = u'%s-%s-%sT%s:%s:%sZ' % (date_string[0:4],
+                        date_string[4:6], date_string[6:8],
+                        date_string[8:10], date_string[10:12],
+                        date_string[12:14])
+            else:
+                date = datetime.datetime(*(time.strptime(
+                    date_string, '%Y%m%d%H%M%S')[0:6]))
+                date_rfc3339 = _rfc3339(date)
+        except (ValueError, TypeError):  # bad format in timestring
+            date = datetime.datetime.utcnow()
+            return date, _rfc3339(date)
+        result = self._dates[date_string] = (date, date_rfc3339)
+        return result
 
     def _host_url(self):
-        return server_host_url(self.environ)
+        return self.context.host_url()
+
+
+class Entry(object):
+    """
+    One item in an AtomFeed.
+
+    Slots are used rather than the dict feedgenerator uses, as a feed
+    may hold thousands of entries. Keyword arguments without a slot
+    are kept in extra. item['name'] and item.get('name') work as they
+    would on the dict.
+    """
+
+    __slots__ = ('title', 'link', 'base', 'description', 'author_email',
+            'author_name', 'author_link', 'pubdate', 'pubdate_string',
+            'updated', 'updated_string', 'unique_id', 'enclosure',
+            'categories', 'item_copyright', 'type', 'extra')
+
+    def __init__(self, title, link, description, base=None,
+            author_email=None, author_name=None, author_link=None,
+            pubdate=None, pubdate_string=None, updated=None,
+            updated_string=None, unique_id=None, enclosure=None,
+            categories=(), item_copyright=None, type=None, extra=None):
+        self.title = title
+        self.link = link
+        self.description = description
+        self.base = base
+        self.author_email = author_email
+        self.author_name = author_name
+        self.author_link = author_link
+        self.pubdate = pubdate
+        self.pubdate_string = pubdate_string
+        self.updated = updated
+        self.updated_string = updated_string
+        self.unique_id = unique_id
+        self.enclosure = enclosure
+        self.categories = categories or ()
+        self.item_copyright = item_copyright
+        self.type = type
+        self.extra = extra
+
+    @property
+    def updateddate(self):
+        return self.updated
+
+    def __getitem__(self, name):
+        try:
+            return getattr(self, name)
+        except AttributeError:
+            if self.extra and name in self.extra:
+                return self.extra[name]
+            raise KeyError(name)
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
 
 
 class AtomFeed(Atom1Feed):
@@ -258,23 +874,54 @@ class AtomFeed(Atom1Feed):
         objects except pubdate, which is a datetime.datetime object, and
         enclosure, which is an instance of the Enclosure class.
         """
-        item = {
-            'title': title,
-            'link': link,
-            'base': base,
-            'description': description,
-            'author_email': author_email,
-            'author_name': author_name,
-            'author_link': author_link,
-            'pubdate': pubdate,
-            'updated': updated,
-            'unique_id': unique_id,
-            'enclosure': enclosure,
-            'categories': categories or (),
-            'item_copyright': item_copyright,
-        }
-        item.update(kwargs)
-        self.items.append(item)
+        pubdate_string = kwargs.pop('pubdate_string', None)
+        updated_string = kwargs.pop('updated_string', None)
+        item_type = kwargs.pop('type', None)
+        kwargs.pop('updateddate', None)
+        self.items.append(Entry(title, link, description, base=base,
+            author_email=author_email, author_name=author_name,
+            author_link=author_link, pubdate=pubdate,
+            pubdate_string=pubdate_string, updated=updated,
+            updated_string=updated_string, unique_id=unique_id,
+            enclosure=enclosure, categories=categories,
+            item_copyright=item_copyright, type=item_type,
+            extra=kwargs or None))
+
+    def latest_post_date(self):
+        """
+        Use a provided feed level updated time if there is one,
+        otherwise the latest date of the items.
+        """
+        if self.feed.get('updated'):
+            return self.feed['updated']
+        latest = None
+        for item in self.items:
+            for date in (item.pubdate, item.updated):
+                if date is not None and (latest is None or date > latest):
+                    latest = date
+        if latest is None:
+            return datetime.datetime.now()
+        return latest
+
+    def write_stream(self, encoding, items):
+        """
+        Generate the feed as a series of encoded strings, writing
+        each of items as it arrives rather than those stored in
+        self.items.
+        """
+        output = io.BytesIO()
+        handler = SimplerXMLGenerator(output, encoding)
+        handler.startDocument()
+        handler.startElement(u'feed', self.root_attributes())
+        self.add_root_elements(handler)
+        yield _drain(output)
+        for item in items:
+            handler.startElement(u'entry', self.item_attributes(item))
+            self.add_item_elements(handler, item)
+            handler.endElement(u'entry')
+            yield _drain(output)
+        handler.endElement(u'feed')
+        yield _drain(output)
 
     def add_root_elements(self, handler):
         Atom1Feed.add_root_elements(self, handler)
@@ -284,6 +931,9 @@ class AtomFeed(Atom1Feed):
         if 'author_avatar' in self.feed and self.feed['author_avatar']:
             handler.addQuickElement(u'link', u'',
                     {u'href': self.feed['author_avatar'], u'rel': u'avatar'})
+        for rel, href in self.feed.get('pages') or ():
+            handler.addQuickElement(u'link', u'',
+                    {u'href': href, u'rel': rel})
 
     def add_item_elements(self, handler, item):
         """
@@ -292,51 +942,254 @@ class AtomFeed(Atom1Feed):
         updated -> updated
         description -> content (instead of summary)
         """
-        handler.addQuickElement(u"title", item['title'])
+        handler.addQuickElement(u"title", item.title)
         handler.addQuickElement(u"link", u"",
-                {u"href": item['link'], u"rel": u"alternate"})
-        if item['updated'] is not None:
+                {u"href": item.link, u"rel": u"alternate"})
+        if item.updated is not None:
             handler.addQuickElement(u"updated",
-                    rfc3339_date(item['updated']).decode('utf-8'))
-        if item['pubdate'] is not None:
+                    item.updated_string or _rfc3339(item.updated))
+        if item.pubdate is not None:
             handler.addQuickElement(u"published",
-                    rfc3339_date(item['pubdate']).decode('utf-8'))
+                    item.pubdate_string or _rfc3339(item.pubdate))
 
         # Author information.
-        if item['author_name'] is not None:
+        if item.author_name is not None:
             handler.startElement(u"author", {})
-            handler.addQuickElement(u"name", item['author_name'])
-            if item['author_email'] is not None:
-                handler.addQuickElement(u"email", item['author_email'])
-            if item['author_link'] is not None:
-                handler.addQuickElement(u"uri", item['author_link'])
+            handler.addQuickElement(u"name", item.author_name)
+            if item.author_email is not None:
+                handler.addQuickElement(u"email", item.author_email)
+            if item.author_link is not None:
+                handler.addQuickElement(u"uri", item.author_link)
             handler.endElement(u"author")
 
         # Unique ID.
-        handler.addQuickElement(u"id", item['unique_id'])
+        handler.addQuickElement(u"id", item.unique_id)
 
         # Content.
-        item_type = item.get('type', u'html')
-        content_dict = {u"type": item_type}
-        if item['base']:
-            content_dict[u"xml:base"] = item['base']
+        content_dict = {u"type": item.type or u'html'}
+        if item.base:
+            content_dict[u"xml:base"] = item.base
 
-        if item['description'] is not None:
-            handler.addQuickElement(u"content", item['description'],
+        if item.description is not None:
+            handler.addQuickElement(u"content", item.description,
                     content_dict)
 
         # Enclosure.
-        if item['enclosure'] is not None:
-            handler.addQuickElement(u"link", '',
-                {u"rel": u"enclosure",
-                 u"href": item['enclosure'].url,
-                 u"length": item['enclosure'].length,
-                 u"type": item['enclosure'].mime_type})
+        if item.enclosure is not None:
+            enclosure_dict = {u"rel": u"enclosure",
+                    u"href": item.enclosure.url,
+                    u"type": item.enclosure.mime_type}
+            if item.enclosure.length is not None:
+                enclosure_dict[u"length"] = item.enclosure.length
+            handler.addQuickElement(u"link", '', enclosure_dict)
 
         # Categories.
-        for cat in item['categories']:
+        for cat in item.categories:
             handler.addQuickElement(u"category", u"", {u"term": cat})
 
         # Rights.
-        if item['item_copyright'] is not None:
-            handler.addQuickElement(u"rights", item['item_copyright'])
+        if item.item_copyright is not None:
+            handler.addQuickElement(u"rights", item.item_copyright)
+
+
+class DirectAtomFeed(AtomFeed):
+    """
+    An AtomFeed which writes its XML directly as strings instead of
+    through feedgenerator's SAX style handler. The output is byte for
+    byte the same as AtomFeed's: elements are made from fixed
+    fragments, attributes are written in sorted order and quoted in
+    the same way, and text goes through one escaping routine.
+
+    Used when 'atom.writer' is 'direct' in config.
+    """
+
+    def write(self, outfile, encoding):
+        outfile.write(self.writeString(encoding))
+
+    def writeString(self, encoding):
+        fragments = [_xml_declaration(encoding)]
+        fragments.extend(self._root_fragments(encoding))
+        for item in self.items:
+            fragments.extend(self._entry_fragments(item, encoding))
+        fragments.append(u'</feed>')
+        return u''.join(fragments).encode(encoding, 'xmlcharrefreplace')
+
+    def write_stream(self, encoding, items):
+        """
+        Generate the feed as a series of encoded strings, writing
+        each of items as it arrives rather than those stored in
+        self.items.
+        """
+        fragments = [_xml_declaration(encoding)]
+        fragments.extend(self._root_fragments(encoding))
+        yield u''.join(fragments).encode(encoding, 'xmlcharrefreplace')
+        for item in items:
+            yield u''.join(self._entry_fragments(item, encoding)).encode(
+                    encoding, 'xmlcharrefreplace')
+        yield u'</feed>'.encode(encoding)
+
+    def _root_fragments(self, encoding):
+        feed = self.feed
+        fragments = []
+        append = fragments.append
+        if feed['language'] is not None:
+            append(u'<feed xml:lang=%s xmlns=%s>'
+                    % (_quoteattr(feed['language'], encoding),
+                        _quoteattr(self.ns, encoding)))
+        else:
+            append(u'<feed xmlns=%s>' % _quoteattr(self.ns, encoding))
+        append(u'<title>%s</title>' % _escape(feed['title'], encoding))
+        append(u'<link href=%s rel="alternate"></link>'
+                % _quoteattr(feed['link'], encoding))
+        if feed['feed_url'] is not None:
+            append(u'<link href=%s rel="self"></link>'
+                    % _quoteattr(feed['feed_url'], encoding))
+        append(u'<id>%s</id>' % _escape(feed['id'], encoding))
+        append(u'<updated>%s</updated>'
+                % _escape(rfc3339_date(self.latest_post_date()), encoding))
+        if feed['author_name'] is not None:
+            append(u'<author><name>%s</name>'
+                    % _escape(feed['author_name'], encoding))
+            if feed['author_email'] is not None:
+                append(u'<email>%s</email>'
+                        % _escape(feed['author_email'], encoding))
+            if feed['author_link'] is not None:
+                append(u'<uri>%s</uri>'
+                        % _escape(feed['author_link'], encoding))
+            append(u'</author>')
+        if feed['description'] is not None:
+            append(u'<subtitle>%s</subtitle>'
+                    % _escape(feed['description'], encoding))
+        if feed['subtitle'] is not None:
+            append(u'<subtitle>%s</subtitle>'
+                    % _escape(feed['subtitle'], encoding))
+        for cat in feed['categories']:
+            append(u'<category term=%s></category>'
+                    % _quoteattr(cat, encoding))
+        if feed['feed_copyright'] is not None:
+            append(u'<rights>%s</rights>'
+                    % _escape(feed['feed_copyright'], encoding))
+        if feed.get('hub'):
+            append(u'<link href=%s rel="hub"></link>'
+                    % _quoteattr(feed['hub'], encoding))
+        if feed.get('author_avatar'):
+            append(u'<link href=%s rel="avatar"></link>'
+                    % _quoteattr(feed['author_avatar'], encoding))
+        for rel, href in feed.get('pages') or ():
+            append(u'<link href=%s rel=%s></link>'
+                    % (_quoteattr(href, encoding), _quoteattr(rel, encoding)))
+        return fragments
+
+    def _entry_fragments(self, item, encoding):
+        fragments = [u'<entry><title>', _escape(item.title, encoding),
+                u'</title><link href=', _quoteattr(item.link, encoding),
+                u' rel="alternate"></link>']
+        append = fragments.append
+        if item.updated is not None:
+            append(u'<updated>%s</updated>' % _escape(
+                item.updated_string or _rfc3339(item.updated), encoding))
+        if item.pubdate is not None:
+            append(u'<published>%s</published>' % _escape(
+                item.pubdate_string or _rfc3339(item.pubdate), encoding))
+        if item.author_name is not None:
+            append(u'<author><name>%s</name>'
+                    % _escape(item.author_name, encoding))
+            if item.author_email is not None:
+                append(u'<email>%s</email>'
+                        % _escape(item.author_email, encoding))
+            if item.author_link is not None:
+                append(u'<uri>%s</uri>'
+                        % _escape(item.author_link, encoding))
+            append(u'</author>')
+        append(u'<id>%s</id>' % _escape(item.unique_id, encoding))
+        if item.description is not None:
+            if item.base:
+                append(u'<content type=%s xml:base=%s>'
+                        % (_quoteattr(item.type or u'html', encoding),
+                            _quoteattr(item.base, encoding)))
+            else:
+                append(u'<content type=%s>'
+                        % _quoteattr(item.type or u'html', encoding))
+            append(_escape(item.description, encoding))
+            append(u'</content>')
+        if item.enclosure is not None:
+            append(u'<link href=%s' % _quoteattr(item.enclosure.url,
+                encoding))
+            if item.enclosure.length is not None:
+                append(u' length=%s' % _quoteattr(item.enclosure.length,
+                    encoding))
+            append(u' rel="enclosure" type=%s></link>'
+                    % _quoteattr(item.enclosure.mime_type, encoding))
+        for cat in item.categories:
+            append(u'<category term=%s></category>'
+                    % _quoteattr(cat, encoding))
+        if item.item_copyright is not None:
+            append(u'<rights>%s</rights>'
+                    % _escape(item.item_copyright, encoding))
+        append(u'</entry>')
+        return fragments
+
+
+FEED_WRITERS = {
+        'sax': AtomFeed,
+        'direct': DirectAtomFeed,
+}
+
+
+def _tiddler_key(tiddler):
+    return (tiddler.bag, tiddler.title, tiddler.revision)
+
+
+def _xml_declaration(encoding):
+    return u'<?xml version="1.0" encoding="%s"?>\n' % encoding
+
+
+def _escape(text, encoding):
+    """
+    Escape text for use as XML character data, as
+    xml.sax.saxutils.escape does.
+    """
+    if text is None:
+        return u''
+    if not isinstance(text, unicode):
+        text = unicode(text, encoding)
+    if u'&' in text:
+        text = text.replace(u'&', u'&amp;')
+    if u'>' in text:
+        text = text.replace(u'>', u'&gt;')
+    if u'<' in text:
+        text = text.replace(u'<', u'&lt;')
+    return text
+
+
+def _quoteattr(value, encoding):
+    """
+    Escape and quote value for use as an attribute, choosing
+    quotes as xml.sax.saxutils.quoteattr does.
+    """
+    value = _escape(value, encoding)
+    if u'\n' in value or u'\r' in value or u'\t' in value:
+        value = value.replace(u'\n', u'&#10;').replace(
+                u'\r', u'&#13;').replace(u'\t', u'&#9;')
+    if u'"' in value:
+        if u"'" in value:
+            return u'"%s"' % value.replace(u'"', u'&quot;')
+        return u"'%s'" % value
+    return u'"%s"' % value
+
+
+def _rfc3339(date):
+    """
+    Format a datetime as an RFC 3339 unicode string.
+    """
+    return rfc3339_date(date).decode('utf-8')
+
+
+def _drain(output):
+    """
+    Return what has been written to output so far and empty it.
+    """
+    chunk = output.getvalue()
+    output.seek(0)
+    output.truncate()
+    return chunk
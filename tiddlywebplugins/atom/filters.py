@@ -0,0 +1,179 @@
+"""
+Cheaper processing of the filters in 'atom.default_filter'.
+
+A default filter like 'sort=-modified;limit=20' sorts every tiddler
+in the collection only to keep twenty. When a sort filter is directly
+followed by a limit filter the two are replaced by a single filter
+which selects the top entities with a bounded heap, in one pass over
+the input, keeping only as many entities as the limit requires.
+
+heapq.nsmallest and heapq.nlargest are equivalent to a stable sort
+followed by a slice, so the results are the same as the filters they
+replace. Only the sort and limit filters provided by TiddlyWeb are
+replaced: if a plugin has overridden either, the filters are left
+alone.
+
+The default filter is the same string for every request, so it is
+parsed and optimized once by compiled_filters and the filter functions
+are kept, keyed on the string and the filter parsers it names, for up
+to COMPILED_SIZE strings. A plugin changing one of those parsers makes
+the string be parsed again; changes to other parsers do not. The
+functions keep no state between calls, so requests in any thread share
+them: only the environ of each request is added to them.
+"""
+
+import heapq
+import threading
+
+from urlparse import parse_qs
+
+from tiddlyweb.filters import FILTER_PARSERS, parse_for_filters
+from tiddlyweb.filters.limit import limit_parse
+from tiddlyweb.filters.sort import sort_parse, ATTRIBUTE_SORT_KEY
+from tiddlyweb.store import get_entity
+
+
+COMPILED_SIZE = 64
+
+COMPILED = {}
+COMPILED_LOCK = threading.Lock()
+
+# the filter names in each string, which depend only on the string
+FILTER_NAMES = {}
+
+
+def compiled_filters(filter_string, environ):
+    """
+    Return the filters of filter_string, parsed and optimized, with
+    environ as their environ, parsing the string only the first
+    time it is seen.
+    """
+    try:
+        names = FILTER_NAMES[filter_string]
+    except KeyError:
+        names = filter_names(filter_string)
+    # names without a parser are left over, so None is part of the key
+    key = (filter_string, tuple(FILTER_PARSERS.get(name) for name in names))
+    try:
+        compiled = COMPILED[key]
+    except KeyError:
+        filters, _ = parse_for_filters(filter_string)
+        compiled = [(function, spec) for function, spec, _
+                in optimize_filters(filters)]
+        with COMPILED_LOCK:
+            if len(COMPILED) >= COMPILED_SIZE:
+                COMPILED.clear()
+                FILTER_NAMES.clear()
+            COMPILED[key] = compiled
+            FILTER_NAMES[filter_string] = names
+    return [(function, spec, environ) for function, spec in compiled]
+
+
+def filter_names(filter_string):
+    """
+    The names of the filters in filter_string, split as
+    parse_for_filters splits it, whether or not there is
+    a parser for them.
+    """
+    if ';' in filter_string:
+        strings = filter_string.split(';')
+    else:
+        strings = filter_string.split('&')
+    names = []
+    for string in strings:
+        names.extend(parse_qs(string).keys())
+    return tuple(names)
+
+
+def optimize_filters(filters):
+    """
+    Return a new list of filters, as made by parse_for_filters,
+    in which each sort filter followed by a limit filter is
+    replaced by a top k selection.
+    """
+    if (FILTER_PARSERS.get('sort') is not sort_parse
+            or FILTER_PARSERS.get('limit') is not limit_parse):
+        return filters
+
+    optimized = []
+    index = 0
+    while index < len(filters):
+        current = filters[index]
+        try:
+            following = filters[index + 1]
+            if current[1][0] == 'sort' and following[1][0] == 'limit':
+                optimized.append((top_k_parse(current[1][1],
+                    following[1][1]), ('sort_limit', '%s;%s'
+                        % (current[1][1], following[1][1])), current[2]))
+                index += 2
+                continue
+        except (IndexError, TypeError):
+            pass
+        optimized.append(current)
+        index += 1
+    return optimized
+
+
+def top_k_parse(attribute, count):
+    """
+    Create a function which will sort a collection of entities by
+    attribute and return the slice described by count, in the
+    syntax of the limit filter.
+    """
+    start = '0'
+    if ',' in count:
+        start, count = count.split(',', 1)
+    start = int(start)
+    count = int(count)
+
+    reverse = attribute.startswith('-')
+    if reverse:
+        attribute = attribute.replace('-', '', 1)
+
+    def selector(entities, indexable=False, environ=None):
+        # refused when filtering, as islice in the limit filter
+        # refuses them, so that recursive_filter makes a FilterError
+        if start < 0 or start + count < 0:
+            raise ValueError('limit start and end must not be '
+                    'negative: %s,%s' % (start, count))
+        return top_k(attribute, entities, start, count, reverse=reverse,
+                environ=environ)
+
+    return selector
+
+
+def top_k(attribute, entities, start, count, reverse=False, environ=None):
+    """
+    Select the entities at positions start to start + count of
+    the entities sorted by attribute, without sorting them all.
+    """
+    if environ is None:
+        environ = {}
+
+    if count <= 0:
+        return iter([])
+
+    store = environ.get('tiddlyweb.store', None)
+
+    func = ATTRIBUTE_SORT_KEY.get(attribute, lambda x: x.lower())
+
+    def key_gen(entity):
+        """
+        Reify the attribute needed for sorting, in the same way
+        as the sort filter does.
+        """
+        stored_entity = get_entity(entity, store)
+        try:
+            return func(getattr(stored_entity, attribute))
+        except AttributeError as attribute_exc:
+            try:
+                return func(stored_entity.fields[attribute])
+            except (AttributeError, KeyError) as exc:
+                raise AttributeError('on %s, no attribute: %s, %s, %s'
+                        % (stored_entity, attribute, attribute_exc, exc))
+
+    if reverse:
+        selected = heapq.nlargest(start + count, entities, key=key_gen)
+    else:
+        selected = heapq.nsmallest(start + count, entities, key=key_gen)
+    return iter(selected[start:])
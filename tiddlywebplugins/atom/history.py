@@ -0,0 +1,105 @@
+"""
+Feeds of the recent edits across a whole bag.
+
+When 'atom.history' is set True in config, /bags/{bag}/revisions.atom
+is a feed of the newest revisions of all the tiddlers in the bag,
+newest first, as many as the default filter allows (as for aggregate
+feeds, see tiddlywebplugins.atom.aggregate) or 'atom.history_limit'
+(default 20).
+
+A revision is never newer than the latest revision of its tiddler, so
+the tiddlers of the bag are taken newest first, from the recent index
+when there is one, and each tiddler taken is opened: its list of
+revisions is read and its next older revision joins a heap of the
+opened tiddlers. The feed takes from whichever of the next tiddler and
+the top of the heap is newer. Only the tiddlers with a revision in the
+feed are opened, and each revision is loaded once, when it is next in
+line, so the work grows with the length of the feed rather than with
+the number of tiddlers in the bag.
+
+Each entry has the revision in its id, so entries for revisions of
+the same tiddler are distinct.
+"""
+
+import heapq
+import itertools
+
+from httpexceptor import HTTP404
+
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.collections import Tiddlers
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import NoBagError, StoreError
+from tiddlyweb.web.sendtiddlers import send_tiddlers
+from tiddlyweb.web.util import get_route_value
+
+from tiddlywebplugins.atom.aggregate import (bag_order, take_newest,
+        newest_first_key)
+
+
+HISTORY_ROUTE = '/bags/{bag_name:segment}/revisions[.{format}]'
+
+
+def get_history(environ, start_response):
+    """
+    Send the newest revisions of the tiddlers in the bag named
+    in the route.
+    """
+    bag_name = get_route_value(environ, 'bag_name')
+    store = environ['tiddlyweb.store']
+    try:
+        bag = store.get(Bag(bag_name))
+    except NoBagError as exc:
+        raise HTTP404('bag %s not found, %s' % (bag_name, exc))
+    bag.policy.allows(environ['tiddlyweb.usersign'], 'read')
+
+    tiddlers = Tiddlers(title=u'Revisions of %s' % bag_name, store=store)
+    tiddlers.is_revisions = True
+    for tiddler in take_newest(environ, revision_stream(environ, bag_name),
+            'atom.history_limit'):
+        tiddlers.add(tiddler)
+    return send_tiddlers(environ, start_response, tiddlers=tiddlers)
+
+
+def revision_stream(environ, bag_name):
+    """
+    Yield the revisions of the tiddlers in bag_name, loaded,
+    newest first.
+    """
+    store = environ['tiddlyweb.store']
+    heads = bag_order(environ, bag_name)
+    opened = []
+    sequence = itertools.count()
+    head = next(heads, None)
+    while head is not None or opened:
+        if head is not None and (not opened or head[0] <= opened[0][0]):
+            _, title, _, revision = head
+            head = next(heads, None)
+            tiddler = _get_revision(store, bag_name, title, revision)
+            if tiddler is None:
+                continue
+            revision_ids = store.list_tiddler_revisions(tiddler)
+            try:
+                older = iter(revision_ids[
+                    revision_ids.index(tiddler.revision) + 1:])
+            except ValueError:
+                older = iter(revision_ids[1:])
+        else:
+            _, _, tiddler, older = heapq.heappop(opened)
+        yield tiddler
+        for revision_id in older:
+            revision = _get_revision(store, bag_name, tiddler.title,
+                    revision_id)
+            if revision is not None:
+                heapq.heappush(opened, (newest_first_key(revision.modified),
+                    next(sequence), revision, older))
+                break
+
+
+def _get_revision(store, bag_name, title, revision_id):
+    revision = Tiddler(title, bag_name)
+    revision.revision = revision_id
+    try:
+        return store.get(revision)
+    except StoreError:
+        return None
@@ -0,0 +1,369 @@
+"""
+Serve the busiest feeds from files made ahead of time.
+
+A few feed URLs, such as the front page recipe or a popular bag, often
+get most of the requests. List their paths in 'atom.hot_feeds':
+
+    'atom.hot_feeds': ['/bags/news/tiddlers.atom',
+                       '/recipes/default/tiddlers.atom'],
+
+and a GET of one of those paths, without a query string, is answered
+from a file below 'atom.hot_feeds_dir' (default 'atomhot', relative to
+the instance) holding the response made for a GUEST request. The file
+is sent with the server's wsgi.file_wrapper, if it has one, so it can
+be sent without copying. If-None-Match is checked against the stored
+ETag. If 'atom.gzip' is set a gzip compressed copy is kept next to the
+file and sent to clients which accept it.
+
+A file is made by passing a GUEST request for the path through the
+rest of the application. This is done after the first request for it,
+and again whenever a tiddler is put or deleted in one of its bags, or
+its bag or recipe changes. When that happens the file is removed at
+once and remade 'atom.hot_feeds_delay' seconds (default 2) after the
+last change, so a burst of changes causes one rebuild. A feed whose
+GUEST request does not succeed, for example because GUEST may not read
+the bag, or which runs out of budget (see tiddlywebplugins.atom.budget),
+is not made until it changes.
+
+A process only sees the changes made through its own store, so before
+a new file is moved into place its ETag is checked against the store
+with a conditional GUEST request, and the file is dropped if the feed
+has changed since it was made, here or in another process. With a
+single process no stale feed is served. With several, a change in
+another process in the moment between that check and the move can
+leave a stale file in place until the feed next changes.
+
+Files are written to the side and moved into place. The HotFeeds
+middleware is the outermost response filter so that nothing wraps
+the file it sends.
+"""
+
+import json
+import logging
+import os
+import threading
+
+from urllib import unquote
+
+from StringIO import StringIO
+
+from tiddlyweb.config import config as global_config
+from tiddlyweb.model.recipe import Recipe
+from tiddlyweb.store import HOOKS, StoreError
+from tiddlyweb.util import sha
+
+from tiddlywebplugins.atom.budget import cut_short
+from tiddlywebplugins.atom.compress import (accepts_gzip, gzip_bytes,
+        vary_on_encoding)
+from tiddlywebplugins.atom.conditional import base_etag, gzip_etag
+
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_DIR = 'atomhot'
+DEFAULT_DELAY = 2
+BLOCK_SIZE = 65536
+GZIP_SUFFIX = '.gz'
+
+GENERATORS = []
+
+
+class HotFeeds(object):
+    """
+    WSGI middleware which answers requests for hot feeds from
+    files, and remakes those files when they change.
+    """
+
+    def __init__(self, application, config=None):
+        self.application = application
+        self.config = config or global_config
+        self.root = self.config.get('atom.hot_feeds_dir', DEFAULT_DIR)
+        if not os.path.isabs(self.root):
+            self.root = os.path.join(self.config.get('root_dir', ''),
+                    self.root)
+        self._timers = {}
+        self._failed = set()
+        self._versions = {}
+        self._lock = threading.Lock()
+        GENERATORS.append(self)
+
+    def __call__(self, environ, start_response):
+        path = _request_path(environ)
+        if (environ.get('REQUEST_METHOD') != 'GET'
+                or environ.get('QUERY_STRING')
+                or path not in self.paths()):
+            return self.application(environ, start_response)
+
+        try:
+            feed = None
+            if self.config.get('atom.gzip', False) and accepts_gzip(environ):
+                try:
+                    feed = open(self._path(path, GZIP_SUFFIX), 'rb')
+                except IOError:
+                    pass
+            if feed is None:
+                feed = open(self._path(path), 'rb')
+        except IOError:
+            if path not in self._failed and path not in self._timers:
+                self.schedule(path, 0)
+            return self.application(environ, start_response)
+
+        headers = [(str(name), str(value)) for name, value
+                in json.loads(feed.readline())]
+        etag = dict((name.lower(), value) for name, value
+                in headers).get('etag')
+        if etag and _etag_matches(environ, etag):
+            feed.close()
+            start_response('304 Not Modified', [(name, value) for
+                name, value in headers if name.lower() in
+                ('etag', 'last-modified', 'cache-control', 'vary')])
+            return []
+
+        start_response('200 OK', headers)
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        if file_wrapper:
+            return file_wrapper(feed, BLOCK_SIZE)
+        return _read_blocks(feed)
+
+    def paths(self):
+        """
+        The paths of the configured hot feeds.
+        """
+        return self.config.get('atom.hot_feeds', [])
+
+    def changed(self, store, bag_name=None, recipe_name=None):
+        """
+        Remove the files of the feeds which depend on bag_name or
+        recipe_name and schedule them to be remade.
+        """
+        delay = float(self.config.get('atom.hot_feeds_delay',
+            DEFAULT_DELAY))
+        for path in self.paths():
+            if depends_on(store, path, bag_name, recipe_name):
+                with self._lock:
+                    self._failed.discard(path)
+                    self._versions[path] = self._versions.get(path, 0) + 1
+                    self.discard(path)
+                self.schedule(path, delay)
+
+    def discard(self, path):
+        """
+        Remove the files of the feed at path.
+        """
+        for suffix in ['', GZIP_SUFFIX]:
+            try:
+                os.unlink(self._path(path, suffix))
+            except OSError:
+                pass
+
+    def schedule(self, path, delay):
+        """
+        Make the file for path in delay seconds, replacing any
+        rebuild already waiting.
+        """
+        with self._lock:
+            timer = self._timers.pop(path, None)
+            if timer is not None:
+                timer.cancel()
+            timer = self._timers[path] = threading.Timer(delay,
+                    self._generate_scheduled, (path,))
+            timer.daemon = True
+        timer.start()
+
+    def generate(self, path):
+        """
+        Make the file for path by making a GUEST request for it.
+        Return True if it was made.
+        """
+        version = self._versions.get(path, 0)
+        environ = _guest_environ(path)
+        try:
+            response, body = self._request(environ)
+        except Exception as exc:
+            LOGGER.warn('unable to make hot feed %s: %s', path, exc)
+            self._failed.add(path)
+            return False
+        if not response.get('status', '').startswith('200'):
+            LOGGER.debug('hot feed %s not made: %s', path,
+                    response.get('status'))
+            self._failed.add(path)
+            return False
+        if cut_short(environ):
+            LOGGER.warn('hot feed %s not made: over budget', path)
+            self._failed.add(path)
+            return False
+
+        headers = [(name, value) for name, value in response['headers']
+                if name.lower() != 'content-length']
+        headers.append(('Content-Length', str(len(body))))
+        etag = dict((name.lower(), value) for name, value
+                in headers).get('etag')
+        if not self._current(path, etag):
+            # changed while it was made, perhaps in another process
+            LOGGER.debug('hot feed %s not made: changed', path)
+            return False
+        with self._lock:
+            # a change while making the feed will make it again
+            if self._versions.get(path, 0) != version:
+                return False
+            if self.config.get('atom.gzip', False):
+                compressed = gzip_bytes(body)
+                gzip_headers = vary_on_encoding([(name, gzip_etag(value)
+                    if name.lower() == 'etag' else value)
+                    for name, value in headers[:-1]]) + [
+                        ('Content-Encoding', 'gzip'),
+                        ('Content-Length', str(len(compressed)))]
+                self._write(path, json.dumps(gzip_headers) + '\n'
+                        + compressed, GZIP_SUFFIX)
+            self._write(path, json.dumps(headers) + '\n' + body)
+        return True
+
+    def _current(self, path, etag):
+        """
+        True if the feed at path, as the store now holds it, still
+        has etag. The feed answers a matching If-None-Match with a
+        304 before it renders anything.
+        """
+        if not etag:
+            return False
+        environ = _guest_environ(path)
+        environ['HTTP_IF_NONE_MATCH'] = etag
+        try:
+            response, _ = self._request(environ)
+        except Exception:
+            return False
+        return response.get('status', '').startswith('304')
+
+    def _request(self, environ):
+        """
+        Pass environ through the application, returning the
+        status and headers and the body of its response.
+        """
+        response = {}
+
+        def capture_start_response(status, headers, exc_info=None):
+            response['status'] = status
+            response['headers'] = headers
+            return lambda data: None
+
+        output = self.application(environ, capture_start_response)
+        try:
+            body = ''.join(output)
+        finally:
+            if hasattr(output, 'close'):
+                output.close()
+        return response, body
+
+    def _generate_scheduled(self, path):
+        with self._lock:
+            self._timers.pop(path, None)
+        self.generate(path)
+
+    def _write(self, path, content, suffix=''):
+        try:
+            os.makedirs(self.root)
+        except OSError:
+            if not os.path.isdir(self.root):
+                raise
+        target = self._path(path, suffix)
+        temp_path = '%s.%s.tmp' % (target, threading.current_thread().ident)
+        with open(temp_path, 'wb') as temp_file:
+            temp_file.write(content)
+        os.rename(temp_path, target)
+
+    def _path(self, path, suffix=''):
+        return os.path.join(self.root, sha(path).hexdigest() + suffix)
+
+
+def register_hooks():
+    """
+    Add the store HOOKS that remake hot feeds when they change.
+    """
+    for method in ['put', 'delete']:
+        for entity, hook in [('tiddler', _tiddler_changed),
+                ('bag', _bag_changed), ('recipe', _recipe_changed)]:
+            if hook not in HOOKS[entity][method]:
+                HOOKS[entity][method].append(hook)
+
+
+def _tiddler_changed(store, tiddler):
+    for generator in GENERATORS:
+        generator.changed(store, bag_name=tiddler.bag)
+
+
+def _bag_changed(store, bag):
+    for generator in GENERATORS:
+        generator.changed(store, bag_name=bag.name)
+
+
+def _recipe_changed(store, recipe):
+    for generator in GENERATORS:
+        generator.changed(store, recipe_name=recipe.name)
+
+
+def depends_on(store, path, bag_name=None, recipe_name=None):
+    """
+    True if the feed at path may include tiddlers from bag_name
+    or is of the recipe recipe_name. Feeds of other paths depend
+    on every bag.
+    """
+    parts = path.split('/')
+    try:
+        kind, name = parts[-3], unquote(parts[-2]).decode('utf-8')
+    except IndexError:
+        return True
+    if kind == 'bags':
+        return name == bag_name
+    if kind == 'recipes':
+        if recipe_name is not None:
+            return name == recipe_name
+        try:
+            recipe = store.get(Recipe(name))
+        except StoreError:
+            return True
+        return bag_name in [bag for bag, _ in recipe.get_recipe()]
+    return True
+
+
+def _etag_matches(environ, etag):
+    """
+    True if the If-None-Match of the request holds etag in any of
+    its forms, as of the compressed or uncompressed file.
+    """
+    incoming_etag = environ.get('HTTP_IF_NONE_MATCH', '')
+    return base_etag(etag) in [base_etag(candidate.strip())
+            for candidate in incoming_etag.split(',') if candidate.strip()]
+
+
+def _guest_environ(path):
+    return {
+            'REQUEST_METHOD': 'GET',
+            'REQUEST_URI': path,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': unquote(path),
+            'QUERY_STRING': '',
+            'SERVER_NAME': 'localhost',
+            'SERVER_PORT': '80',
+            'HTTP_ACCEPT': 'application/atom+xml',
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': StringIO(''),
+            'wsgi.errors': StringIO(),
+    }
+
+
+def _request_path(environ):
+    request_uri = environ.get('REQUEST_URI', environ.get('RAW_URI', ''))
+    if request_uri:
+        return request_uri.split('?', 1)[0]
+    return environ.get('SCRIPT_NAME', '') + environ.get('PATH_INFO', '')
+
+
+def _read_blocks(feed):
+    try:
+        while True:
+            block = feed.read(BLOCK_SIZE)
+            if not block:
+                break
+            yield block
+    finally:
+        feed.close()
@@ -0,0 +1,125 @@
+"""
+Paged feeds, as described in RFC 5005.
+
+When 'atom.page_size' is set in config, a collection feed holds at
+most that many entries, newest first, and links to the first, next
+and previous pages of the feed with link elements of those rels.
+
+A page is identified by a cursor query parameter: an opaque token
+naming the (modified, bag, title) of the entry the page starts after
+or ends before. Because pages are found relative to an entry rather
+than by position, a page stays in place when tiddlers are added or
+changed between fetches. Each page is selected with a bounded heap in
+one pass over the tiddlers, holding only a page of them.
+"""
+
+import base64
+import heapq
+
+from httpexceptor import HTTP400
+
+from tiddlyweb.filters.sort import date_to_canonical
+from tiddlyweb.store import get_entity
+
+
+CURSOR_PARAMETER = 'cursor'
+
+AFTER = u'a'
+BEFORE = u'b'
+
+
+def encode_cursor(direction, key):
+    """
+    Make an opaque cursor for the page which is after or before
+    the entry with key.
+    """
+    data = u'\x00'.join((direction,) + tuple(key)).encode('utf-8')
+    return base64.urlsafe_b64encode(data).rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Turn a cursor back into a direction and key, raising 400
+    if it is not one we made.
+    """
+    try:
+        cursor = str(cursor)
+        cursor += '=' * (-len(cursor) % 4)
+        parts = base64.urlsafe_b64decode(cursor).decode('utf-8').split(
+                u'\x00')
+        direction, modified, bag, title = parts
+    except (TypeError, ValueError, UnicodeError):
+        raise HTTP400('invalid feed cursor')
+    if direction not in (AFTER, BEFORE):
+        raise HTTP400('invalid feed cursor')
+    return direction, (modified, bag, title)
+
+
+def page_key(tiddler, store=None):
+    """
+    The position of tiddler in a paged feed. Pages are in
+    descending order of this key.
+    """
+    stored_tiddler = get_entity(tiddler, store)
+    return (date_to_canonical(u'%s' % stored_tiddler.modified),
+            stored_tiddler.bag or u'', stored_tiddler.title)
+
+
+def select_page(tiddlers, page_size, cursor=None, store=None):
+    """
+    Select the page of tiddlers identified by cursor, or the first
+    page if there is none.
+
+    Return the tiddlers on the page, newest first, and the cursors
+    of the next and previous pages, each None if there is no
+    such page.
+    """
+    direction, cursor_key = AFTER, None
+    if cursor:
+        direction, cursor_key = decode_cursor(cursor)
+
+    keyed = ((page_key(tiddler, store), index, tiddler)
+            for index, tiddler in enumerate(tiddlers))
+
+    if direction == AFTER:
+        if cursor_key is not None:
+            keyed = (entry for entry in keyed if entry[0] < cursor_key)
+        selected = heapq.nlargest(page_size + 1, keyed,
+                key=lambda entry: (entry[0], -entry[1]))
+        more = len(selected) > page_size
+        selected = selected[:page_size]
+        next_cursor = previous_cursor = None
+        if selected and more:
+            next_cursor = encode_cursor(AFTER, selected[-1][0])
+        if selected and cursor_key is not None:
+            previous_cursor = encode_cursor(BEFORE, selected[0][0])
+    else:
+        keyed = (entry for entry in keyed if entry[0] > cursor_key)
+        selected = heapq.nsmallest(page_size + 1, keyed,
+                key=lambda entry: (entry[0], -entry[1]))
+        more = len(selected) > page_size
+        selected = list(reversed(selected[:page_size]))
+        next_cursor = previous_cursor = None
+        if selected:
+            next_cursor = encode_cursor(AFTER, selected[-1][0])
+        if selected and more:
+            previous_cursor = encode_cursor(BEFORE, selected[0][0])
+
+    return ([entry[2] for entry in selected], next_cursor, previous_cursor)
+
+
+def page_url(base_url, query_string, cursor=None):
+    """
+    The URL of the page with cursor, keeping all of query_string
+    except any existing cursor.
+    """
+    separator = ';' if ';' in query_string else '&'
+    parameters = [parameter for parameter in query_string.split(separator)
+            if parameter and not
+            parameter.startswith(CURSOR_PARAMETER + '=')]
+    if cursor:
+        parameters.append('%s=%s' % (CURSOR_PARAMETER, cursor))
+    if parameters:
+        return u'%s?%s' % (base_url,
+                separator.join(parameters).decode('utf-8', 'replace'))
+    return base_url
@@ -0,0 +1,137 @@
+"""
+Render the content of feed entries concurrently.
+
+Rendering wikitext and markdown is CPU bound and independent for each
+tiddler. If 'atom.render_workers' is set in config to a number greater
+than one, the tiddlers of a collection feed are taken in batches and
+the renderable ones in each batch are rendered by a pool of that many
+workers. Entries are still written in the order of the collection.
+
+'atom.render_pool' chooses the kind of pool:
+
+    'thread' (the default) renders in threads of this process, sharing
+    the request's environ. Only renderers which release the GIL gain
+    from this.
+
+    'process' renders in worker processes, each with its own store,
+    so one feed can use more than one core. Tiddlers are sent to the
+    workers as plain data, with the name and roles of the requesting
+    user, so that content which depends on what the user may read,
+    such as a transcluded tiddler, renders as it does in the request.
+
+'atom.render_batch' sets how many tiddlers are taken at a time (default
+eight per worker). When fewer than 'atom.render_parallel_min' tiddlers
+(default 8) in a batch need rendering they are rendered in the request,
+so small feeds do not pay for the pool.
+
+Pools are created on first use and kept for the life of the process.
+"""
+
+import threading
+
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import Store
+
+
+DEFAULT_PARALLEL_MIN = 8
+BATCH_PER_WORKER = 8
+
+POOLS = {}
+POOLS_LOCK = threading.Lock()
+
+WORKER_ENVIRON = {}
+
+
+def get_pool(config):
+    """
+    Return the render pool configured in config, creating it on
+    first use, or None if rendering is to be done serially.
+    """
+    workers = int(config.get('atom.render_workers', 0) or 0)
+    if workers <= 1:
+        return None
+    kind = config.get('atom.render_pool', 'thread')
+    with POOLS_LOCK:
+        try:
+            return POOLS[(kind, workers)]
+        except KeyError:
+            if kind == 'process':
+                pool = Pool(workers, _init_worker, (config,))
+            else:
+                pool = ThreadPool(workers)
+            POOLS[(kind, workers)] = pool
+            return pool
+
+
+def batch_size(config):
+    """
+    The number of tiddlers to gather before rendering.
+    """
+    workers = int(config.get('atom.render_workers', 0) or 0)
+    return int(config.get('atom.render_batch', workers * BATCH_PER_WORKER))
+
+
+def render_batch(pool, environ, tiddlers, render):
+    """
+    Render each of tiddlers with the pool, returning a list
+    of descriptions in the same order. render is the function used
+    to render one tiddler in this process.
+    """
+    config = environ.get('tiddlyweb.config', {})
+    if len(tiddlers) < int(config.get('atom.render_parallel_min',
+            DEFAULT_PARALLEL_MIN)):
+        return [render(tiddler, environ) for tiddler in tiddlers]
+    if config.get('atom.render_pool', 'thread') == 'process':
+        usersign = _usersign_data(environ)
+        return pool.map(_render_worker,
+                [(usersign, _tiddler_data(tiddler)) for tiddler in tiddlers])
+    return pool.map(lambda tiddler: render(tiddler, environ), tiddlers)
+
+
+def _init_worker(config):
+    """
+    Give a worker process an environ with its own store.
+    """
+    WORKER_ENVIRON['tiddlyweb.config'] = config
+    WORKER_ENVIRON['tiddlyweb.usersign'] = {'name': u'GUEST', 'roles': []}
+    WORKER_ENVIRON['tiddlyweb.store'] = Store(config['server_store'][0],
+            config['server_store'][1], environ=WORKER_ENVIRON)
+
+
+def _render_worker(task):
+    from tiddlywebplugins.atom.feed import render_description
+    usersign, data = task
+    # a worker renders one tiddler at a time
+    WORKER_ENVIRON['tiddlyweb.usersign'] = usersign
+    return render_description(_tiddler_from_data(data), WORKER_ENVIRON)
+
+
+def _usersign_data(environ):
+    usersign = environ.get('tiddlyweb.usersign') or {}
+    return {'name': usersign.get('name', u'GUEST'),
+            'roles': list(usersign.get('roles', []))}
+
+
+def _tiddler_data(tiddler):
+    return (tiddler.title, tiddler.bag, tiddler.recipe, tiddler.revision,
+            tiddler.type, tiddler.text, tiddler.tags, tiddler.fields,
+            tiddler.modifier, tiddler.modified, tiddler.created)
+
+
+def _tiddler_from_data(data):
+    (title, bag, recipe, revision, tiddler_type, text, tags, fields,
+            modifier, modified, created) = data
+    tiddler = Tiddler(title, bag)
+    tiddler.recipe = recipe
+    tiddler.revision = revision
+    tiddler.type = tiddler_type
+    tiddler.text = text
+    tiddler.tags = tags
+    tiddler.fields = fields
+    tiddler.modifier = modifier
+    tiddler.modified = modified
+    tiddler.created = created
+    return tiddler
@@ -0,0 +1,290 @@
+"""
+An index of the most recently modified tiddlers in each bag.
+
+A feed of the tiddlers in a bag with a default filter like
+'sort=-modified;limit=20' loads every tiddler in the bag to keep
+twenty. When 'atom.recent_index' is set True in config, a small index
+of the 'atom.recent_index_size' (default 50) most recently modified
+tiddlers in each bag is kept in files below 'atom.recent_index_dir'
+(default 'atomrecent', relative to the instance). Each record holds
+the title, revision, modified time and modifier of a tiddler.
+
+The index is used for feeds of a whole bag whose default filter is
+any number of select filters followed by a sort on -modified and a
+limit no larger than the index. The filters are run over the tiddlers
+in the index, so only those are loaded from the store. As the index
+holds the newest tiddlers in the bag, the result is the same as for
+the whole bag unless the select filters leave fewer tiddlers than the
+limit, in which case the whole bag is used as before. A request with
+filters of its own, such as a select in its query string, is not made
+from the index.
+
+The index for a bag is made from every tiddler in the bag, read from
+the store rather than taken from a request, the first time a feed of
+it is requested. After that the store HOOKS keep it current: a put adds
+or moves the tiddler's record, a delete removes it, and the deletion
+of a bag removes its index. When a tiddler in a full index is deleted
+the index is dropped, to be made again, as an older tiddler may now
+belong in it. If a hook can not write the index it drops it, so the
+put or delete of the tiddler does not fail.
+
+Indexes are written to the side and moved into place, but puts in
+separate processes at the same moment may lose one update.
+"""
+
+import heapq
+import json
+import logging
+import os
+import threading
+
+from tiddlyweb.filters import recursive_filter
+from tiddlyweb.filters.sort import date_to_canonical
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.collections import Tiddlers
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import HOOKS, StoreError
+from tiddlyweb.util import sha, read_utf8_file, write_utf8_file
+
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_SIZE = 50
+DEFAULT_DIR = 'atomrecent'
+
+INDEXES = {}
+INDEX_LOCK = threading.Lock()
+
+
+class RecentIndex(object):
+    """
+    The most recently modified tiddlers of each bag, newest first,
+    kept in one file per bag.
+    """
+
+    def __init__(self, config):
+        self.size = int(config.get('atom.recent_index_size', DEFAULT_SIZE))
+        self.root = config.get('atom.recent_index_dir', DEFAULT_DIR)
+        if not os.path.isabs(self.root):
+            self.root = os.path.join(config.get('root_dir', ''), self.root)
+
+    def read(self, bag):
+        """
+        Return the records of bag as a list of (title, revision,
+        modified, modifier), newest first, or None if there is
+        no index for bag.
+        """
+        try:
+            return [tuple(record) for record in
+                    json.loads(read_utf8_file(self._path(bag)))]
+        except (IOError, OSError, ValueError):
+            return None
+
+    def build(self, store, bag):
+        """
+        Make the index of bag from all of the tiddlers in it, read
+        from store, and return its records. If the index can not
+        be written the records are still returned.
+        """
+        records = heapq.nlargest(self.size,
+                (_record(tiddler) for tiddler in bag_tiddlers(store, bag)),
+                key=_modified)
+        with INDEX_LOCK:
+            try:
+                self._write(bag, records)
+            except (IOError, OSError) as exc:
+                LOGGER.warn('unable to write recent index of %s: %s',
+                        bag, exc)
+        return records
+
+    def put(self, tiddler):
+        """
+        Update the record of tiddler in the index of its bag, if
+        there is one.
+        """
+        with INDEX_LOCK:
+            records = self.read(tiddler.bag)
+            if records is None:
+                return
+            records = [record for record in records
+                    if record[0] != tiddler.title]
+            records.append(_record(tiddler))
+            records.sort(key=_modified, reverse=True)
+            self._write(tiddler.bag, records[:self.size])
+
+    def delete(self, tiddler):
+        """
+        Remove the record of tiddler from the index of its bag.
+        """
+        with INDEX_LOCK:
+            records = self.read(tiddler.bag)
+            if records is None:
+                return
+            remaining = [record for record in records
+                    if record[0] != tiddler.title]
+            if len(remaining) == len(records):
+                return
+            if len(records) < self.size:
+                self._write(tiddler.bag, remaining)
+            else:
+                self.drop(tiddler.bag)
+
+    def drop(self, bag):
+        """
+        Remove the index of bag.
+        """
+        try:
+            os.unlink(self._path(bag))
+        except OSError:
+            pass
+
+    def _write(self, bag, records):
+        path = self._path(bag)
+        try:
+            os.makedirs(self.root)
+        except OSError:
+            if not os.path.isdir(self.root):
+                raise
+        temp_path = '%s.%s.tmp' % (path, threading.current_thread().ident)
+        write_utf8_file(temp_path, json.dumps(records))
+        os.rename(temp_path, path)
+
+    def _path(self, bag):
+        return os.path.join(self.root, sha(bag).hexdigest())
+
+
+def recent_limit(filters):
+    """
+    If filters, as made by parse_for_filters and optimize_filters,
+    are select filters followed by a sort on -modified and a limit,
+    return the start and count of the limit. Otherwise return None.
+    """
+    if not filters:
+        return None
+    key, argument = filters[-1][1]
+    if key != 'sort_limit':
+        return None
+    attribute, limit = argument.split(';', 1)
+    if attribute != '-modified':
+        return None
+    for _, (key, _), _ in filters[:-1]:
+        if key != 'select':
+            return None
+    start = '0'
+    if ',' in limit:
+        start, limit = limit.split(',', 1)
+    return int(start), int(limit)
+
+
+def recent_selection(environ, tiddlers, filters):
+    """
+    Return the tiddlers selected by filters from the tiddlers of
+    a bag, using the index of the bag. Return None if the index
+    can not be used for tiddlers and filters, or does not hold
+    enough of the bag.
+    """
+    config = environ.get('tiddlyweb.config', {})
+    if not config.get('atom.recent_index', False):
+        return None
+    # tiddlers has already been through the request's own filters
+    if environ.get('tiddlyweb.filters'):
+        return None
+    if (not tiddlers.bag or tiddlers.recipe or tiddlers.is_search
+            or tiddlers.is_revisions or not tiddlers.store):
+        return None
+    limit = recent_limit(filters)
+    index = get_index(config)
+    if limit is None or sum(limit) > index.size:
+        return None
+
+    records = index.read(tiddlers.bag)
+    if records is None:
+        records = index.build(tiddlers.store, tiddlers.bag)
+
+    references = Tiddlers()
+    for title, revision, _, _ in records:
+        tiddler = Tiddler(title, tiddlers.bag)
+        tiddler.revision = revision
+        references.add(tiddler)
+    # load the tiddlers as they are filtered
+    references.store = tiddlers.store
+
+    selected = list(recursive_filter(filters, references))
+    if len(selected) < limit[1] and len(records) >= index.size:
+        return None
+    return selected
+
+
+def bag_tiddlers(store, bag_name):
+    """
+    Yield each tiddler in bag_name, loaded from store.
+    """
+    for tiddler in store.list_bag_tiddlers(Bag(bag_name)):
+        try:
+            yield store.get(tiddler)
+        except StoreError:
+            continue
+
+
+def get_index(config):
+    """
+    The RecentIndex for config, created on first use.
+    """
+    root = config.get('atom.recent_index_dir', DEFAULT_DIR)
+    try:
+        return INDEXES[root]
+    except KeyError:
+        index = INDEXES[root] = RecentIndex(config)
+        return index
+
+
+def register_hooks():
+    """
+    Add the store HOOKS that keep the index current.
+    """
+    for method, hook in [('put', _tiddler_put),
+            ('delete', _tiddler_deleted)]:
+        if hook not in HOOKS['tiddler'][method]:
+            HOOKS['tiddler'][method].append(hook)
+    if _bag_deleted not in HOOKS['bag']['delete']:
+        HOOKS['bag']['delete'].append(_bag_deleted)
+
+
+def _tiddler_put(store, tiddler):
+    config = store.environ.get('tiddlyweb.config', {})
+    if config.get('atom.recent_index', False):
+        index = get_index(config)
+        try:
+            index.put(tiddler)
+        except (IOError, OSError) as exc:
+            # the tiddler is stored, so only the index is out of date
+            LOGGER.warn('unable to update recent index of %s, dropping '
+                    'it: %s', tiddler.bag, exc)
+            index.drop(tiddler.bag)
+
+
+def _tiddler_deleted(store, tiddler):
+    config = store.environ.get('tiddlyweb.config', {})
+    if config.get('atom.recent_index', False):
+        index = get_index(config)
+        try:
+            index.delete(tiddler)
+        except (IOError, OSError) as exc:
+            LOGGER.warn('unable to update recent index of %s, dropping '
+                    'it: %s', tiddler.bag, exc)
+            index.drop(tiddler.bag)
+
+
+def _bag_deleted(store, bag):
+    config = store.environ.get('tiddlyweb.config', {})
+    if config.get('atom.recent_index', False):
+        get_index(config).drop(bag.name)
+
+
+def _record(tiddler):
+    return (tiddler.title, tiddler.revision,
+            date_to_canonical(u'%s' % tiddler.modified), tiddler.modifier)
+
+
+def _modified(record):
+    return record[2]
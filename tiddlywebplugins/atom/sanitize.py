@@ -0,0 +1,241 @@
+"""
+An allowlist sanitizer for the content of HTML tiddlers.
+
+HTML tiddlers are sent in a feed as their text wrapped in a <pre>, so
+a feed reader shows their source. When 'atom.sanitize_html' is set True
+in config, tiddlers of an HTML_TYPES type are instead sent as HTML made
+safe by sanitize_html:
+
+    elements not in ELEMENTS are dropped, keeping their text, and
+    those in SKIPPED, such as script and style, are dropped with
+    their content
+
+    attributes not in ATTRIBUTES for their element are dropped, as
+    are URL attributes whose scheme is not in SCHEMES
+
+    comments, doctypes and processing instructions are dropped
+
+    text is escaped, unclosed elements are closed and close tags
+    with no open element are dropped
+
+The text is read once, from start to end, jumping from one '<' to the
+next, and nothing is looked at twice, so the cost grows with the length
+of the text and not with how it is nested or malformed. Texts longer
+than 'atom.sanitize_max_size' characters (default 65536) are not
+sanitized and are sent wrapped in a <pre> as before.
+
+bench/bench_sanitize.py compares the cost with that of the <pre>: the
+sanitizing itself takes 9.5 to 28 times as long as escaping, which is a
+small part of a feed of a short page but most of the cost for pages
+of tens of thousands of characters.
+"""
+
+import re
+
+from HTMLParser import HTMLParser
+
+
+HTML_TYPES = ('text/html', 'application/xhtml+xml')
+
+DEFAULT_MAX_SIZE = 65536
+
+ELEMENTS = frozenset([
+    'a', 'abbr', 'acronym', 'address', 'b', 'big', 'blockquote', 'br',
+    'caption', 'center', 'cite', 'code', 'col', 'colgroup', 'dd', 'del',
+    'dfn', 'div', 'dl', 'dt', 'em', 'figcaption', 'figure', 'h1', 'h2',
+    'h3', 'h4', 'h5', 'h6', 'hr', 'i', 'img', 'ins', 'kbd', 'li', 'mark',
+    'ol', 'p', 'pre', 'q', 's', 'samp', 'small', 'span', 'strike',
+    'strong', 'sub', 'sup', 'table', 'tbody', 'td', 'tfoot', 'th',
+    'thead', 'tr', 'tt', 'u', 'ul', 'var'])
+
+VOID_ELEMENTS = frozenset(['br', 'col', 'hr', 'img'])
+
+SKIPPED = frozenset(['applet', 'embed', 'frameset', 'head', 'iframe',
+    'math', 'noembed', 'noframes', 'noscript', 'object', 'script', 'style',
+    'svg', 'template', 'textarea', 'title', 'xmp'])
+
+COMMON_ATTRIBUTES = frozenset(['title', 'lang', 'dir'])
+
+ATTRIBUTES = {
+        'a': frozenset(['href', 'name']),
+        'blockquote': frozenset(['cite']),
+        'col': frozenset(['span']),
+        'colgroup': frozenset(['span']),
+        'del': frozenset(['cite', 'datetime']),
+        'img': frozenset(['src', 'alt', 'width', 'height']),
+        'ins': frozenset(['cite', 'datetime']),
+        'ol': frozenset(['start', 'type']),
+        'q': frozenset(['cite']),
+        'td': frozenset(['colspan', 'rowspan', 'align']),
+        'th': frozenset(['colspan', 'rowspan', 'align', 'scope']),
+}
+
+URL_ATTRIBUTES = frozenset(['href', 'src', 'cite'])
+
+SCHEMES = frozenset(['http', 'https', 'mailto', 'ftp'])
+
+# A tag, or the start of a comment, doctype or processing instruction.
+# Neither a tag nor a quoted value may hold a '<', so a tag that fails
+# to match is given up at the next '<' and no text is scanned twice.
+TOKEN = re.compile(r'<(?:(/?)([a-zA-Z][a-zA-Z0-9]*)'
+        r'((?:[^<>"\']|"[^<"]*"|\'[^<\']*\')*)>|!--|[!?])')
+ATTRIBUTE = re.compile(r'([^\s"\'<>/=]+)(?:\s*=\s*(?:"([^"]*)"|'
+        r'\'([^\']*)\'|([^\s"\'<>]+)))?')
+BARE_AMPERSAND = re.compile(
+        r'&(?!#[0-9]{1,7};|#[xX][0-9a-fA-F]{1,6};|[a-zA-Z][a-zA-Z0-9]{0,31};)')
+SCHEME = re.compile(r'^([^/?#]*):')
+UNSAFE_URL_CHARACTERS = re.compile(u'[\\s\x00-\x1f\x7f]+')
+
+# The same tags recur across tiddlers, so each distinct tag is worked
+# out once, up to TAGS_SIZE of them.
+TAGS = {}
+TAGS_SIZE = 4096
+
+_CLOSE_SKIPPED = {}
+
+_unescape = HTMLParser().unescape
+
+
+def sanitize_html(text, max_size=DEFAULT_MAX_SIZE):
+    """
+    Return text, HTML, with everything not allowed removed, or
+    None if text is longer than max_size.
+    """
+    if len(text) > max_size:
+        return None
+    output = []
+    append = output.append
+    search = TOKEN.search
+    tags = TAGS
+    open_elements = []
+    open_counts = {}
+    position = 0
+    while True:
+        match = search(text, position)
+        if match is None:
+            append(_escape_text(text[position:]))
+            break
+        start = match.start()
+        if start > position:
+            append(_escape_text(text[position:start]))
+        position = match.end()
+
+        tag = match.group(0)
+        if tag == '<!--':
+            end = text.find('-->', position)
+            if end == -1:
+                break
+            position = end + 3
+            continue
+        if len(tag) == 2:
+            end = text.find('>', position)
+            if end == -1:
+                break
+            position = end + 1
+            continue
+
+        try:
+            closing, name, markup = tags[tag]
+        except KeyError:
+            if len(tags) >= TAGS_SIZE:
+                tags.clear()
+            closing, name, markup = tags[tag] = _tag(*match.groups())
+
+        if closing:
+            if open_counts.get(name):
+                while True:
+                    element = open_elements.pop()
+                    open_counts[element] -= 1
+                    append(u'</%s>' % element)
+                    if element == name:
+                        break
+        elif markup:
+            append(markup)
+            if name not in VOID_ELEMENTS:
+                open_elements.append(name)
+                open_counts[name] = open_counts.get(name, 0) + 1
+        elif name in SKIPPED and not tag.endswith('/>'):
+            end = _skipped_end(name).search(text, position)
+            if end is None:
+                break
+            position = end.end()
+
+    while open_elements:
+        append(u'</%s>' % open_elements.pop())
+    return u''.join(output)
+
+
+def sanitizing(environ):
+    """
+    True if HTML tiddlers are to be sanitized rather than shown
+    as source.
+    """
+    return environ.get('tiddlyweb.config', {}).get('atom.sanitize_html',
+            False)
+
+
+def _tag(closing, name, attributes):
+    """
+    Return whether the tag closes, the lower case name of its
+    element and, for an allowed element, the opening tag to send.
+    """
+    name = name.lower()
+    if closing or name not in ELEMENTS:
+        return closing, name, None
+    return closing, name, u'<%s%s>' % (name, _attributes(name, attributes))
+
+
+def _attributes(name, attributes):
+    allowed = ATTRIBUTES.get(name, frozenset())
+    kept = []
+    seen = set()
+    if not attributes.strip():
+        return u''
+    for match in ATTRIBUTE.finditer(attributes):
+        attribute = match.group(1).lower()
+        if attribute in seen or not (attribute in allowed
+                or attribute in COMMON_ATTRIBUTES):
+            continue
+        seen.add(attribute)
+        value = match.group(2)
+        if value is None:
+            value = match.group(3)
+        if value is None:
+            value = match.group(4)
+        if value is None:
+            value = u''
+        if u'&' in value:
+            value = _unescape(value)
+        if attribute in URL_ATTRIBUTES and not _safe_url(value):
+            continue
+        kept.append(u' %s="%s"' % (attribute, _escape_attribute(value)))
+    return u''.join(kept)
+
+
+def _safe_url(url):
+    match = SCHEME.match(UNSAFE_URL_CHARACTERS.sub(u'', url))
+    return match is None or match.group(1).lower() in SCHEMES
+
+
+def _skipped_end(name):
+    try:
+        return _CLOSE_SKIPPED[name]
+    except KeyError:
+        pattern = _CLOSE_SKIPPED[name] = re.compile(
+                r'</%s\s*>' % name, re.I)
+        return pattern
+
+
+def _escape_text(text):
+    if u'&' in text:
+        text = BARE_AMPERSAND.sub(u'&amp;', text)
+    if u'<' in text:
+        text = text.replace(u'<', u'&lt;')
+    if u'>' in text:
+        text = text.replace(u'>', u'&gt;')
+    return text
+
+
+def _escape_attribute(value):
+    return (value.replace(u'&', u'&amp;').replace(u'"', u'&quot;')
+            .replace(u'<', u'&lt;').replace(u'>', u'&gt;'))
@@ -0,0 +1,293 @@
+"""
+Timing of the phases of making a feed.
+
+When 'atom.timing' is set True in config, each feed records how long
+was spent in each phase of its making, and counts of what was done:
+
+    filter     the default filter, since, paging and the recent index
+    validate   computing the ETag and Last-Modified
+    entries    making the entries, including render and revisions
+    render     rendering content, including render cache lookups
+    revisions  reading revisions and making diffs for depth feeds
+    write      writing the XML of a feed which is not streamed
+
+    entries, renders, cache_hits, summaries and store_gets
+
+Each stage of the default filter is measured too, after the loading
+of the collection as stage 0: the time spent in that stage alone, and
+how many entities went in and came out, so the stage which costs the
+most, or selects the least, can be seen. A stage is named for its
+filter, as 'select=tag:blog', and is sent in the Server-Timing header
+as 'stage1;desc="select=tag:blog 400/25";dur=1.2', and logged as
+'stage1=1.2ms:400/25'.
+
+The FeedTiming is kept in the environ as 'tiddlyweb.atom.timing', is
+sent as a Server-Timing header by the FeedTimer middleware, and is
+logged as one line at INFO when the response has been sent. For a
+streamed feed the header can only hold the phases done before the
+first byte is sent; the log line has them all.
+
+When 'atom.timing' is not set the serialization uses NO_TIMING, whose
+phases and counts do nothing.
+"""
+
+import logging
+import time
+
+from tiddlyweb.store import HOOKS
+
+
+TIMING_KEY = 'tiddlyweb.atom.timing'
+
+LOGGER = logging.getLogger(__name__)
+
+
+class FeedTiming(object):
+    """
+    Durations and counts for one feed.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.durations = {}
+        self.counts = {}
+        self.phases = []
+        self.stages = []
+
+    def phase(self, name):
+        """
+        A context manager adding the time spent in it to the
+        phase name.
+        """
+        if name not in self.durations:
+            self.durations[name] = 0.0
+            self.phases.append(name)
+        return _Phase(self, name)
+
+    def count(self, name, amount=1):
+        self.counts[name] = self.counts.get(name, 0) + amount
+
+    def total(self):
+        return time.time() - self.started
+
+    def server_timing(self):
+        """
+        The durations as the value of a Server-Timing header.
+        """
+        metrics = ['%s;dur=%.1f' % (name, self.durations[name] * 1000)
+                for name in self.phases]
+        metrics.extend('stage%s;desc="%s %s";dur=%.1f' % (index,
+            _quoted(name), selectivity, seconds * 1000) for index,
+            (name, seconds, selectivity) in enumerate(self.stage_report()))
+        return ', '.join(metrics)
+
+    def stage_report(self):
+        """
+        Return a list of the name, time spent in that stage alone
+        and entities in and out, as 'in/out', of each filter stage.
+        """
+        report = []
+        previous = None
+        for stage in self.stages:
+            seconds = stage.seconds
+            entities_in = '?'
+            if previous is not None:
+                seconds -= previous.seconds
+                entities_in = previous.count
+            report.append((stage.name, max(seconds, 0.0), '%s/%s'
+                % (entities_in, stage.count)))
+            previous = stage
+        return report
+
+    def log(self, environ):
+        """
+        Log the durations and counts as one line of key=value
+        pairs.
+        """
+        if not LOGGER.isEnabledFor(logging.INFO):
+            return
+        fields = ['uri=%s%s' % (environ.get('SCRIPT_NAME', ''),
+            environ.get('PATH_INFO', '')), 'total=%.1fms'
+            % (self.total() * 1000)]
+        fields.extend('%s=%.1fms' % (name, self.durations[name] * 1000)
+                for name in self.phases)
+        fields.extend('%s=%s' % (name, self.counts[name])
+                for name in sorted(self.counts))
+        fields.extend('stage%s=%.1fms:%s' % (index, seconds * 1000,
+            selectivity) for index, (_, seconds, selectivity)
+            in enumerate(self.stage_report()))
+        LOGGER.info('atom feed timing %s', ' '.join(fields))
+
+
+class FilterStage(object):
+    """
+    The time spent producing the entities of one filter stage,
+    including the stages before it, and how many it produced.
+    """
+
+    __slots__ = ('name', 'seconds', 'count')
+
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0.0
+        self.count = 0
+
+
+class _Phase(object):
+
+    __slots__ = ('timing', 'name', 'start')
+
+    def __init__(self, timing, name):
+        self.timing = timing
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.timing.durations[self.name] += time.time() - self.start
+        return False
+
+
+class _NoPhase(object):
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+class _NoTiming(object):
+    """
+    Stands in for FeedTiming when timing is off.
+    """
+
+    __slots__ = ()
+
+    _phase = _NoPhase()
+
+    def phase(self, name):
+        return self._phase
+
+    stages = None
+
+    def count(self, name, amount=1):
+        pass
+
+
+NO_TIMING = _NoTiming()
+
+
+def start_timing(environ):
+    """
+    Return a new FeedTiming, kept in environ, if timing is on,
+    otherwise NO_TIMING.
+    """
+    if not environ.get('tiddlyweb.config', {}).get('atom.timing', False):
+        return NO_TIMING
+    timing = environ[TIMING_KEY] = FeedTiming()
+    return timing
+
+
+def measured_filters(filters, entities, timing):
+    """
+    Return filters, as made by parse_for_filters, and entities
+    wrapped to measure each stage of filtering into timing.
+    """
+    stage = FilterStage('load')
+    timing.stages.append(stage)
+    entities = _measured(entities, stage)
+    measured = []
+    for function, spec, environ in filters:
+        stage = FilterStage('%s=%s' % spec)
+        timing.stages.append(stage)
+        measured.append((_measured_filter(function, stage), spec, environ))
+    return measured, entities
+
+
+def _measured_filter(function, stage):
+
+    def measured_filter(entities, indexable=False, environ=None):
+        # some filters do their work when called, not when iterated
+        started = time.time()
+        try:
+            return _measured(function(entities, indexable, environ), stage)
+        finally:
+            stage.seconds += time.time() - started
+
+    return measured_filter
+
+
+def _measured(entities, stage):
+    """
+    Yield entities, adding the time spent in each step to stage.
+    """
+    iterator = iter(entities)
+    while True:
+        started = time.time()
+        try:
+            entity = next(iterator)
+        except StopIteration:
+            stage.seconds += time.time() - started
+            return
+        stage.seconds += time.time() - started
+        stage.count += 1
+        yield entity
+
+
+class FeedTimer(object):
+    """
+    Send the timing of a feed as a Server-Timing header and log
+    it once the response has been sent.
+    """
+
+    def __init__(self, application):
+        self.application = application
+
+    def __call__(self, environ, start_response):
+
+        def timing_start_response(status, headers, exc_info=None):
+            timing = environ.get(TIMING_KEY)
+            if timing is not None:
+                headers.append(('Server-Timing', timing.server_timing()))
+            return start_response(status, headers, exc_info)
+
+        output = self.application(environ, timing_start_response)
+        if environ.get(TIMING_KEY) is None:
+            return output
+        return _logging_output(output, environ)
+
+
+def register_hooks():
+    """
+    Add the store HOOK which counts tiddler gets.
+    """
+    if _count_get not in HOOKS['tiddler']['get']:
+        HOOKS['tiddler']['get'].append(_count_get)
+
+
+def _count_get(store, tiddler):
+    timing = store.environ.get(TIMING_KEY)
+    if timing is not None:
+        timing.count('store_gets')
+
+
+def _quoted(text):
+    if isinstance(text, unicode):
+        text = text.encode('ascii', 'replace')
+    return text.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def _logging_output(output, environ):
+    try:
+        for chunk in output:
+            yield chunk
+    finally:
+        if hasattr(output, 'close'):
+            output.close()
+        environ[TIMING_KEY].log(environ)
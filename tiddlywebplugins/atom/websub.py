@@ -0,0 +1,260 @@
+"""
+Notify a WebSub hub when feeds change.
+
+Feeds advertise the hub set in 'atom.hub'. When 'atom.hub_publish' is
+also set True in config, a put or delete of a tiddler is sent to the
+hub, so subscribers are pushed changes rather than polling for them.
+
+The topics notified for a change are the feeds of 'atom.hub_topics'
+which may include the tiddler, judged as for hot feeds (see
+tiddlywebplugins.atom.hot):
+
+    'atom.hub_topics': ['/bags/news/tiddlers.atom',
+                        '/recipes/default/tiddlers.atom'],
+
+or, if it is not set, the feed of the tiddler's bag.
+
+Changes are gathered for each topic: the first change to a topic opens
+a window of 'atom.hub_window' seconds (default 2) and every change to
+it in that window is sent in one notification at its end. A burst of
+puts is one notification, and none is delayed by more than the window.
+
+Each notification is a fat ping: a POST to the hub, with hub.mode
+publish and hub.url the topic in the query string, of an Atom feed of
+the tiddlers changed in the window, as GUEST would see them. Deleted
+tiddlers are not in the feed. Tiddlers GUEST may not read are never
+sent, and a window of nothing but those sends no notification.
+
+Notifications are sent in order by one background thread from a queue
+of at most 'atom.hub_queue' (default 64). When the queue is full, as
+when the hub is down, a notification is dropped and logged, and the
+feed is left for subscribers to poll. A notification the hub refuses
+with a server error, or which can not reach it, is tried again up to
+'atom.hub_retries' times (default 3), waiting 'atom.hub_retry_delay'
+seconds (default 1), doubled each time, between tries. Other refusals
+are logged and not tried again.
+"""
+
+import logging
+import threading
+import time
+import urllib2
+
+from Queue import Queue, Full
+from urllib import urlencode
+
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.collections import Tiddlers
+from tiddlyweb.model.policy import PermissionsError
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.serializer import Serializer
+from tiddlyweb.store import HOOKS, Store, StoreError
+from tiddlyweb.web.util import encode_name, server_host_url
+
+from tiddlywebplugins.atom.hot import depends_on
+
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_WINDOW = 2
+DEFAULT_QUEUE = 64
+DEFAULT_RETRIES = 3
+DEFAULT_RETRY_DELAY = 1
+TIMEOUT = 10
+
+GUEST = {'name': u'GUEST', 'roles': []}
+
+PUBLISHERS = {}
+PUBLISHERS_LOCK = threading.Lock()
+
+
+class Publisher(object):
+    """
+    Gathers the changes to each topic and sends them to the hub
+    from a background thread.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.hub = config['atom.hub']
+        self.queue = Queue(int(config.get('atom.hub_queue', DEFAULT_QUEUE)))
+        self._pending = {}
+        self._timers = {}
+        self._lock = threading.Lock()
+        worker = threading.Thread(target=self._work)
+        worker.daemon = True
+        worker.start()
+
+    def changed(self, store, tiddler):
+        """
+        Add tiddler to the changes waiting for each of its topics,
+        opening a window for topics with none waiting.
+        """
+        window = float(self.config.get('atom.hub_window', DEFAULT_WINDOW))
+        for path in self.topics(store, tiddler.bag):
+            with self._lock:
+                self._pending.setdefault(path, set()).add(
+                        (tiddler.bag, tiddler.title))
+                if path in self._timers:
+                    continue
+                timer = self._timers[path] = threading.Timer(window,
+                        self._release, (path,))
+                timer.daemon = True
+            timer.start()
+
+    def topics(self, store, bag_name):
+        """
+        The paths of the feeds which may include tiddlers
+        of bag_name.
+        """
+        paths = self.config.get('atom.hub_topics')
+        if paths is None:
+            return ['%s/bags/%s/tiddlers.atom' % (
+                self.config.get('server_prefix', ''), encode_name(bag_name))]
+        return [path for path in paths
+                if depends_on(store, path, bag_name=bag_name)]
+
+    def flush(self):
+        """
+        Close every open window and wait until all notifications
+        have been sent.
+        """
+        with self._lock:
+            paths = self._timers.keys()
+        for path in paths:
+            self._release(path)
+        self.queue.join()
+
+    def publish(self, path, changes):
+        """
+        Send the hub a fat ping of changes, a set of bag and title
+        pairs, for the feed at path. Return True if the hub took it.
+        """
+        environ = {
+                'tiddlyweb.config': self.config,
+                'tiddlyweb.usersign': GUEST,
+                'REQUEST_METHOD': 'GET',
+                'SCRIPT_NAME': path,
+                'QUERY_STRING': '',
+                'HTTP_ACCEPT': 'application/atom+xml',
+        }
+        store = environ['tiddlyweb.store'] = Store(
+                self.config['server_store'][0],
+                self.config['server_store'][1], environ)
+        topic = server_host_url(environ) + path
+
+        tiddlers = Tiddlers(title=topic.decode('utf-8'), store=store)
+        readable = {}
+        for bag_name, title in sorted(changes):
+            if bag_name not in readable:
+                try:
+                    store.get(Bag(bag_name)).policy.allows(GUEST, 'read')
+                    readable[bag_name] = True
+                except (StoreError, PermissionsError):
+                    readable[bag_name] = False
+            if not readable[bag_name]:
+                continue
+            try:
+                tiddlers.add(store.get(Tiddler(title, bag_name)))
+            except StoreError:
+                continue
+        if not any(readable.values()):
+            return False
+
+        output = Serializer('tiddlywebplugins.atom.feed',
+                environ).list_tiddlers(tiddlers)
+        body = ''.join(output)
+        separator = '&' if '?' in self.hub else '?'
+        url = '%s%s%s' % (self.hub, separator, urlencode(
+            [('hub.mode', 'publish'), ('hub.url', topic)]))
+        headers = {
+                'Content-Type': 'application/atom+xml; charset=UTF-8',
+                'Link': '<%s>; rel="hub", <%s>; rel="self"' % (
+                    self.hub, topic),
+        }
+
+        retries = int(self.config.get('atom.hub_retries', DEFAULT_RETRIES))
+        delay = float(self.config.get('atom.hub_retry_delay',
+            DEFAULT_RETRY_DELAY))
+        for attempt in range(retries + 1):
+            try:
+                post(url, body, headers)
+                return True
+            except urllib2.HTTPError as exc:
+                if exc.code < 500 and exc.code != 429:
+                    LOGGER.warn('hub %s refused %s: %s', self.hub, topic,
+                            exc.code)
+                    return False
+                error = exc
+            except (urllib2.URLError, IOError) as exc:
+                error = exc
+            if attempt < retries:
+                time.sleep(delay)
+                delay *= 2
+        LOGGER.warn('unable to notify hub %s of %s after %s tries: %s',
+                self.hub, topic, retries + 1, error)
+        return False
+
+    def _release(self, path):
+        with self._lock:
+            timer = self._timers.pop(path, None)
+            changes = self._pending.pop(path, None)
+        if timer is not None:
+            timer.cancel()
+        if not changes:
+            return
+        try:
+            self.queue.put_nowait((path, changes))
+        except Full:
+            LOGGER.warn('hub queue full, dropping notification of %s', path)
+
+    def _work(self):
+        while True:
+            path, changes = self.queue.get()
+            try:
+                self.publish(path, changes)
+            except Exception as exc:
+                LOGGER.exception('unable to notify hub of %s: %s', path, exc)
+            finally:
+                self.queue.task_done()
+
+
+def get_publisher(config):
+    """
+    Return the publisher for the hub configured in config,
+    creating it on first use.
+    """
+    hub = config['atom.hub']
+    with PUBLISHERS_LOCK:
+        try:
+            return PUBLISHERS[hub]
+        except KeyError:
+            publisher = PUBLISHERS[hub] = Publisher(config)
+            return publisher
+
+
+def post(url, body, headers):
+    """
+    POST body to url, raising urllib2.HTTPError if it is refused.
+    """
+    response = urllib2.urlopen(urllib2.Request(url, body, headers),
+            timeout=TIMEOUT)
+    try:
+        response.read()
+    finally:
+        response.close()
+
+
+def register_hooks():
+    """
+    Add the store HOOKS that send changed tiddlers to the hub.
+    """
+    for method in ['put', 'delete']:
+        if _tiddler_changed not in HOOKS['tiddler'][method]:
+            HOOKS['tiddler'][method].append(_tiddler_changed)
+
+
+def _tiddler_changed(store, tiddler):
+    config = store.environ.get('tiddlyweb.config', {})
+    if config.get('atom.hub') and config.get('atom.hub_publish', False):
+        get_publisher(config).changed(store, tiddler)